@@ -1,16 +1,20 @@
 import os
-import csv
+import concurrent.futures
 import XPLMPlugin as plugin
 import XPLMPlanes as planes
 import XPLMUtilities as utils
 import XPLMDataAccess as data
 import XPLMMenus as menu
+import XPLMProcessing as proc
 import XPStandardWidgets as swidgets
 import XPWidgetDefs as dwidgets
 
 from os import path
 from XPPython3 import xp
 from mgwidget import MGWidget, MGButton, MGTextBox, get_screen_size
+from smapply import StateApplier, write_order
+from smformat import STATE_FORMAT_BINARY, STATE_EXTENSIONS, StateCache, write_state
+from smresolve import DrefResolver
 
 
 STATES_FOLDER_NAME = 'deck_states'
@@ -18,17 +22,15 @@ CONFIG_FILE_NAME = 'statemanager.csv'
 
 XPL_ROOT = utils.XPLMGetSystemPath()
 XPL_CONFIG_FILE = path.join(XPL_ROOT, CONFIG_FILE_NAME)
+DREF_CACHE_FILE = path.join(XPL_ROOT, 'Output', 'preferences', 'statemanager-drefs.json')
 
 MENU_STATE = 0 # Main plugin menu
 MENU_RELOAD = 1 # Menu item to start recording telemetry for a new flight
 MENU_SAVE = 2 # Save the current state
+MENU_CANCEL = 3 # Cancel loading a state
 
 MENU_STATE_BASE_REFCON = 100 # States shown in the menu will have refcon set no less than this value
 
-CSV_DELIMITER = ','
-CSV_QUOTE_CHAR = '"'
-ARRAY_SEPARATOR = ':'
-
 
 def _read_float_array(dref_id, dref_n):
     out = [0] * dref_n
@@ -51,106 +53,21 @@ def _read_byte_array(dref_id, dref_n):
     return out
 
 
-def _read_config_file(path):
-    """Read a config file and return its contents.
-
-    Return value:
-        A dictionary where keys are datarefs and values are lists `[type, length]`, where
-        the "type" is a string representnig the dataref type and "length" is an integer indicating
-        the length of the array. A length of 0 indicates a scalar dataref.
-    """
-    drefs = {}
-
-    if os.path.exists(path):
-        with open(path, newline='') as f:
-            f_csv = csv.reader(f, delimiter=CSV_DELIMITER, quotechar=CSV_QUOTE_CHAR)
-
-            for record in f_csv:
-                dref_name, dref_type = record
-                dref_length = 0 # non-array
-
-                if '[' in dref_type:
-                    dref_type, dref_length = dref_type.split('[')
-
-                    dref_type += '_array'
-                    dref_length = int(dref_length[:-1])
-
-                drefs[dref_name] = [dref_type, dref_length]
-
-    return drefs
-
-
-def _read_state_file(path, dref_db):
-    """Load and return a saved state.
-
-    Arguments:
-        path: The full path to the state file.
-        dref_db: The dataref database (see `_read_config_file()` for its format)
-
-    Return value:
-        A dictionary where keys are datarefs and values the dataref values.
-        Arrays are returned as tuples and each value is coerced to the correct type.
-    """
-    drefs = {}
-    dref_type_conversions = {
-        'int': int,
-        'float': float,
-        'double': float,
-        'byte_array': lambda x: bytes(map(int, x.split(ARRAY_SEPARATOR))),
-        'int_array': lambda x: tuple(map(int, x.split(ARRAY_SEPARATOR))),
-        'float_array': lambda x: tuple(map(float, x.split(ARRAY_SEPARATOR)))
-    }
-
-    with open(path, newline='') as f:
-        f_csv = csv.reader(f, delimiter=CSV_DELIMITER, quotechar=CSV_QUOTE_CHAR)
-
-        for record in f_csv:
-            try:
-                dref_name, dref_value = record
-
-                try:
-                    dref_type = dref_db[dref_name][0]
-                except KeyError:
-                    print('statemanager: Warning Invalid dataref %s. Skipping...' % dref_name)
-
-                    continue
-
-                drefs[dref_name] = dref_type_conversions[dref_type](dref_value)
-            except Exception:
-                print('statemanager: Error deserializing record %s' % record)
-
-                raise
-
-    return drefs
-
-
-def _write_state_file(path, drefs):
-    """Load and return a saved state.
-
-    Arguments:
-        path: The full path to the state file.
-        drefs: Datarefs in the same format as the one returned by `_read_state_file()`.
-    """
-    get_type = lambda x: type(x).__name__
-    records = []
-
-    for dref_name, dref_value in drefs.items():
-        dref_type = get_type(dref_value)
-
-        if dref_type in ('tuple', 'list'):
-            dref_type = get_type(dref_value[0])
-            dref_value = ARRAY_SEPARATOR.join(str(y) for y in dref_value)
-        else:
-            dref_value = str(dref_value)
-
-        records.append([dref_name, dref_value])
-
-    with open(path, 'w', newline='') as f:
-        f_csv = csv.writer(f, delimiter=CSV_DELIMITER, quotechar=CSV_QUOTE_CHAR)
-        f_csv.writerows(records)
-
-
 class PythonInterface:
+    APPLY_BUDGET = 0.002 # seconds - time spent reading and writing datarefs per frame while loading a state
+    STATE_FORMAT = STATE_FORMAT_BINARY # Format of the states saved (smformat.STATE_FORMAT_*); states in any format can be loaded
+    DREF_CACHE_ENABLED = True # Save resolved config datarefs to DREF_CACHE_FILE for the next sessions
+    STATE_CACHE_SIZE = 16 # Number of parsed states kept in memory
+    APPLY_ONLY_CHANGED = True # Only write the datarefs whose current value differs from the state
+    DIFF_TOLERANCE = {
+        'int': 0,
+        'float': 1e-5,
+        'double': 1e-9,
+        'int_array': 0,
+        'float_array': 1e-5,
+        'byte_array': 0
+    } # Differences ignored when comparing current values to a state, relative to values above 1
+
     DREF_READ = {
         'int': lambda x, _: data.XPLMGetDatai(x),
         'float': lambda x, _: data.XPLMGetDataf(x),
@@ -174,10 +91,21 @@ class PythonInterface:
         self.menu_id = None
         self.menu_item_reset_id = None
         self.menu_item_save_id = None
+        self.menu_item_cancel_id = None
         self.common_drefs = {} # Datarefs from the sim
         self.acf_drefs = {} # Aircraft-specific datarefs
+        self.drefs = {} # Datarefs from the sim and the aircraft, aircraft entries overriding sim ones
+        self.drefs_order = [] # Names of `drefs` in write order
+        self.state_cache = StateCache(self.STATE_CACHE_SIZE)
+        self.resolver = DrefResolver(
+            data.XPLMFindDataRef,
+            data.XPLMCanWriteDataRef,
+            DREF_CACHE_FILE if self.DREF_CACHE_ENABLED else None
+        )
+        self.preload_executor = None # Worker thread parsing the listed states
         self.win_save = None
         self.is_aircraft_loaded = False
+        self.applier = None # State being loaded
 
         # List of states shown in the menu.
         # The index is the refcon (- MENU_STATE_BASE_REFCON), the value is the label/file name
@@ -201,6 +129,9 @@ class PythonInterface:
         # Register menu
         self.menu_id = xp.createMenu("States", None, MENU_STATE, self._menu_clbk, [])
 
+        proc.XPLMRegisterFlightLoopCallback(self._apply_clbk, 0, None)
+        self.preload_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='statemanager-preload')
+
         # Initialize the plugin
         self.menu_state_entries.clear()
         self.reset_user_aircraft()
@@ -210,31 +141,22 @@ class PythonInterface:
         return 1
 
     def read_sim_config(self):
-        self.common_drefs = _read_config_file(XPL_CONFIG_FILE)
-
-        self.init_config_drefs(self.common_drefs)
-
-    def init_config_drefs(self, cfg):
-        """Enrich `cfg` by adding the dataref IDs and verify they are writable."""
-        to_discard = []
+        self.common_drefs = self.resolver.resolve(XPL_CONFIG_FILE)
 
-        for name, attrs in cfg.items():
-            dref_id = data.XPLMFindDataRef(name)
-
-            if not data.XPLMCanWriteDataRef(dref_id):
-                print('State manager: dataref %s is not writable. Discarding it...' % name)
-                to_discard.append(name)
-            else:
-                attrs.append(dref_id)
-
-        for x in to_discard:
-            del cfg[x]
+        self.update_drefs()
 
     def load_acf_config(self):
         print('Loading aircraft config file...')
-        self.acf_drefs = _read_config_file(self.aircraft_config_file)
+        self.acf_drefs = self.resolver.resolve(self.aircraft_config_file, self.acf_file_path)
+
+        self.update_drefs()
+
+    def update_drefs(self):
+        """Merge the sim and aircraft configs after either is loaded. Cached states are dropped as they were parsed against the previous configs."""
+        self.drefs = {**self.common_drefs, **self.acf_drefs}
+        self.drefs_order = write_order(self.drefs)
 
-        self.init_config_drefs(self.acf_drefs)
+        self.state_cache.clear()
 
     def add_menu_entries(self):
         if self.is_aircraft_loaded:
@@ -245,17 +167,36 @@ class PythonInterface:
                     self.show_state(s)
 
                 menu.XPLMAppendMenuSeparator(self.menu_id)
+                self.preload_states(states)
 
         self.menu_item_save_id = xp.appendMenuItem(self.menu_id, "Save current state", MENU_SAVE)
         self.menu_item_reset_id = xp.appendMenuItem(self.menu_id, "Reload state list", MENU_RELOAD)
+        self.menu_item_cancel_id = xp.appendMenuItem(self.menu_id, "Cancel state loading", MENU_CANCEL)
+
+        self.update_apply_menu()
 
     def show_state(self, state_name):
         xp.appendMenuItem(self.menu_id, state_name, MENU_STATE_BASE_REFCON + len(self.menu_state_entries))
 
         self.menu_state_entries.append(state_name)
 
+    def preload_states(self, states):
+        """Parse states in the background so that loading them from the menu does not read their file."""
+        if self.preload_executor:
+            paths = [self.get_aircraft_state_file(x) for x in states]
+
+            self.preload_executor.submit(self.state_cache.preload, paths, self.drefs)
+
     def get_aircraft_state_list(self):
-        return [x[:-4] for x in os.listdir(self.aircraft_state_folder) if x.endswith('.csv')]
+        states = {} # Ordered set of the names of the states saved in any format
+
+        for x in os.listdir(self.aircraft_state_folder):
+            state_name, ext = path.splitext(x)
+
+            if ext in STATE_EXTENSIONS.values():
+                states[state_name] = None
+
+        return list(states)
 
     def reset_menu_entries(self):
         menu.XPLMClearAllMenuItems(self.menu_id)
@@ -269,6 +210,8 @@ class PythonInterface:
             self.reset_menu_entries()
         elif item_id == MENU_SAVE:
             self.win_save.is_visible = True
+        elif item_id == MENU_CANCEL:
+            self.cancel_apply()
         elif item_id >= MENU_STATE_BASE_REFCON:
             state_idx = item_id - MENU_STATE_BASE_REFCON
             state_name = self.menu_state_entries[state_idx]
@@ -277,28 +220,38 @@ class PythonInterface:
             self.load_aircraft_state(state_name)
 
     def save_aircraft_state(self, state_name):
-        state_path = self.get_aircraft_state_file(state_name)
+        state_path = self.get_aircraft_state_file(state_name, self.STATE_FORMAT)
 
         state = {
             dref_name: self.read_dataref(dref_id, dref_type, dref_n)
-            for dref_name, (dref_type, dref_n, dref_id) in dict(**self.common_drefs, **self.acf_drefs).items()
+            for dref_name, (dref_type, dref_n, _, dref_id) in self.drefs.items()
         }
 
-        _write_state_file(state_path, state)
+        write_state(state_path, state, self.drefs)
 
     def XPluginDisable(self):
+        self.cancel_apply()
+        proc.XPLMUnregisterFlightLoopCallback(self._apply_clbk, None)
+        self.preload_executor.shutdown(wait=False)
+        self.preload_executor = None
+
         # Remove menu items
         menu.XPLMDestroyMenu(self.menu_id)
 
         self.menu_id = None
         self.menu_item_reset_id = None
         self.menu_item_save_id = None
+        self.menu_item_cancel_id = None
         self.common_drefs.clear()
         self.acf_drefs.clear()
+        self.drefs = {}
+        self.drefs_order = []
+        self.state_cache.clear()
         self.menu_state_entries.clear()
 
     def XPluginReceiveMessage(self, from_, message, param):
         if message == plugin.XPLM_MSG_PLANE_LOADED and param == planes.XPLM_USER_AIRCRAFT:
+            self.cancel_apply()
             self.reset_user_aircraft()
             self.reset_menu_entries()
 
@@ -324,21 +277,107 @@ class PythonInterface:
         self.DREF_WRITE[dref_type](dref_id, dref_value)
 
     def load_aircraft_state(self, state_name):
-        drefs = dict(**self.common_drefs, **self.acf_drefs)
         state_path = self.get_aircraft_state_file(state_name)
-        state = _read_state_file(state_path, drefs)
-        self.apply_state(state)
+        state = self.state_cache.get(state_path, self.drefs)
+        self.apply_state(state, state_name)
+
+    def get_aircraft_state_file(self, state_name, state_format=None):
+        """Return the path of a state file.
+
+        Arguments:
+            state_name: The name of the state
+            state_format: The format of the file, or None to find the file saved in any format,
+                `STATE_FORMAT` being preferred if the state is saved in several formats
+        """
+        formats = [state_format] if state_format else [self.STATE_FORMAT] + [x for x in STATE_EXTENSIONS if x != self.STATE_FORMAT]
+
+        for fmt in formats:
+            state_path = path.join(self.aircraft_state_folder, state_name + STATE_EXTENSIONS[fmt])
+
+            if path.exists(state_path) or state_format:
+                return state_path
+
+        return path.join(self.aircraft_state_folder, state_name + STATE_EXTENSIONS[self.STATE_FORMAT])
+
+    def apply_state(self, state, state_name=None):
+        """Start applying a state over the next flight loops (see `smapply.StateApplier`).
+
+        A state being loaded is cancelled first. Configured datarefs missing from the state are
+        left unchanged, and so are the ones already matching the state if APPLY_ONLY_CHANGED is set.
+
+        Return value:
+            The `StateApplier` of the state. Its `report()` lists the datarefs written.
+        """
+        self.cancel_apply()
+
+        drefs = self.drefs
+        entries = [
+            (drefs[x][2], x, drefs[x][0], drefs[x][3], drefs[x][1], state[x])
+            for x in self.drefs_order if x in state
+        ]
+
+        if len(entries) < len(drefs):
+            print('statemanager: Warning %d datarefs are missing from the state' % (len(drefs) - len(entries)))
+
+        self.applier = StateApplier(
+            entries,
+            self.DREF_READ,
+            self.DREF_WRITE,
+            self.APPLY_BUDGET,
+            self.DIFF_TOLERANCE if self.APPLY_ONLY_CHANGED else None,
+            self._apply_progress,
+            self._apply_done,
+            state_name
+        )
+
+        proc.XPLMSetFlightLoopCallbackInterval(self._apply_clbk, -1, 1, None)
+        self.update_apply_menu()
+
+        return self.applier
+
+    def cancel_apply(self):
+        if self.applier:
+            self.applier.cancel()
+
+    def _apply_clbk(self, since_last, elapsed_time, counter, refcon):
+        if self.applier and self.applier.step():
+            return -1 # Next frame
+
+        return 0
 
-    def get_aircraft_state_file(self, state_name):
-        state_filename = state_name + '.csv'
+    def _apply_progress(self, applier):
+        self.update_apply_menu()
 
-        return path.join(self.aircraft_state_folder, state_filename)
+    def _apply_done(self, applier):
+        report = applier.report()
 
-    def apply_state(self, state):
-        drefs = dict(**self.common_drefs, **self.acf_drefs)
+        if applier.cancelled:
+            print('Loading aircraft state "%s" cancelled after %d of %d datarefs' % (applier.name, applier.completed, applier.total))
+        else:
+            print('Aircraft state "%s" loaded: %d of %d datarefs written in %d frames' % (
+                applier.name, report['written'], report['total'], applier.frames
+            ))
+
+        if applier.failed:
+            print('statemanager: Warning %d datarefs could not be written' % len(applier.failed))
+
+        if applier is self.applier:
+            self.applier = None
+
+        self.update_apply_menu()
+
+    def update_apply_menu(self):
+        """Show the progress of the state being loaded in the cancel menu item, which is only enabled while loading."""
+        if self.menu_id is None or self.menu_item_cancel_id is None:
+            return
+
+        if self.applier:
+            name = 'Cancel state loading (%d%%)' % (self.applier.progress * 100)
+        else:
+            name = 'Cancel state loading'
 
-        for dref_name, (dref_type, dref_n, dref_id) in drefs.items():
-            self.write_dataref(dref_id, state[dref_name], dref_type)
+        menu.XPLMSetMenuItemName(self.menu_id, self.menu_item_cancel_id, name, 0)
+        menu.XPLMEnableMenuItem(self.menu_id, self.menu_item_cancel_id, int(bool(self.applier)))
 
     def create_windows(self):
         self.win_save = SaveStateWindow(self._save_state_clbk)
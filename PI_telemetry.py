@@ -1,7 +1,10 @@
 import math
 import time
 import os
+import csv
+import json
 import datetime as dt
+import concurrent.futures
 import XPLMPlugin as plugin
 import XPLMPlanes as planes
 import XPLMUtilities as utils
@@ -11,24 +14,55 @@ import XPLMMenus as menu
 
 from XPPython3 import xp
 from os import path
-
-
-DTYPE_INT = object()
-DTYPE_FLOAT = object()
-DTYPE_DOUBLE = object()
-DTYPE_INT_ARRAY = object()
-DTYPE_FLOAT_ARRAY = object()
-DTYPE_BYTES = object()
+from tlmwriter import POLICY_DROP_OLDEST
+from tlmbuffer import FrameBuffer
+from tlmframe import FrameReader
+from tlmsampling import SamplingProfile, OP_LT, OP_GT
+from tlmstats import TelemetryStats, STATS_KEYS
+from tlmpipeline import (
+    SINK_FILE, SINK_STREAM, SINK_RING, SINK_JOURNAL, SINK_METRICS, SINK_CLASSES,
+    transform_columns, compile_transforms
+)
+from tlmformat import (
+    TYPE_INT, TYPE_FLOAT, TYPE_DOUBLE, TYPE_INT_ARRAY, TYPE_FLOAT_ARRAY, TYPE_BYTE_ARRAY,
+    FORMAT_CSV, FORMAT_DELTA,
+    COMPRESSION_NONE
+)
+
+
+DTYPE_INT = TYPE_INT
+DTYPE_FLOAT = TYPE_FLOAT
+DTYPE_DOUBLE = TYPE_DOUBLE
+DTYPE_INT_ARRAY = TYPE_INT_ARRAY
+DTYPE_FLOAT_ARRAY = TYPE_FLOAT_ARRAY
+DTYPE_BYTES = TYPE_BYTE_ARRAY
 
 N_ENGINES = object()
 
+CONFIG_FILE_NAME = 'telemetry.csv'
+
 XPL_ROOT = utils.XPLMGetSystemPath()
+XPL_CONFIG_FILE = path.join(XPL_ROOT, CONFIG_FILE_NAME)
 XPL_FOLDER_OUTPUT = path.join(XPL_ROOT, 'Output')
 XPL_FOLDER_TELEMETRY = path.join(XPL_FOLDER_OUTPUT, 'telemetry')
 
+CSV_DELIMITER = ','
+CSV_QUOTE_CHAR = '"'
+CONFIG_ENGINES = 'engines' # Array length of per-engine datarefs in config files
+CONFIG_REMOVE = '-' # Dataref of an aircraft config record removing a column of the global config
+
 LABEL_GS = 'gs'
 LABEL_HEIGHT = 'height'
 
+STATS_EXTENSION = '.stats.jsonl' # Appended to the flight prefix
+STATS_DREF_PREFIX = 'moongoal/telemetry/stats/'
+
+INIT_IDLE = 'idle' # Not initialized, waiting for the next attempt
+INIT_LOADING = 'loading' # Reading the ACF file on the worker thread
+INIT_DONE = 'done' # Initialized for the user aircraft
+
+ACF_ICAO_PREFIX = b'P acf/_ICAO '
+
 MENU_TELEMETRY = 0 # Main plugin menu
 MENU_RESET = 1 # Menu item to start recording telemetry for a new flight
 
@@ -39,75 +73,209 @@ def m_to_ft(m):
 def ms_to_kts(ms):
     return ms * 1.943844
 
-def _read_float_array(dref_id, dref_n):
-    out = [0] * dref_n
+def abs_ms_to_kts(ms):
+    return abs(ms) * 1.943844
+
+def _read_float_array(dref_id, dref_n, out):
     data.XPLMGetDatavf(dref_id, out, 0, dref_n)
 
-    return ':'.join([str(x) for x in out])
+    return out
 
+def _read_int_array(dref_id, dref_n, out):
+    data.XPLMGetDatavi(dref_id, out, 0, dref_n)
 
-def _get_airplane_icao(acf_path):
-    with open(acf_path) as f:
-        for line in f:
-            line = line.strip()
+    return out
+
+def _read_byte_array(dref_id, dref_n, out):
+    data.XPLMGetDatab(dref_id, out, 0, dref_n)
+
+    return out
+
+
+def _read_config_file(file_path):
+    """Read a telemetry config file and return its records.
+
+    Each record is `dataref,type,label[,divisor[,deadband]]`, where the type is `int`, `float` or
+    `double`, or an array type such as `float[4]`. The array length `engines` is replaced with the
+    number of engines of the aircraft. Empty lines and lines starting with `#` are ignored.
+
+    Return value:
+        A list of records in the format of `PythonInterface.FRAME_CONTENTS`, in file order.
+        Records removing a column (see `CONFIG_REMOVE`) have a dataref of `CONFIG_REMOVE`.
+    """
+    contents = []
+
+    with open(file_path, newline='') as f:
+        f_csv = csv.reader(f, delimiter=CSV_DELIMITER, quotechar=CSV_QUOTE_CHAR)
+
+        for record in f_csv:
+            if not record or record[0].startswith('#'):
+                continue
+
+            try:
+                dref_name, dref_type, dref_label = [x.strip() for x in record[:3]]
+                divisor = int(record[3]) if len(record) > 3 else 1
+                deadband = float(record[4]) if len(record) > 4 else 0
+                dref_n = None
+
+                if divisor < 1:
+                    raise ValueError('Invalid sampling divisor', divisor)
+
+                if '[' in dref_type:
+                    dref_type, dref_n = dref_type.split('[')
+
+                    dref_type += '_array'
+                    dref_n = dref_n[:-1]
+                    dref_n = N_ENGINES if dref_n == CONFIG_ENGINES else int(dref_n)
+
+                if dref_name != CONFIG_REMOVE and dref_type not in PythonInterface.DREF_READ:
+                    print('telemetry: Warning Unsupported type %s of dataref %s. Skipping...' % (dref_type, dref_name))
+
+                    continue
+
+                contents.append((dref_name, dref_type, dref_label, dref_n, divisor, deadband))
+            except ValueError:
+                print('telemetry: Warning Invalid record %s in %s. Skipping...' % (record, file_path))
+
+    return contents
+
+
+def _merge_frame_contents(contents, overrides):
+    """Return `contents` with the records of `overrides` replacing, adding or removing columns by label."""
+    merged = {x[2]: x for x in contents}
+
+    for record in overrides:
+        if record[0] == CONFIG_REMOVE:
+            merged.pop(record[2], None)
+        else:
+            merged[record[2]] = record
+
+    return list(merged.values())
 
-            if line.startswith('P acf/_ICAO'):
-                rec_type, prop_name, prop_value = line.split(' ', 2)
 
-                return prop_value
+def _file_mtime(file_path):
+    return os.stat(file_path).st_mtime if path.exists(file_path) else None
+
+
+def _get_airplane_icao(acf_path):
+    """Return the ICAO code in an ACF file, reading it only up to the ICAO property."""
+    with open(acf_path, 'rb') as f:
+        for line in f:
+            if line.startswith(ACF_ICAO_PREFIX):
+                return line[len(ACF_ICAO_PREFIX):].strip().decode(errors='replace')
 
 
 class PythonInterface:
-    RECORD_INTERVAL = 5 # seconds - will be halved during t/o and ldg
-    MAX_BUF_SIZE = 128 # elements
+    RECORD_INTERVAL = 5 # seconds - used when no sampling phase is active
+    MAX_BUF_SIZE = 128 # frames
+    WRITER_QUEUE_SIZE = 16 # blocks of MAX_BUF_SIZE frames waiting to be written
+    WRITER_POLICY = POLICY_DROP_OLDEST # What to do when the writer thread can't keep up
+    WRITER_FSYNC = True # Sync the file to disk after each write
+    ROTATE_MAX_BYTES = 0 # Start a new segment after this many encoded bytes (0 to disable)
+    ROTATE_MAX_FRAMES = 0 # Start a new segment after this many frames (0 to disable)
+    ROTATE_MAX_SECONDS = 0 # Start a new segment after this many seconds of recording (0 to disable)
+    INDEX_INTERVAL = 512 # Frames between entries of the index sidecar (0 to disable)
+    OUTPUT_FORMAT = FORMAT_CSV # FORMAT_CSV, FORMAT_SPARSE_CSV, FORMAT_BINARY or FORMAT_DELTA
+    ENCODER_OPTIONS = {
+        FORMAT_DELTA: {
+            'deadbands': {} # Lossy deadbands by label, e.g. {'aoa': 0.05}
+        }
+    } # Additional encoder arguments by output format
+    COMPRESSION = COMPRESSION_NONE # COMPRESSION_NONE, COMPRESSION_GZIP, COMPRESSION_LZMA or COMPRESSION_BZ2
+    STREAM_ADDRESS = None # Stream frames live to this UDP (host, port) or Unix socket path (None to disable)
+    STREAM_MAX_RATE = 20 # Maximum number of frames streamed per second
+    STREAM_SCHEMA_INTERVAL = 5 # seconds - interval between repetitions of the stream schema
+    JOURNAL_ENABLED = False # Journal frames to <log>.journal, to recover the log if X-Plane dies (see tools/tlm-recover.py)
+    JOURNAL_MAX_FRAMES = 10 # Maximum number of frames lost if X-Plane dies (0 for no limit)
+    JOURNAL_MAX_SECONDS = 1 # seconds - maximum time span of the frames lost if X-Plane dies (0 for no limit)
+    JOURNAL_MAX_BYTES = 1048576 # bytes - rotate the journal from this size, dropping the frames flushed to the log (0 to disable)
+    JOURNAL_PREALLOCATE = 1048576 # bytes - write the journal through a memory map grown by this many bytes, which
+                                  # makes each block a memory copy on the sim thread (0 to write blocks with a system call)
+    JOURNAL_FSYNC = False # Sync the journal to disk after each block, to also survive a system crash.
+                          # The sync blocks the sim thread until the block is on disk, memory-mapped or not.
+    SUMMARY_ENABLED = True # Compute flight metrics while recording and write them to <log>.summary.json
+    SINKS = None # List of (sink type, options) receiving the frames, see tlmpipeline. None for a file
+                 # sink configured by the attributes above, plus a stream sink if STREAM_ADDRESS is set,
+                 # a journal sink if JOURNAL_ENABLED is set and a metrics sink if SUMMARY_ENABLED is set.
+                 # e.g. [(SINK_FILE, {}), (SINK_FILE, {'format': tlmformat.FORMAT_BINARY}), (SINK_RING, {'capacity': 600})]
+                 # File sinks after the first one get the suffix -1, -2... unless set in their options.
+    TRANSFORMS = [] # Frame transform stages applied in order to each frame, see tlmpipeline
+                    # e.g. [tlmpipeline.Derivative('vs', 'altitude', 196.85), tlmpipeline.Convert(LABEL_GS, abs_ms_to_kts, 'gs_kts')]
+    INIT_RETRY_MIN = 1 # seconds - delay before retrying a failed initialization, doubled on each failure
+    INIT_RETRY_MAX = 60 # seconds - maximum delay between initialization attempts
+    INIT_POLL_INTERVAL = 0.1 # seconds - flight loop interval while the ACF file is being read
+    STATS_ENABLED = False # Measure the recorder's own overhead (see tlmstats)
+    STATS_INTERVAL = 60 # seconds - window of the overhead histograms
+    STATS_FILE = True # Append the summary of each window to <flight>.stats.jsonl
+    STATS_DATAREFS = True # Publish the summary of the last window as moongoal/telemetry/stats/<metric>_<key> datarefs
 
     FRAME_CONTENTS = [
+        # (dataref, type, label, n_elements, sampling divisor [frames], deadband)
         # Flight model
-        ('sim/flightmodel/position/latitude', DTYPE_DOUBLE, 'latitude', None),
-        ('sim/flightmodel/position/longitude', DTYPE_DOUBLE, 'longitude', None),
-        ('sim/flightmodel/position/local_x', DTYPE_DOUBLE, 'local_x', None),
-        ('sim/flightmodel/position/local_y', DTYPE_DOUBLE, 'local_y', None),
-        ('sim/flightmodel/position/local_z', DTYPE_DOUBLE, 'local_z', None),
-        ('sim/flightmodel/position/elevation', DTYPE_DOUBLE, 'altitude', None),
-        ('sim/flightmodel/position/y_agl', DTYPE_FLOAT, LABEL_HEIGHT, None),
-        ('sim/flightmodel/position/groundspeed', DTYPE_FLOAT, LABEL_GS, None),
-        ('sim/flightmodel/position/indicated_airspeed', DTYPE_FLOAT, 'ias', None),
-        ('sim/flightmodel/position/true_psi', DTYPE_FLOAT, 'true_hdg', None),
-        ('sim/flightmodel/engine/ENGN_FF_', DTYPE_FLOAT_ARRAY, 'ff', N_ENGINES),
-        ('sim/flightmodel2/engines/throttle_used_ratio', DTYPE_FLOAT_ARRAY, 'true_throttle', N_ENGINES),
-        ('sim/flightmodel/weight/m_fuel_total', DTYPE_FLOAT, 'fuel', None),
-        ('sim/flightmodel/weight/m_total', DTYPE_FLOAT, 'weight', None),
-        ('sim/flightmodel2/engines/AoA_angle_degrees', DTYPE_FLOAT, 'aoa', None),
-        ('sim/flightmodel/position/theta', DTYPE_FLOAT, 'pitch', None),
-        ('sim/flightmodel/position/phi', DTYPE_FLOAT, 'roll', None),
-        ('sim/flightmodel/position/psi', DTYPE_FLOAT, 'yaw', None),
-        ('sim/flightmodel/position/true_theta', DTYPE_FLOAT, 'pitch_terr', None),
-        ('sim/flightmodel/position/true_phi', DTYPE_FLOAT, 'roll_terr', None),
-        ('sim/flightmodel/misc/machno', DTYPE_FLOAT, 'mach_no', None),
-        ('sim/flightmodel/controls/elv_trim', DTYPE_FLOAT, 'elev_trim', None),
-        ('sim/flightmodel/controls/flaprat', DTYPE_FLOAT, 'flap1_ratio', None),
-        ('sim/flightmodel/controls/flap2rat', DTYPE_FLOAT, 'flap2_ratio', None),
-        ('sim/flightmodel/controls/speedbrake_ratio', DTYPE_FLOAT, 'speed_brake', None),
+        ('sim/flightmodel/position/latitude', DTYPE_DOUBLE, 'latitude', None, 1, 0),
+        ('sim/flightmodel/position/longitude', DTYPE_DOUBLE, 'longitude', None, 1, 0),
+        ('sim/flightmodel/position/local_x', DTYPE_DOUBLE, 'local_x', None, 1, 0),
+        ('sim/flightmodel/position/local_y', DTYPE_DOUBLE, 'local_y', None, 1, 0),
+        ('sim/flightmodel/position/local_z', DTYPE_DOUBLE, 'local_z', None, 1, 0),
+        ('sim/flightmodel/position/elevation', DTYPE_DOUBLE, 'altitude', None, 1, 0),
+        ('sim/flightmodel/position/y_agl', DTYPE_FLOAT, LABEL_HEIGHT, None, 1, 0),
+        ('sim/flightmodel/failures/onground_any', DTYPE_INT, 'on_ground', None, 1, 0),
+        ('sim/flightmodel/position/groundspeed', DTYPE_FLOAT, LABEL_GS, None, 1, 0),
+        ('sim/flightmodel/position/indicated_airspeed', DTYPE_FLOAT, 'ias', None, 1, 0),
+        ('sim/flightmodel/position/true_psi', DTYPE_FLOAT, 'true_hdg', None, 1, 0),
+        ('sim/flightmodel/engine/ENGN_FF_', DTYPE_FLOAT_ARRAY, 'ff', N_ENGINES, 1, 0),
+        ('sim/flightmodel2/engines/throttle_used_ratio', DTYPE_FLOAT_ARRAY, 'true_throttle', N_ENGINES, 1, 0),
+        ('sim/flightmodel/weight/m_fuel_total', DTYPE_FLOAT, 'fuel', None, 5, 1),
+        ('sim/flightmodel/weight/m_total', DTYPE_FLOAT, 'weight', None, 5, 1),
+        ('sim/flightmodel2/engines/AoA_angle_degrees', DTYPE_FLOAT, 'aoa', None, 1, 0),
+        ('sim/flightmodel/position/theta', DTYPE_FLOAT, 'pitch', None, 1, 0),
+        ('sim/flightmodel/position/phi', DTYPE_FLOAT, 'roll', None, 1, 0),
+        ('sim/flightmodel/position/psi', DTYPE_FLOAT, 'yaw', None, 1, 0),
+        ('sim/flightmodel/position/true_theta', DTYPE_FLOAT, 'pitch_terr', None, 1, 0),
+        ('sim/flightmodel/position/true_phi', DTYPE_FLOAT, 'roll_terr', None, 1, 0),
+        ('sim/flightmodel/forces/g_nrml', DTYPE_FLOAT, 'g_nrml', None, 1, 0),
+        ('sim/flightmodel/misc/machno', DTYPE_FLOAT, 'mach_no', None, 1, 0),
+        ('sim/flightmodel/controls/elv_trim', DTYPE_FLOAT, 'elev_trim', None, 1, 0),
+        ('sim/flightmodel/controls/flaprat', DTYPE_FLOAT, 'flap1_ratio', None, 1, 0),
+        ('sim/flightmodel/controls/flap2rat', DTYPE_FLOAT, 'flap2_ratio', None, 1, 0),
+        ('sim/flightmodel/controls/speedbrake_ratio', DTYPE_FLOAT, 'speed_brake', None, 1, 0),
 
         # Weather
-        ('sim/weather/rain_percent', DTYPE_FLOAT, 'rain_percent', None),
-        ('sim/weather/thunderstorm_percent', DTYPE_FLOAT, 'thunderstorm_percent', None),
-        ('sim/weather/wind_turbulence_percent', DTYPE_FLOAT, 'wind_turbulence_percent', None),
-        ('sim/weather/wind_direction_degt', DTYPE_FLOAT, 'wind_direction', None),
-        ('sim/weather/wind_speed_kt', DTYPE_FLOAT, 'wind_speed', None),
-        ('sim/weather/barometer_current_inhg', DTYPE_FLOAT, 'pressure', None),
-        # ('sim/weather/runway_friction', DTYPE_INT, 'rwy_friction', None),
-        # ('sim/weather/runway_is_patchy', DTYPE_INT, 'rwy_patchy', None),
+        ('sim/weather/rain_percent', DTYPE_FLOAT, 'rain_percent', None, 10, 0.01),
+        ('sim/weather/thunderstorm_percent', DTYPE_FLOAT, 'thunderstorm_percent', None, 10, 0.01),
+        ('sim/weather/wind_turbulence_percent', DTYPE_FLOAT, 'wind_turbulence_percent', None, 10, 0.01),
+        ('sim/weather/wind_direction_degt', DTYPE_FLOAT, 'wind_direction', None, 10, 1),
+        ('sim/weather/wind_speed_kt', DTYPE_FLOAT, 'wind_speed', None, 10, 0.5),
+        ('sim/weather/barometer_current_inhg', DTYPE_FLOAT, 'pressure', None, 10, 0.001),
+        # ('sim/weather/runway_friction', DTYPE_INT, 'rwy_friction', None, 10, 0),
+        # ('sim/weather/runway_is_patchy', DTYPE_INT, 'rwy_patchy', None, 10, 0),
 
         # Aircraft configuration
-        ('sim/cockpit/switches/auto_brake_settings', DTYPE_INT, 'auto_brake', None),
-    ] # Set of datarefs making up each telemetry frame
+        ('sim/cockpit/switches/auto_brake_settings', DTYPE_INT, 'auto_brake', None, 10, 0),
+    ] # Default set of datarefs making up each telemetry frame, used when there is no global config file
+
+    SAMPLING_PROFILES = {
+        None: [
+            # (phase, interval [s], [(label, operator, threshold, hysteresis), ...])
+            ('touchdown', 0.05, [(LABEL_HEIGHT, OP_LT, 50, 20), (LABEL_GS, OP_GT, 25, 5)]),
+            ('terminal', 1, [(LABEL_HEIGHT, OP_LT, 2000, 200), (LABEL_GS, OP_GT, 25, 5)]),
+            ('cruise', 15, [(LABEL_HEIGHT, OP_GT, 10000, 500)]),
+            ('other', RECORD_INTERVAL, []),
+        ],
+    } # Sampling profiles by aircraft ICAO (None for the default profile), see tlmsampling
+
+    LABEL_CONVERSIONS = {
+        LABEL_HEIGHT: m_to_ft,
+        LABEL_GS: abs_ms_to_kts
+    } # Conversions of recorded values into the units used by sampling rules
 
     DREF_READ = {
         DTYPE_INT: data.XPLMGetDatai,
         DTYPE_FLOAT: data.XPLMGetDataf,
         DTYPE_DOUBLE: data.XPLMGetDatad,
-        DTYPE_FLOAT_ARRAY: _read_float_array
+        DTYPE_INT_ARRAY: _read_int_array,
+        DTYPE_FLOAT_ARRAY: _read_float_array,
+        DTYPE_BYTES: _read_byte_array
     } # dataref read dispatch table
 
     AIRCRAFT_ICAO_PLACEHOLDER = 'ZZZZ'
@@ -117,19 +285,36 @@ class PythonInterface:
         self.sig = "moongoal.telemetry"
         self.desc = "Aircraft telemetry recorder"
 
-        self.buffer = [] # Telemetry buffer
-        self.drefs = [] # Tuples of (dataref_id, type, n_elements) making up the telemetry frame
+        self.buffer = None # FrameBuffer holding the frames waiting to be written
+        self.drefs = [] # Tuples of (dataref_id, type, n_elements, divisor, deadband) making up the telemetry frame
+        self.reader = None # FrameReader compiled from `drefs`
         self.header = [] # List of strings that will make up the header of the file. Must be empty here.
+        self.columns = [] # Telemetry schema: tuples of (label, type, n_elements) matching `header`, then derived columns
+        self.transforms = [] # Compiled TRANSFORMS
         self.clean_file = True # True if the file was never written to
         self.num_engines = 8 # 8 is the max number of available engine slots
         self.aircraft_icao = self.AIRCRAFT_ICAO_PLACEHOLDER
         self.acf_file_path = None
-        self.telemetry_file_path = None
-        self.file = None
-        self.gs_index = None # Index of gs in frame data
-        self.h_index = None # Index of height in frame data
-        self.cur_gs = 0
-        self.cur_height = 0
+        self.frame_contents = [] # Records of the frame schema for the current aircraft (see FRAME_CONTENTS)
+        self.frame_config_key = None # Paths and modification times of the config files `frame_contents` was loaded from
+        self.dref_ids = {} # Resolved dataref IDs by name, for the aircraft `dref_ids_acf`
+        self.dref_ids_acf = None
+        self.init_state = INIT_IDLE
+        self.init_retry_delay = self.INIT_RETRY_MIN # Delay after the next failed initialization
+        self.init_retry_at = 0 # Monotonic time of the next initialization attempt
+        self.acf_executor = None # Worker thread reading ACF files
+        self.acf_pending = None # Tuple of ((acf path, mtime), future) of the ACF file being read
+        self.acf_metadata = {} # ICAO codes by (acf path, mtime)
+        self.telemetry_file_path = None # Path of the current flight without extension
+        self.sinks = [] # Sinks created from SINKS
+        self.frame_sinks = [] # Sinks receiving each frame
+        self.block_sinks = [] # Sinks receiving blocks of frames
+        self.is_recording = False # True if the sinks are open for the current flight
+        self.sampler = None # SamplingProfile for the current aircraft
+        self.frame_count = 0 # Number of frames recorded with the current schema
+        self.block_phases = set() # Sampling phases active while recording the frames in the buffer
+        self.stats = TelemetryStats(self.STATS_INTERVAL) if self.STATS_ENABLED else None
+        self.stats_drefs = [] # Handles of the registered stats datarefs
         self.menu_id = None
         self.menu_item_reset_id = None
 
@@ -142,12 +327,19 @@ class PythonInterface:
         pass
 
     def XPluginEnable(self):
+        self.acf_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='telemetry-acf')
+
         proc.XPLMRegisterFlightLoopCallback(self.flight_loop_clbk, self.RECORD_INTERVAL, None)
 
         # Register menu
         self.menu_id = xp.createMenu("Telemetry", None, MENU_TELEMETRY, self._menu_clbk, [])
         self.menu_item_reset_id = xp.appendMenuItem(self.menu_id, "Record new flight", MENU_RESET)
 
+        if self.stats and self.STATS_DATAREFS:
+            self.register_stats_drefs()
+
+        self.create_sinks()
+
         self.init_telemetry()
 
         return 1
@@ -160,33 +352,124 @@ class PythonInterface:
             self.init_telemetry()
 
     def init_telemetry(self):
-        """Initialize telemetry for a new plane."""
+        """Initialize telemetry for a new plane.
+
+        The ICAO code is read from the ACF file on the worker thread, unless it is already known for
+        this version of the file, and initialization completes in a later flight loop
+        (see `poll_init()`). Failed attempts are retried with an exponential backoff.
+        """
+        self.init_retry_delay = self.INIT_RETRY_MIN
+        self.start_init()
+
+    def start_init(self):
         try:
-            self.aircraft_icao, self.acf_file_path = self.get_user_aircraft()
+            acf_file_name, acf_path = planes.XPLMGetNthAircraftModel(planes.XPLM_USER_AIRCRAFT)
+
+            if not acf_file_name:
+                self.aircraft_icao, self.acf_file_path = self.AIRCRAFT_ICAO_PLACEHOLDER, acf_path
+                self.schedule_init_retry()
+
+                return
+
+            key = (acf_path, os.stat(acf_path).st_mtime)
 
-            if self.is_aircraft_loaded:
-                self.num_engines = data.XPLMGetDatai(
-                    data.XPLMFindDataRef('sim/aircraft/engine/acf_num_engines')
-                )
+            if key in self.acf_metadata:
+                self.finish_init(self.acf_metadata[key], acf_path)
 
-                self.init_drefs() # This must happen after num_engines is retrieved
-                self.open_output_file() # This must happen after init_drefs()
+                return
+
+            if not self.acf_pending or self.acf_pending[0] != key:
+                self.acf_pending = (key, self.acf_executor.submit(_get_airplane_icao, acf_path))
+
+            self.init_state = INIT_LOADING
         except Exception as exc:
-            # This can happen if the ACF file is still begin read during initialization.
-            # During the next flight model frame, a new attempt will be made
-            print('Error during telemetry initialisation - telemetry will be initialized as part of the next flight model frame')
-            print(exc)
+            self.init_failed(exc)
+
+    def poll_init(self):
+        """Complete initialization once the ACF file has been read, or start the next attempt when due."""
+        if self.init_state == INIT_LOADING:
+            key, future = self.acf_pending
+
+            if not future.done():
+                return
+
+            self.acf_pending = None
+
+            try:
+                icao = future.result()
+            except Exception as exc:
+                self.init_failed(exc)
+            else:
+                self.acf_metadata[key] = icao
+                self.finish_init(icao, key[0])
+        elif self.init_state == INIT_IDLE and time.monotonic() >= self.init_retry_at:
+            self.start_init()
+
+    def finish_init(self, icao, acf_path):
+        self.aircraft_icao, self.acf_file_path = icao, acf_path
+
+        try:
+            self.num_engines = data.XPLMGetDatai(
+                self.find_dataref('sim/aircraft/engine/acf_num_engines')
+            )
+
+            self.init_drefs() # This must happen after num_engines is retrieved
+            self.open_output_file() # This must happen after init_drefs()
+        except Exception as exc:
+            self.init_failed(exc)
+
+            return
+
+        self.init_state = INIT_DONE
+        self.init_retry_delay = self.INIT_RETRY_MIN
+
+    def init_failed(self, exc):
+        # This can happen if the ACF file is still begin read during initialization
+        print('Error during telemetry initialisation - retrying in %g seconds' % self.init_retry_delay)
+        print(exc)
+
+        self.schedule_init_retry()
+
+    def schedule_init_retry(self):
+        self.init_state = INIT_IDLE
+        self.init_retry_at = time.monotonic() + self.init_retry_delay
+        self.init_retry_delay = min(self.init_retry_delay * 2, self.INIT_RETRY_MAX)
+
+    @property
+    def init_interval(self):
+        """Interval until initialization needs the next flight loop call."""
+        if self.init_state == INIT_LOADING:
+            return self.INIT_POLL_INTERVAL
+
+        return max(self.INIT_POLL_INTERVAL, self.init_retry_at - time.monotonic())
 
     def XPluginDisable(self):
         proc.XPLMUnregisterFlightLoopCallback(self.flight_loop_clbk, None)
         self.close_output_file()
 
+        self.acf_executor.shutdown(wait=False)
+        self.acf_executor = None
+        self.acf_pending = None
+        self.init_state = INIT_IDLE
+
         # Remove menu items
         menu.XPLMDestroyMenu(self.menu_id)
 
         self.menu_id = None
         self.menu_item_reset_id = None
 
+        for handle in self.stats_drefs:
+            data.XPLMUnregisterDataAccessor(handle)
+
+        self.stats_drefs.clear()
+
+        for sink in self.sinks:
+            sink.release()
+
+        self.sinks.clear()
+        self.frame_sinks.clear()
+        self.block_sinks.clear()
+
     def XPluginReceiveMessage(self, from_, message, param):
         if message == plugin.XPLM_MSG_PLANE_LOADED and param == planes.XPLM_USER_AIRCRAFT:
             self.init_telemetry()
@@ -200,7 +483,7 @@ class PythonInterface:
             self.close_output_file(crash=True)
 
     def new_telemetry_file_path(self):
-        self.telemetry_file_path = path.join(XPL_FOLDER_TELEMETRY, '{icao}-{date}.csv'.format(
+        self.telemetry_file_path = path.join(XPL_FOLDER_TELEMETRY, '{icao}-{date}'.format(
             icao=self.aircraft_icao,
             date=dt.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
         ))
@@ -210,110 +493,332 @@ class PythonInterface:
         if not path.exists(XPL_FOLDER_TELEMETRY):
             os.makedirs(XPL_FOLDER_TELEMETRY, exist_ok=True)
 
-    def get_user_aircraft(self):
-        """Return the user aircraft's ICAO code and ACF file path."""
-        out_file, out_path = planes.XPLMGetNthAircraftModel(planes.XPLM_USER_AIRCRAFT)
-
-        acf_icao = _get_airplane_icao(out_path) if out_file else self.AIRCRAFT_ICAO_PLACEHOLDER
-
-        return acf_icao, out_path
-
     def flight_loop_clbk(self, since_last_call, since_last_fl, counter, _):
-        if not self.file:
-            self.init_telemetry()
-
-        self.record_frame()
-
-        # Compute new record interval
-        record_interval = self.RECORD_INTERVAL
-
-        if self.cur_gs > 25 and self.cur_height < 2000: # Increase resolution upon take-off/landing
-            record_interval = 1
+        stats = self.stats
+
+        if stats:
+            start = time.perf_counter()
+
+        if self.init_state != INIT_DONE:
+            self.poll_init()
+
+        interval = (self.record_frame() if self.is_recording else None) or self.RECORD_INTERVAL
+
+        if self.init_state != INIT_DONE:
+            interval = min(interval, self.init_interval)
+
+        if stats:
+            end = time.perf_counter()
+            stats.callback.add(end - start)
+
+            if stats.roll(end) and self.STATS_FILE:
+                self.write_stats()
+
+        return interval
+
+    def create_sinks(self):
+        """Create the sinks of SINKS, with defaults from the class attributes."""
+        defaults = {
+            SINK_FILE: {
+                'format': self.OUTPUT_FORMAT,
+                'encoder_options': self.ENCODER_OPTIONS,
+                'compression': self.COMPRESSION,
+                'fsync': self.WRITER_FSYNC,
+                'max_bytes': self.ROTATE_MAX_BYTES,
+                'max_frames': self.ROTATE_MAX_FRAMES,
+                'max_seconds': self.ROTATE_MAX_SECONDS,
+                'index_interval': self.INDEX_INTERVAL,
+                'queue_size': self.WRITER_QUEUE_SIZE,
+                'policy': self.WRITER_POLICY,
+                'stats': self.stats
+            },
+            SINK_STREAM: {
+                'address': self.STREAM_ADDRESS,
+                'max_rate': self.STREAM_MAX_RATE,
+                'schema_interval': self.STREAM_SCHEMA_INTERVAL
+            },
+            SINK_RING: {},
+            SINK_JOURNAL: {
+                'format': self.OUTPUT_FORMAT,
+                'encoder_options': self.ENCODER_OPTIONS,
+                'max_frames': self.JOURNAL_MAX_FRAMES,
+                'max_seconds': self.JOURNAL_MAX_SECONDS,
+                'max_bytes': self.JOURNAL_MAX_BYTES,
+                'preallocate': self.JOURNAL_PREALLOCATE,
+                'fsync': self.JOURNAL_FSYNC
+            },
+            SINK_METRICS: {}
+        }
+        config = self.SINKS
+
+        if config is None:
+            config = [(SINK_FILE, {})]
+
+            if self.STREAM_ADDRESS:
+                config.append((SINK_STREAM, {}))
+
+            if self.JOURNAL_ENABLED:
+                config.append((SINK_JOURNAL, {}))
+
+            if self.SUMMARY_ENABLED:
+                config.append((SINK_METRICS, {}))
+
+        n_files = 0
+
+        for sink_type, options in config:
+            if sink_type == SINK_FILE:
+                # Files and manifests of additional file sinks must not overwrite the ones of the first
+                defaults[SINK_FILE]['suffix'] = '-%d' % n_files if n_files else ''
+                n_files += 1
+            elif sink_type == SINK_JOURNAL:
+                defaults[SINK_JOURNAL]['file_sinks'] = [x for x in self.sinks if isinstance(x, SINK_CLASSES[SINK_FILE])]
+
+            try:
+                self.sinks.append(SINK_CLASSES[sink_type](**dict(defaults[sink_type], **options)))
+            except (KeyError, TypeError, OSError) as exc:
+                print('telemetry: Error creating %s sink. Ignoring it...' % sink_type)
+                print(exc)
+
+        self.frame_sinks = [x for x in self.sinks if x.wants_frames]
+        self.block_sinks = [x for x in self.sinks if x.wants_blocks]
+
+    def register_stats_drefs(self):
+        """Publish the summary of the last stats window as float datarefs."""
+        for metric in TelemetryStats.METRICS:
+            for key in STATS_KEYS:
+                self.stats_drefs.append(data.XPLMRegisterDataAccessor(
+                    STATS_DREF_PREFIX + '%s_%s' % (metric, key),
+                    data.xplmType_Float,
+                    0, # Read-only
+                    None, None,
+                    self._read_stat_dref, None,
+                    None, None,
+                    None, None,
+                    None, None,
+                    None, None,
+                    (metric, key), None
+                ))
+
+    def _read_stat_dref(self, refcon):
+        return float(self.stats.value(*refcon))
+
+    def write_stats(self):
+        """Append the summary of the last stats window to the stats file of the flight."""
+        if not self.telemetry_file_path:
+            return
 
-        return record_interval
+        try:
+            with open(self.telemetry_file_path + STATS_EXTENSION, 'a') as f:
+                print(json.dumps(dict(t=time.time(), interval=self.STATS_INTERVAL, **self.stats.snapshot)), file=f)
+        except OSError as exc:
+            print('telemetry: Error writing telemetry stats')
+            print(exc)
 
     def open_output_file(self):
         if self.aircraft_icao == self.AIRCRAFT_ICAO_PLACEHOLDER:
             return
 
-        if not self.clean_file or not self.file:
+        if not self.clean_file or not self.is_recording:
             self.new_telemetry_file_path()
 
-        if self.file:
-            self.file.close()
+        for sink in self.sinks:
+            sink.open(self.telemetry_file_path, self.columns, self.aircraft_icao) # Closes the previous flight
 
-        self.file = open(self.telemetry_file_path, 'w')
-
-        print(','.join(self.header), file=self.file)
+        self.is_recording = True
 
     def close_output_file(self, *, crash=False):
-        if self.file:
+        if self.is_recording:
             self.flush_buffer()
 
-            if crash:
-                print('CRASH', file=self.file)
+            for sink in self.sinks:
+                if crash:
+                    sink.crash()
+
+                sink.close() # Drains the writer queues before closing the files
 
-            self.file.close()
             self.clean_file = True
-            self.file = None
+            self.is_recording = False
+
+            if self.init_state == INIT_DONE:
+                # Start a new file on the next flight loop, unless an initialization is in progress
+                self.init_state = INIT_IDLE
+                self.init_retry_at = 0
 
     def record_frame(self):
-        """Record one telemetry frame."""
-        frame = self.get_frame()
+        """Record one telemetry frame and return the interval until the next one."""
+        buffer = self.buffer
+        slot = buffer.append()
+        stats = self.stats
+
+        if stats:
+            start = time.perf_counter()
+            self.get_frame(slot)
+            stats.frame.add(time.perf_counter() - start)
+        else:
+            self.get_frame(slot)
 
-        self.cur_height = m_to_ft(frame[self.h_index])
-        self.cur_gs = ms_to_kts(abs(frame[self.gs_index]))
+        keep = True
 
-        self.buffer.append(frame)
+        for apply in self.transforms:
+            if apply(buffer.columns, slot, (slot - 1) % buffer.capacity, self.frame_count == 1) is False:
+                keep = False
 
-        if len(self.buffer) >= self.MAX_BUF_SIZE:
+                break
+
+        record_interval = self.sampler.update(buffer)
+
+        if not keep:
+            buffer.discard_last()
+            self.frame_count = 0 # The next frame has no previous frame to hold values from
+
+            return record_interval
+
+        if self.sampler.phase:
+            self.block_phases.add(self.sampler.phase)
+
+        for sink in self.frame_sinks:
+            sink.frame(buffer.columns, slot)
+
+        if buffer.is_full:
             self.flush_buffer()
 
-    def get_frame(self):
-        return [time.time()] + [self.read_dataref(dref_id, dref_type, dref_n) for dref_id, dref_type, dref_n in self.drefs]
+        return record_interval
 
-    def read_dataref(self, dref_id, dref_type, dref_n):
-        params = [dref_id]
+    def get_frame(self, slot):
+        """Read one telemetry frame into `slot` of the frame buffer (see `tlmframe.FrameReader.read()`)."""
+        n = self.frame_count
+        self.frame_count = n + 1
 
-        if dref_n:
-            params.append(dref_n)
+        self.reader.read(slot, n, time.time())
 
-        return self.DREF_READ[dref_type](*params)
+    def compile_reader(self):
+        """Compile the frame reader for the current datarefs, timing each read when stats are enabled."""
+        self.reader = FrameReader(
+            self.buffer,
+            self.drefs,
+            self.DREF_READ,
+            timers=self.stats.reads if self.stats else None,
+            perf_counter=time.perf_counter
+        )
 
     def init_drefs(self):
+        if self.is_recording:
+            self.flush_buffer() # Pending frames belong to the previous schema
+
         self.drefs.clear()
         self.header.clear()
+        self.columns.clear()
 
         self.header.append('t')
+        self.columns.append(('t', DTYPE_DOUBLE, 0))
 
-        for dref_name, dref_type, dref_label, dref_n in self.FRAME_CONTENTS:
-            dref_id = data.XPLMFindDataRef(dref_name)
+        self.load_frame_contents()
+
+        for dref_name, dref_type, dref_label, dref_n, divisor, deadband in self.frame_contents:
+            dref_id = self.find_dataref(dref_name)
 
             if dref_n is N_ENGINES:
                 dref_n = self.num_engines
 
             if dref_id is not None:
-                self.drefs.append((dref_id, dref_type, dref_n))
+                self.drefs.append((dref_id, dref_type, dref_n, divisor, deadband))
                 self.header.append(dref_label)
+                self.columns.append((dref_label, dref_type, dref_n or 0))
+
+        self.columns[:] = transform_columns(self.TRANSFORMS, self.columns)
+        self.transforms = compile_transforms(self.TRANSFORMS, self.columns)
+        self.buffer = FrameBuffer(self.columns, self.MAX_BUF_SIZE)
+        self.frame_count = 0
+
+        if self.stats:
+            self.stats.set_columns(self.header[1:])
+
+        self.compile_reader()
+        self.sampler = SamplingProfile(
+            self.SAMPLING_PROFILES.get(self.aircraft_icao, self.SAMPLING_PROFILES[None]),
+            self.columns,
+            self.LABEL_CONVERSIONS
+        )
+
+    def load_frame_contents(self):
+        """Load the frame schema from the global and aircraft config files, unless they did not change.
+
+        The global config file replaces `FRAME_CONTENTS`, and the aircraft config file replaces,
+        adds or removes columns by label.
+        """
+        config_files = [XPL_CONFIG_FILE, self.aircraft_config_file]
+        key = [(x, _file_mtime(x)) for x in config_files]
+
+        if key == self.frame_config_key:
+            return
+
+        contents = self.FRAME_CONTENTS
+
+        try:
+            if key[0][1] is not None:
+                contents = _read_config_file(XPL_CONFIG_FILE)
+
+            if key[1][1] is not None:
+                print('telemetry: Loading aircraft config file %s...' % self.aircraft_config_file)
+                contents = _merge_frame_contents(contents, _read_config_file(self.aircraft_config_file))
+        except OSError as exc:
+            print('telemetry: Error reading config file. Using the default frame contents...')
+            print(exc)
+
+            contents = self.FRAME_CONTENTS
 
-                if dref_label == LABEL_GS:
-                    self.gs_index = len(self.drefs) - 1
-                elif dref_label == LABEL_HEIGHT:
-                    self.h_index = len(self.drefs) - 1
+        self.frame_contents = contents
+        self.frame_config_key = key
+
+    def find_dataref(self, dref_name):
+        """Return the ID of a dataref, or None if it does not exist.
+
+        IDs are cached for the current aircraft. Datarefs that are not found are not cached, since
+        aircraft plugins can register theirs after the aircraft is loaded.
+        """
+        if self.dref_ids_acf != self.acf_file_path:
+            self.dref_ids.clear()
+            self.dref_ids_acf = self.acf_file_path
+
+        dref_id = self.dref_ids.get(dref_name)
+
+        if dref_id is None:
+            dref_id = data.XPLMFindDataRef(dref_name)
+
+            if dref_id is not None:
+                self.dref_ids[dref_name] = dref_id
+
+        return dref_id
 
     def flush_buffer(self):
         if self.buffer:
-            for frame in self.buffer:
-                print(','.join([str(x) for x in frame]), file=self.file)
+            stats = self.stats
+
+            if stats:
+                start = time.perf_counter()
+
+            # Formatting and I/O happen on the writer threads
+            block = self.buffer.take()
+            phases = sorted(self.block_phases)
+
+            for sink in self.block_sinks:
+                sink.block(block, phases)
 
-            self.file.flush()
-            self.buffer.clear()
+            self.block_phases.clear()
             self.clean_file = False
 
+            if stats:
+                stats.flush.add(time.perf_counter() - start)
+
     @property
     def aircraft_folder(self):
         return path.dirname(self.acf_file_path)
 
+    @property
+    def aircraft_config_file(self):
+        """Aircraft specific config file"""
+        return path.join(self.aircraft_folder, CONFIG_FILE_NAME)
+
     @property
     def is_aircraft_loaded(self):
         return self.aircraft_icao != self.AIRCRAFT_ICAO_PLACEHOLDER
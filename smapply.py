@@ -0,0 +1,243 @@
+"""Incremental application of aircraft states.
+
+Writing a large state in one go freezes the sim, so a `StateApplier` spreads the work over
+flight loops: each call to `step()` reads and writes datarefs until a time budget is spent.
+Datarefs are ordered by the priority of their config entry and then by type, and each priority
+level starts in a new frame, so that the sim processes mode switches before the values that
+depend on them are written.
+
+Unless diffing is disabled, the datarefs of each priority level are first read and compared to
+the state, and only the ones that differ are written. Reading a level just before writing it
+takes the side effects of the previous levels into account.
+
+This module has no dependency on X-Plane; the read and write functions are passed in by the plugin.
+"""
+import time
+
+
+PRIORITY_DEFAULT = 0
+
+# Within a priority level, integer datarefs (mode switches, selectors) are written before the
+# values they enable
+TYPE_ORDER = {
+    'int': 0,
+    'int_array': 1,
+    'byte_array': 1,
+    'float': 2,
+    'double': 2,
+    'float_array': 2
+}
+
+PHASE_READ = 0
+PHASE_WRITE = 1
+
+
+def write_order(drefs):
+    """Return the names of the datarefs of a config in the order they are written.
+
+    Arguments:
+        drefs: Dictionary of `[type, length, priority, ...]` by dataref name, in config order
+    """
+    return sorted(drefs, key=lambda x: (drefs[x][2], TYPE_ORDER[drefs[x][0]]))
+
+
+def values_equal(current, target, tolerance):
+    """Return True if the current value of a dataref matches its target value.
+
+    Values match if they differ by at most `tolerance`, relative to the target value when its
+    magnitude is above 1. Arrays match if all of their elements match.
+    """
+    if isinstance(target, (tuple, list, bytes)):
+        return len(current) >= len(target) and all([
+            abs(x - y) <= tolerance * max(1, abs(y)) for x, y in zip(current, target)
+        ])
+
+    return abs(current - target) <= tolerance * max(1, abs(target))
+
+
+class StateApplier:
+    """Reads and writes of a state, spread over frames."""
+
+    def __init__(self, entries, read_functions, write_functions, budget, tolerances=None,
+                 on_progress=None, on_done=None, name=None, perf_counter=time.perf_counter):
+        """Prepare the state.
+
+        Arguments:
+            entries: List of `(priority, name, type, dataref ID, length, value)` in write order
+            read_functions: Dictionary of read functions `read(dataref ID, length)` by type
+            write_functions: Dictionary of write functions `write(dataref ID, value)` by type
+            budget: Time spent per frame (s). At least one dataref is read or written per frame.
+            tolerances: Dictionary of the tolerance of the comparison of current and target values
+                by type (see `values_equal()`), or None to write every dataref without reading it
+            on_progress: Called with the applier after each frame
+            on_done: Called with the applier once the state is applied or cancelled
+            name: The name of the state
+            perf_counter: Clock used for the budget
+        """
+        self.read_functions = read_functions
+        self.write_functions = write_functions
+        self.budget = budget
+        self.tolerances = tolerances
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.name = name
+        self.perf_counter = perf_counter
+        self.total = len(entries)
+        self.levels = [] # Lists of entries by priority level, in order
+        self.level = 0 # Index of the current level
+        self.phase = PHASE_READ if tolerances is not None else PHASE_WRITE
+        self.position = 0 # Index of the next entry of the current phase
+        self.pending = [] # Entries of the current level to write
+        self.completed = 0 # Number of entries found equal or written
+        self.frames = 0 # Number of frames spent
+        self.changed = [] # Tuples of (name, value before, value written)
+        self.failed = [] # Names of the datarefs whose read or write raised an exception
+        self.cancelled = False
+        self.notified = False # True once `on_done` was called
+
+        for entry in entries:
+            if not self.levels or self.levels[-1][0][0] != entry[0]:
+                self.levels.append([])
+
+            self.levels[-1].append(entry)
+
+        if self.levels and self.phase == PHASE_WRITE:
+            self.pending = [entry + (None,) for entry in self.levels[0]]
+
+    @property
+    def progress(self):
+        """Fraction of the datarefs done, between 0 and 1."""
+        return self.completed / self.total if self.total else 1
+
+    @property
+    def is_done(self):
+        return self.cancelled or self.level >= len(self.levels)
+
+    def step(self):
+        """Read and write datarefs for one frame and return True if work remains."""
+        if self.is_done:
+            # A state with no configured datarefs is done before its first step
+            self._finish()
+
+            return False
+
+        perf_counter = self.perf_counter
+        end_time = perf_counter() + self.budget
+
+        while True:
+            if self.phase == PHASE_READ:
+                level_done = self._read_next()
+            else:
+                level_done = self._write_next()
+
+            if level_done or self.is_done or perf_counter() >= end_time:
+                break
+
+        self.frames += 1
+
+        if self.on_progress:
+            self.on_progress(self)
+
+        if not self.is_done:
+            return True
+
+        self._finish()
+
+        return False
+
+    def _finish(self):
+        """Call `on_done` once."""
+        if not self.notified:
+            self.notified = True
+
+            if self.on_done:
+                self.on_done(self)
+
+    def _read_next(self):
+        """Compare the next dataref of the current level to the state, queuing it for writing if it differs.
+
+        Return False: a level with nothing to write is skipped without ending the frame.
+        """
+        level = self.levels[self.level]
+        entry = level[self.position]
+        _, name, dref_type, dref_id, dref_n, value = entry
+        self.position += 1
+
+        try:
+            current = self.read_functions[dref_type](dref_id, dref_n)
+        except Exception as exc:
+            print('statemanager: Error reading dataref %s: %s' % (name, exc))
+            current = None
+
+        if current is not None and values_equal(current, value, self.tolerances.get(dref_type, 0)):
+            self.completed += 1
+        else:
+            self.pending.append(entry + (current,))
+
+        if self.position < len(level):
+            return False
+
+        self.phase = PHASE_WRITE
+        self.position = 0
+
+        if not self.pending:
+            self._end_level()
+
+        return False
+
+    def _write_next(self):
+        """Write the next changed dataref of the current level, and return True at the end of the level."""
+        _, name, dref_type, dref_id, _, value, current = self.pending[self.position]
+        self.position += 1
+
+        try:
+            self.write_functions[dref_type](dref_id, value)
+            self.changed.append((name, current, value))
+        except Exception as exc:
+            print('statemanager: Error writing dataref %s: %s' % (name, exc))
+            self.failed.append(name)
+
+        self.completed += 1
+
+        if self.position < len(self.pending):
+            return False
+
+        self._end_level()
+
+        return True
+
+    def _end_level(self):
+        """Move on to the next priority level."""
+        self.level += 1
+        self.position = 0
+        self.pending = []
+
+        if self.tolerances is not None:
+            self.phase = PHASE_READ
+        elif self.level < len(self.levels):
+            self.pending = [entry + (None,) for entry in self.levels[self.level]]
+
+    def report(self):
+        """Return the differences between the sim and the state found so far.
+
+        Return value:
+            A dictionary with the name of the state, the number of datarefs in the state, found
+            equal and written, the list of `(name, value before, value written)` of the datarefs
+            written (the value before is None if diffing is disabled), the datarefs that could not
+            be written and whether loading was cancelled.
+        """
+        return {
+            'state': self.name,
+            'total': self.total,
+            'unchanged': self.completed - len(self.changed) - len(self.failed),
+            'written': len(self.changed),
+            'changed': self.changed,
+            'failed': self.failed,
+            'cancelled': self.cancelled
+        }
+
+    def cancel(self):
+        """Stop applying the state. Datarefs already written keep their new value."""
+        if not self.is_done:
+            self.cancelled = True
+            self._finish()
@@ -0,0 +1,371 @@
+"""State and config files of the state manager.
+
+States are saved either as CSV files of `dataref,value` records, or in a binary format which
+loads with little per-dataref work:
+
+    STATE_HEADER: magic, version, length of the name table, number of datarefs of each type of
+        `STATE_TYPES`, in that order
+    Name table: The names of the datarefs, grouped by type in the order of `STATE_TYPES`,
+        separated by newlines
+    Array lengths: One `uint32` per array dataref, in name table order
+    Values: One contiguous block per type in the order of `STATE_TYPES`, holding the values of
+        all the datarefs of the type, arrays being concatenated
+
+The position of a dataref in the name table is its index into the lengths and values. All
+numbers are little endian.
+
+Parsed states are kept in a `StateCache` so that loading a state from the menu does not read
+its file again unless it changed.
+
+This module has no dependency on X-Plane so that it can be used by offline tools.
+"""
+import os
+import csv
+import sys
+import struct
+import threading
+import collections
+
+from array import array
+from smapply import PRIORITY_DEFAULT
+
+
+CSV_DELIMITER = ','
+CSV_QUOTE_CHAR = '"'
+ARRAY_SEPARATOR = ':'
+
+STATE_FORMAT_CSV = 'csv'
+STATE_FORMAT_BINARY = 'binary'
+
+STATE_EXTENSIONS = {
+    STATE_FORMAT_CSV: '.csv',
+    STATE_FORMAT_BINARY: '.xst'
+}
+
+STATE_MAGIC = b'XPLSTATE'
+STATE_VERSION = 1
+STATE_TYPES = ['int', 'float', 'double', 'int_array', 'float_array', 'byte_array']
+STATE_HEADER = struct.Struct('<8sHI%dI' % len(STATE_TYPES)) # magic, version, name table length, counts by type
+
+ARRAY_TYPES = STATE_TYPES[3:]
+TYPECODES = {
+    'int': 'i',
+    'float': 'f',
+    'double': 'd',
+    'int_array': 'i',
+    'float_array': 'f',
+    'byte_array': 'B'
+}
+
+
+def read_config_file(path):
+    """Read a config file and return its contents.
+
+    Records are `dataref,type[,priority]`. Datarefs with a lower priority are written first
+    when a state is loaded (see `smapply.write_order()`).
+
+    Return value:
+        A dictionary where keys are datarefs and values are lists `[type, length, priority]`, where
+        the "type" is a string representnig the dataref type and "length" is an integer indicating
+        the length of the array. A length of 0 indicates a scalar dataref.
+    """
+    drefs = {}
+
+    if os.path.exists(path):
+        with open(path, newline='') as f:
+            f_csv = csv.reader(f, delimiter=CSV_DELIMITER, quotechar=CSV_QUOTE_CHAR)
+
+            for record in f_csv:
+                dref_name, dref_type, *priority = record
+                dref_length = 0 # non-array
+
+                if '[' in dref_type:
+                    dref_type, dref_length = dref_type.split('[')
+
+                    dref_type += '_array'
+                    dref_length = int(dref_length[:-1])
+
+                drefs[dref_name] = [dref_type, dref_length, int(priority[0]) if priority else PRIORITY_DEFAULT]
+
+    return drefs
+
+
+def read_state_csv(path, dref_db):
+    """Load and return a saved state.
+
+    Arguments:
+        path: The full path to the state file.
+        dref_db: The dataref database (see `read_config_file()` for its format)
+
+    Return value:
+        A dictionary where keys are datarefs and values the dataref values.
+        Arrays are returned as tuples and each value is coerced to the correct type.
+    """
+    drefs = {}
+    dref_type_conversions = {
+        'int': int,
+        'float': float,
+        'double': float,
+        'byte_array': lambda x: bytes(map(int, x.split(ARRAY_SEPARATOR))),
+        'int_array': lambda x: tuple(map(int, x.split(ARRAY_SEPARATOR))),
+        'float_array': lambda x: tuple(map(float, x.split(ARRAY_SEPARATOR)))
+    }
+
+    with open(path, newline='') as f:
+        f_csv = csv.reader(f, delimiter=CSV_DELIMITER, quotechar=CSV_QUOTE_CHAR)
+
+        for record in f_csv:
+            try:
+                dref_name, dref_value = record
+
+                try:
+                    dref_type = dref_db[dref_name][0]
+                except KeyError:
+                    print('statemanager: Warning Invalid dataref %s. Skipping...' % dref_name)
+
+                    continue
+
+                drefs[dref_name] = dref_type_conversions[dref_type](dref_value)
+            except Exception:
+                print('statemanager: Error deserializing record %s' % record)
+
+                raise
+
+    return drefs
+
+
+def write_state_csv(path, drefs):
+    """Save a state.
+
+    Arguments:
+        path: The full path to the state file.
+        drefs: Datarefs in the same format as the one returned by `read_state_csv()`.
+    """
+    get_type = lambda x: type(x).__name__
+    records = []
+
+    for dref_name, dref_value in drefs.items():
+        dref_type = get_type(dref_value)
+
+        if dref_type in ('tuple', 'list', 'bytes'):
+            dref_type = get_type(dref_value[0])
+            dref_value = ARRAY_SEPARATOR.join(str(y) for y in dref_value)
+        else:
+            dref_value = str(dref_value)
+
+        records.append([dref_name, dref_value])
+
+    with open(path, 'w', newline='') as f:
+        f_csv = csv.writer(f, delimiter=CSV_DELIMITER, quotechar=CSV_QUOTE_CHAR)
+        f_csv.writerows(records)
+
+
+def write_state_binary(path, drefs, dref_db):
+    """Save a state in the binary format.
+
+    Arguments:
+        path: The full path to the state file.
+        drefs: Datarefs in the same format as the one returned by `read_state_binary()`.
+        dref_db: The dataref database giving the type of each dataref (see `read_config_file()`)
+    """
+    groups = {x: [] for x in STATE_TYPES}
+
+    for dref_name in drefs:
+        try:
+            groups[dref_db[dref_name][0]].append(dref_name)
+        except KeyError:
+            print('statemanager: Warning Invalid dataref %s. Skipping...' % dref_name)
+
+    names = '\n'.join([x for dref_type in STATE_TYPES for x in groups[dref_type]]).encode()
+    lengths = array('I', [len(drefs[x]) for dref_type in ARRAY_TYPES for x in groups[dref_type]])
+    blocks = []
+
+    for dref_type in STATE_TYPES:
+        values = array(TYPECODES[dref_type])
+
+        if dref_type in ARRAY_TYPES:
+            for x in groups[dref_type]:
+                values.extend(drefs[x])
+        else:
+            values.extend([drefs[x] for x in groups[dref_type]])
+
+        blocks.append(values)
+
+    if sys.byteorder == 'big':
+        for values in [lengths] + blocks:
+            values.byteswap()
+
+    tmp_path = path + '.tmp'
+
+    with open(tmp_path, 'wb') as f:
+        f.write(STATE_HEADER.pack(STATE_MAGIC, STATE_VERSION, len(names), *[len(groups[x]) for x in STATE_TYPES]))
+        f.write(names)
+        f.write(lengths.tobytes())
+
+        for values in blocks:
+            f.write(values.tobytes())
+
+    os.replace(tmp_path, path)
+
+
+def read_state_binary(path, dref_db=None):
+    """Load and return a state saved in the binary format.
+
+    Arguments:
+        path: The full path to the state file.
+        dref_db: The dataref database, if given datarefs missing from it are skipped.
+
+    Return value:
+        A dictionary where keys are datarefs and values the dataref values, as returned by
+        `read_state_csv()`.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    magic, version, names_len, *counts = STATE_HEADER.unpack_from(data)
+
+    if magic != STATE_MAGIC:
+        raise ValueError('Not a binary state file', path)
+
+    if version > STATE_VERSION:
+        raise ValueError('Unsupported binary state version', version)
+
+    pos = STATE_HEADER.size
+    names = data[pos:pos + names_len].decode().split('\n') if names_len else []
+    pos += names_len
+
+    n_arrays = sum(counts[len(STATE_TYPES) - len(ARRAY_TYPES):])
+    lengths = array('I')
+    lengths.frombytes(data[pos:pos + n_arrays * lengths.itemsize])
+    pos += n_arrays * lengths.itemsize
+
+    if sys.byteorder == 'big':
+        lengths.byteswap()
+
+    drefs = {}
+    i = 0 # Index of the first name of the type
+    k = 0 # Index of the first array length of the type
+
+    for dref_type, count in zip(STATE_TYPES, counts):
+        values = array(TYPECODES[dref_type])
+        is_array = dref_type in ARRAY_TYPES
+        n_values = sum(lengths[k:k + count]) if is_array else count
+        size = n_values * values.itemsize
+
+        values.frombytes(data[pos:pos + size])
+        pos += size
+
+        if sys.byteorder == 'big':
+            values.byteswap()
+
+        if not is_array:
+            drefs.update(zip(names[i:i + count], values.tolist()))
+        else:
+            convert = bytes if dref_type == 'byte_array' else tuple
+            offset = 0
+
+            for name, n in zip(names[i:i + count], lengths[k:k + count]):
+                drefs[name] = convert(values[offset:offset + n])
+                offset += n
+
+            k += count
+
+        i += count
+
+    if dref_db is not None:
+        for dref_name in drefs.keys() - dref_db.keys():
+            print('statemanager: Warning Invalid dataref %s. Skipping...' % dref_name)
+
+            del drefs[dref_name]
+
+    return drefs
+
+
+def state_format(path):
+    """Return the format of a state file from its extension."""
+    for fmt, ext in STATE_EXTENSIONS.items():
+        if path.endswith(ext):
+            return fmt
+
+    return None
+
+
+def read_state(path, dref_db):
+    """Load a state file in any format (see `read_state_csv()`)."""
+    if state_format(path) == STATE_FORMAT_BINARY:
+        return read_state_binary(path, dref_db)
+
+    return read_state_csv(path, dref_db)
+
+
+def write_state(path, drefs, dref_db):
+    """Save a state file in the format given by its extension."""
+    if state_format(path) == STATE_FORMAT_BINARY:
+        write_state_binary(path, drefs, dref_db)
+    else:
+        write_state_csv(path, drefs)
+
+
+class StateCache:
+    """LRU cache of parsed states, keyed by path and modification time.
+
+    States are parsed against the dataref database current when they are read, so the cache
+    must be cleared when the configs are reloaded. It can be filled from a worker thread.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.states = collections.OrderedDict() # States by (path, mtime, size), least recently used first
+        self.generation = 0 # Incremented by `clear()`, so that states parsed before are not stored
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(path):
+        st = os.stat(path)
+
+        return path, st.st_mtime_ns, st.st_size
+
+    def get(self, path, dref_db):
+        """Return the state of a file, reading it if it is not cached or changed since it was read."""
+        key = self._key(path)
+
+        with self.lock:
+            state = self.states.get(key)
+
+            if state is not None:
+                self.states.move_to_end(key)
+
+                return state
+
+            generation = self.generation
+
+        state = read_state(path, dref_db)
+
+        with self.lock:
+            if generation == self.generation:
+                self._store(key, state)
+
+        return state
+
+    def preload(self, paths, dref_db):
+        """Read the states of `paths` that are not cached, up to the capacity of the cache."""
+        for path in paths[:self.max_entries]:
+            try:
+                self.get(path, dref_db)
+            except (OSError, ValueError) as exc:
+                print('statemanager: Warning Could not preload state %s: %s' % (path, exc))
+
+    def _store(self, key, state):
+        # A file that changed leaves its previous version behind
+        for old_key in [x for x in self.states if x[0] == key[0]]:
+            del self.states[old_key]
+
+        self.states[key] = state
+
+        while len(self.states) > self.max_entries:
+            self.states.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.states.clear()
+            self.generation += 1
@@ -0,0 +1,176 @@
+"""Resolution of the datarefs of state manager configs.
+
+Resolving a config looks up the ID of each of its datarefs and discards the ones that are not
+writable. A `DrefResolver` remembers the results so that loading a config again, on every
+aircraft load, state list reload or save, costs few lookups:
+
+- Dataref IDs are kept for the session, as they stay valid until the simulator exits.
+- The entries of each config and the datarefs found read-only are saved to a cache file, by
+  config path. A config whose modification time and size are unchanged is not parsed again,
+  and neither is one whose contents hash the same. Only entries that are new or whose type
+  changed are checked for writability; the verdicts of the others are reused, unless the config
+  is loaded for another aircraft.
+
+Datarefs that are not found are looked up again on every load, since plugins may register them
+later.
+
+This module has no dependency on X-Plane; the lookup functions are passed in by the plugin.
+"""
+import os
+import json
+import hashlib
+
+from smformat import read_config_file
+
+
+DREF_CACHE_VERSION = 1
+
+
+class DrefResolver:
+    """Resolves the datarefs of configs, remembering the results."""
+
+    def __init__(self, find, can_write, cache_path=None):
+        """Create a resolver.
+
+        Arguments:
+            find: Function returning the ID of a dataref given its name, or None if it does not exist
+            can_write: Function returning True if a dataref is writable given its ID
+            cache_path: The path of the file the results are saved to, or None to only keep them in memory
+        """
+        self.find = find
+        self.can_write = can_write
+        self.cache_path = cache_path
+        self.ids = {} # Dataref IDs by name
+        self.configs = {} # Cache records by config path
+        self.lookups = 0 # Number of calls to `find` and `can_write`
+
+        if cache_path:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            print('statemanager: Warning Ignoring dataref cache %s: %s' % (self.cache_path, exc))
+
+            return
+
+        if cache.get('version') == DREF_CACHE_VERSION:
+            self.configs = cache['configs']
+
+    def _save(self):
+        tmp_path = self.cache_path + '.tmp'
+
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': DREF_CACHE_VERSION, 'configs': self.configs}, f)
+
+            os.replace(tmp_path, self.cache_path)
+        except OSError as exc:
+            print('statemanager: Warning Could not save dataref cache %s: %s' % (self.cache_path, exc))
+
+    def _read_entries(self, config_path, record):
+        """Return the entries of a config and its stat and hash, parsing it only if it changed."""
+        st = os.stat(config_path)
+
+        if record and record['mtime_ns'] == st.st_mtime_ns and record['size'] == st.st_size:
+            return record['entries'], st, record['hash']
+
+        with open(config_path, 'rb') as f:
+            content_hash = hashlib.sha1(f.read()).hexdigest()
+
+        if record and record['hash'] == content_hash:
+            return record['entries'], st, content_hash
+
+        entries = read_config_file(config_path)
+
+        return entries, st, content_hash
+
+    def resolve(self, config_path, aircraft_path=None):
+        """Read a config and resolve its datarefs.
+
+        Arguments:
+            config_path: The path of the config (see `smformat.read_config_file()`)
+            aircraft_path: The path of the aircraft the config is loaded for, None for the sim config
+
+        Return value:
+            A dictionary of the writable datarefs of the config, where values are lists `[type,
+            length, priority, dataref ID]`.
+        """
+        if not os.path.exists(config_path):
+            return {}
+
+        record = self.configs.get(config_path)
+        entries, st, content_hash = self._read_entries(config_path, record)
+
+        if record and record['aircraft'] == aircraft_path:
+            known = record['entries']
+            read_only = set(record['read_only'])
+            missing = set(record['missing'])
+        else:
+            known = {}
+            read_only = set()
+            missing = set()
+
+        drefs = {}
+        new_read_only = []
+        new_missing = []
+
+        for name, attrs in entries.items():
+            # The writability of an unchanged entry found in a previous load is known
+            is_known = name in known and known[name][:2] == attrs[:2] and name not in missing
+
+            is_read_only = is_known and name in read_only
+            dref_id = None
+
+            if not is_read_only:
+                dref_id = self.ids.get(name)
+
+                if dref_id is None:
+                    dref_id = self.find(name)
+                    self.lookups += 1
+
+                if dref_id is not None:
+                    self.ids[name] = dref_id
+
+                    if not is_known:
+                        self.lookups += 1
+                        is_read_only = not self.can_write(dref_id)
+
+            if is_read_only or dref_id is None:
+                print('State manager: dataref %s is not writable. Discarding it...' % name)
+
+                if is_read_only:
+                    new_read_only.append(name)
+                else:
+                    new_missing.append(name)
+            else:
+                drefs[name] = list(attrs[:3]) + [dref_id]
+
+        new_record = {
+            'mtime_ns': st.st_mtime_ns,
+            'size': st.st_size,
+            'hash': content_hash,
+            'aircraft': aircraft_path,
+            'entries': entries,
+            'read_only': new_read_only,
+            'missing': new_missing
+        }
+
+        if new_record != record:
+            self.configs[config_path] = new_record
+
+            if self.cache_path:
+                self._save()
+
+        return drefs
+
+    def clear(self):
+        """Forget all the results, in memory only."""
+        self.ids.clear()
+        self.configs.clear()
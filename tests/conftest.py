@@ -0,0 +1,7 @@
+import sys
+
+from os import path
+
+
+# The modules of the repository are flat and not installed
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
@@ -0,0 +1,194 @@
+import sys
+import subprocess
+
+from os import path
+from array import array
+
+import pytest
+
+from smformat import (
+    STATE_MAGIC, STATE_FORMAT_CSV, STATE_FORMAT_BINARY, read_config_file, read_state_csv, write_state_csv,
+    read_state_binary, write_state_binary, read_state, write_state, state_format, StateCache
+)
+
+
+TOOLS_FOLDER = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'tools')
+
+CONFIG = """sim/cockpit/autopilot/autopilot_mode,int
+sim/cockpit/autopilot/heading_mag,float
+sim/flightmodel/position/latitude,double
+sim/cockpit2/switches/landing_lights_switch,int[3],1
+sim/cockpit2/switches/panel_brightness_ratio,float[2]
+sim/aircraft/view/acf_tailnum,byte[6]
+"""
+
+STATE = {
+    'sim/cockpit/autopilot/autopilot_mode': -2,
+    'sim/cockpit/autopilot/heading_mag': 271.5,
+    'sim/flightmodel/position/latitude': 47.46311234567891,
+    'sim/cockpit2/switches/landing_lights_switch': (1, 0, 1),
+    'sim/cockpit2/switches/panel_brightness_ratio': (0.25, 0.75),
+    'sim/aircraft/view/acf_tailnum': b'D-AIZZ'
+}
+
+
+@pytest.fixture
+def dref_db(tmp_path):
+    config_path = tmp_path / 'statemanager.csv'
+    config_path.write_text(CONFIG)
+
+    return read_config_file(str(config_path))
+
+
+def test_config(dref_db):
+    assert dref_db['sim/cockpit/autopilot/autopilot_mode'] == ['int', 0, 0]
+    assert dref_db['sim/cockpit2/switches/landing_lights_switch'] == ['int_array', 3, 1]
+    assert dref_db['sim/aircraft/view/acf_tailnum'][:2] == ['byte_array', 6]
+
+
+def test_binary_round_trip(tmp_path, dref_db):
+    file_path = str(tmp_path / 'state.xst')
+    write_state_binary(file_path, STATE, dref_db)
+
+    with open(file_path, 'rb') as f:
+        assert f.read(len(STATE_MAGIC)) == STATE_MAGIC
+
+    state = read_state_binary(file_path)
+
+    assert state == STATE
+    assert type(state['sim/cockpit2/switches/landing_lights_switch']) is tuple
+    assert not path.exists(file_path + '.tmp')
+
+
+def test_binary_float_precision(tmp_path, dref_db):
+    name = 'sim/cockpit/autopilot/heading_mag'
+    file_path = str(tmp_path / 'state.xst')
+    write_state_binary(file_path, {name: 0.1, 'sim/flightmodel/position/latitude': 0.1}, dref_db)
+    state = read_state_binary(file_path)
+
+    # Floats are stored in single precision, doubles in double precision
+    assert state[name] == array('f', [0.1])[0]
+    assert state['sim/flightmodel/position/latitude'] == 0.1
+
+
+def test_csv_binary_conversion(tmp_path, dref_db):
+    csv_path = str(tmp_path / 'state.csv')
+    binary_path = str(tmp_path / 'state.xst')
+    write_state_csv(csv_path, STATE)
+    write_state_binary(binary_path, read_state_csv(csv_path, dref_db), dref_db)
+
+    assert read_state_csv(csv_path, dref_db) == STATE
+    assert read_state_binary(binary_path) == STATE
+
+    write_state_csv(csv_path, read_state_binary(binary_path))
+
+    assert read_state_csv(csv_path, dref_db) == STATE
+
+
+def test_unknown_datarefs(tmp_path, dref_db):
+    file_path = str(tmp_path / 'state.xst')
+    write_state_binary(file_path, dict(STATE, **{'sim/unknown': 1}), dref_db)
+
+    assert read_state_binary(file_path) == STATE
+
+    # Datarefs no longer in the configs are skipped on load
+    del dref_db['sim/cockpit/autopilot/heading_mag']
+    state = read_state_binary(file_path, dref_db)
+
+    assert 'sim/cockpit/autopilot/heading_mag' not in state
+    assert len(state) == len(STATE) - 1
+
+
+def test_empty_state(tmp_path, dref_db):
+    file_path = str(tmp_path / 'state.xst')
+    write_state_binary(file_path, {}, dref_db)
+
+    assert read_state_binary(file_path) == {}
+
+
+def test_invalid_binary_state(tmp_path, dref_db):
+    file_path = tmp_path / 'state.xst'
+    file_path.write_bytes(b'XPLSTATX' + bytes(64))
+
+    with pytest.raises(ValueError):
+        read_state_binary(str(file_path))
+
+    write_state_binary(str(file_path), STATE, dref_db)
+    data = bytearray(file_path.read_bytes())
+    data[8] = 0xff # Version from the future
+    file_path.write_bytes(bytes(data))
+
+    with pytest.raises(ValueError):
+        read_state_binary(str(file_path))
+
+
+def test_format_by_extension(tmp_path, dref_db):
+    assert state_format('a/state.csv') == STATE_FORMAT_CSV
+    assert state_format('a/state.xst') == STATE_FORMAT_BINARY
+    assert state_format('a/state.txt') is None
+
+    for name in ('state.csv', 'state.xst'):
+        file_path = str(tmp_path / name)
+        write_state(file_path, STATE, dref_db)
+
+        assert read_state(file_path, dref_db) == STATE
+
+    with open(tmp_path / 'state.xst', 'rb') as f:
+        assert f.read(len(STATE_MAGIC)) == STATE_MAGIC
+
+
+def test_state_cache(tmp_path, dref_db):
+    cache = StateCache(2)
+    paths = [str(tmp_path / ('state-%d.xst' % i)) for i in range(3)]
+
+    for x in paths:
+        write_state_binary(x, STATE, dref_db)
+
+    state = cache.get(paths[0], dref_db)
+
+    assert cache.get(paths[0], dref_db) is state
+
+    # A file that changed is read again
+    write_state_binary(paths[0], {'sim/cockpit/autopilot/autopilot_mode': 1}, dref_db)
+
+    assert cache.get(paths[0], dref_db) == {'sim/cockpit/autopilot/autopilot_mode': 1}
+    assert len(cache.states) == 1
+
+    cache.preload(paths, dref_db)
+
+    # The least recently used state is evicted
+    assert [x[0] for x in cache.states] == paths[:2]
+
+    cache.get(paths[2], dref_db)
+
+    assert [x[0] for x in cache.states] == paths[1:]
+
+    cache.clear()
+
+    assert not cache.states and cache.generation == 1
+
+
+def run_tool(*args):
+    return subprocess.run(
+        [sys.executable, path.join(TOOLS_FOLDER, 'sm-convert.py')] + [str(x) for x in args],
+        capture_output=True, text=True, check=True
+    ).stdout
+
+
+def test_convert_tool(tmp_path, dref_db):
+    config_path = tmp_path / 'statemanager.csv'
+    out_folder = tmp_path / 'out'
+    out_folder.mkdir()
+    write_state_csv(str(tmp_path / 'state.csv'), STATE)
+
+    assert 'requires a config' in run_tool(tmp_path / 'state.csv')
+    assert not (tmp_path / 'state.xst').exists()
+
+    run_tool(tmp_path / 'state.csv', '-c', config_path)
+
+    assert read_state_binary(str(tmp_path / 'state.xst')) == STATE
+
+    run_tool(tmp_path / 'state.xst', '-o', out_folder)
+
+    assert read_state_csv(str(out_folder / 'state.csv'), dref_db) == STATE
+    assert 'unknown state format' in run_tool(config_path.with_suffix('.txt'))
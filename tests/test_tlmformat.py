@@ -0,0 +1,249 @@
+import io
+import sys
+import math
+import random
+import subprocess
+
+import pytest
+
+from os import path
+from tlmformat import (
+    TYPE_INT, TYPE_FLOAT, TYPE_DOUBLE, TYPE_FLOAT_ARRAY, TYPE_BYTE_ARRAY, FORMAT_CSV, FORMAT_BINARY, CRASH_TIME,
+    CRASH_MARKER, BinaryReader, BinaryEncoder, CsvEncoder, CsvReader, SparseCsvEncoder, DeltaEncoder, binary_to_csv,
+    sparse_to_csv, open_reader, split_log_path
+)
+
+
+NAN = float('nan')
+
+COLUMNS = [('t', TYPE_DOUBLE, 0), ('height', TYPE_DOUBLE, 0), ('gear', TYPE_INT, 0), ('ff', TYPE_FLOAT_ARRAY, 2)]
+
+
+def same_rows(a, b):
+    """Compare lists of flat records, NaN being equal to NaN."""
+    return len(a) == len(b) and all(
+        len(x) == len(y) and all(u == v or (math.isnan(u) and math.isnan(v)) for u, v in zip(x, y))
+        for x, y in zip(a, b)
+    )
+
+
+ROWS = [
+    (0.0, 10.0, 0, 0.5, 0.25),
+    (0.05, 10.5, 0, 0.5, 0.25),
+    (0.1, 10.5, 1, 0.75, 0.25),
+    (0.15, -3.0, 1, 0.75, 0.0)
+]
+
+TOOLS_FOLDER = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'tools')
+
+
+def read_binary(data):
+    return list(BinaryReader(io.BytesIO(data)).records())
+
+
+def write_log(file_path, encoder, rows, crashed=False):
+    with open(file_path, 'wb') as f:
+        f.write(encoder.header())
+        f.write(encoder.encode_rows(rows))
+
+        if crashed:
+            f.write(encoder.crash_marker())
+
+
+def test_binary_round_trip():
+    encoder = BinaryEncoder(COLUMNS, 'A320')
+    data = encoder.header() + encoder.encode_rows(ROWS)
+    reader = BinaryReader(io.BytesIO(data))
+
+    assert reader.icao == 'A320'
+    assert reader.columns == COLUMNS
+    assert reader.data_offset % 8 == 0
+    assert len(data) == reader.data_offset + len(ROWS) * reader.record_size
+    assert list(reader.records()) == ROWS
+
+
+def test_binary_unflattens_arrays():
+    encoder = BinaryEncoder(COLUMNS, 'A320')
+    reader = BinaryReader(io.BytesIO(encoder.header() + encoder.encode_rows(ROWS[:1])))
+
+    assert list(reader) == [[0.0, 10.0, 0, [0.5, 0.25]]]
+
+
+def test_binary_types():
+    columns = [('t', TYPE_DOUBLE, 0), ('x', TYPE_FLOAT, 0), ('b', TYPE_BYTE_ARRAY, 3)]
+    rows = [(1.0, 0.1, 1, 2, 255)]
+    encoder = BinaryEncoder(columns, None)
+    record, = read_binary(encoder.header() + encoder.encode_rows(rows))
+
+    assert record[0] == 1.0
+    assert record[1] == pytest.approx(0.1, rel=1e-7) # Single precision
+    assert record[2:] == (1, 2, 255)
+
+
+def test_binary_crash_marker():
+    encoder = BinaryEncoder(COLUMNS, 'A320')
+    records = read_binary(encoder.header() + encoder.encode_rows(ROWS) + encoder.crash_marker())
+
+    assert records[:-1] == ROWS
+    assert records[-1][0] == CRASH_TIME
+
+
+def test_binary_truncated_record():
+    encoder = BinaryEncoder(COLUMNS, 'A320')
+    data = encoder.header() + encoder.encode_rows(ROWS)
+
+    assert read_binary(data[:-1]) == ROWS[:-1]
+
+
+def test_binary_bad_magic():
+    with pytest.raises(ValueError):
+        BinaryReader(io.BytesIO(b'x' * 64))
+
+
+def test_binary_to_csv():
+    binary = BinaryEncoder(COLUMNS, 'A320')
+    csv = CsvEncoder(COLUMNS, 'A320')
+    dst = io.StringIO()
+
+    binary_to_csv(io.BytesIO(binary.header() + binary.encode_rows(ROWS) + binary.crash_marker()), dst)
+
+    assert dst.getvalue() == (csv.header() + csv.encode_rows(ROWS)).decode() + CRASH_MARKER + '\n'
+
+
+def test_open_reader(tmp_path):
+    for fmt, encoder in [(FORMAT_CSV, CsvEncoder), (FORMAT_BINARY, BinaryEncoder)]:
+        file_path = str(tmp_path / ('flight.' + {FORMAT_CSV: 'csv', FORMAT_BINARY: 'tlm'}[fmt]))
+        write_log(file_path, encoder(COLUMNS, 'A320'), ROWS)
+        reader = open_reader(file_path)
+
+        try:
+            assert [label for label, _, _ in reader.columns] == ['t', 'height', 'gear', 'ff']
+            assert list(reader.records()) == [tuple(float(x) for x in row) for row in ROWS]
+        finally:
+            reader.close()
+
+
+def test_split_log_path():
+    assert split_log_path('a/flight.tlm') == ('a/flight', FORMAT_BINARY, None)
+    assert split_log_path('a/flight.tlm.gz') == ('a/flight', FORMAT_BINARY, 'gzip')
+    assert split_log_path('a/flight.txt') == ('a/flight.txt', None, None)
+
+
+def run_tool(*args):
+    return subprocess.run(
+        [sys.executable, path.join(TOOLS_FOLDER, 'tlm-to-csv.py')] + [str(x) for x in args],
+        capture_output=True, text=True, check=True
+    )
+
+
+def test_tlm_to_csv(tmp_path):
+    write_log(str(tmp_path / 'flight.tlm'), BinaryEncoder(COLUMNS, 'A320'), ROWS)
+    run_tool(tmp_path / 'flight.tlm')
+    csv = CsvEncoder(COLUMNS, 'A320')
+
+    assert (tmp_path / 'flight.csv').read_bytes() == csv.header() + csv.encode_rows(ROWS)
+
+
+def test_tlm_to_csv_unknown_format(tmp_path):
+    (tmp_path / 'flight.txt').write_text('')
+    (tmp_path / 'flight.csv').write_text('kept')
+
+    assert 'unknown format' in run_tool(tmp_path / 'flight.txt').stdout
+    assert (tmp_path / 'flight.csv').read_text() == 'kept'
+
+
+def test_delta_nan_round_trip():
+    rows = [
+        (0.0, 1.0, 0, 0.5, 0.5),
+        (1.0, NAN, 0, 0.5, NAN),
+        (2.0, NAN, 1, 0.5, NAN),
+        (3.0, 2.0, 1, 0.5, 0.25),
+        (4.0, 2.0, 1, NAN, 0.25)
+    ]
+    encoder = DeltaEncoder(COLUMNS, 'A320', deadbands={'height': 0.5})
+
+    assert same_rows(read_binary(encoder.header() + encoder.encode_rows(rows)), rows)
+
+
+def test_sparse_csv_leaves_unchanged_fields_empty():
+    lines = SparseCsvEncoder(COLUMNS, 'A320').encode_rows(ROWS[:3]).decode().splitlines()
+
+    assert lines == ['0.0,10.0,0,0.5:0.25', '0.05,10.5,,', '0.1,,1,0.75:0.25']
+
+
+def test_sparse_csv_round_trip():
+    sparse = SparseCsvEncoder(COLUMNS, 'A320')
+    csv = CsvEncoder(COLUMNS, 'A320')
+    # Each block starts with a full frame
+    data = sparse.header() + sparse.encode_rows(ROWS[:2]) + sparse.encode_rows(ROWS[2:]) + sparse.crash_marker()
+    reader = CsvReader(io.BytesIO(data), sparse=True)
+    dst = io.StringIO()
+
+    sparse_to_csv(io.StringIO(data.decode()), dst)
+
+    assert list(reader.records())[:-1] == [tuple(float(x) for x in row) for row in ROWS]
+    assert dst.getvalue() == (csv.header() + csv.encode_rows(ROWS)).decode() + CRASH_MARKER + '\n'
+
+
+def test_sparse_csv_block_starts_in_full():
+    lines = SparseCsvEncoder(COLUMNS, 'A320').encode_rows(ROWS[1:2]).decode().splitlines()
+
+    assert lines == ['0.05,10.5,0,0.5:0.25']
+
+
+def test_delta_round_trip():
+    encoder = DeltaEncoder(COLUMNS, 'A320')
+    data = encoder.header() + encoder.encode_rows(ROWS[:2]) + encoder.encode_rows(ROWS[2:])
+
+    assert read_binary(data) == ROWS
+
+
+def test_delta_is_lossless_on_wide_records():
+    # More than 8 flat columns need a mask of several bytes
+    columns = [('t', TYPE_DOUBLE, 0), ('n', TYPE_INT, 0), ('v', TYPE_FLOAT_ARRAY, 12)]
+    rng = random.Random(1)
+    rows = []
+    row = [0.0, 0] + [0.0] * 12
+
+    for i in range(200):
+        row = list(row)
+        row[0] = i * 0.05
+        row[1] += rng.choice([0, 0, 1])
+
+        for j in rng.sample(range(2, 14), 3):
+            row[j] = rng.randint(-100, 100) / 4
+
+        rows.append(tuple(row))
+
+    encoder = DeltaEncoder(columns, None)
+
+    assert encoder.mask_size == 2
+    assert read_binary(encoder.header() + encoder.encode_rows(rows[:70]) + encoder.encode_rows(rows[70:])) == rows
+
+
+def test_delta_deadband():
+    encoder = DeltaEncoder(COLUMNS, 'A320', deadbands={'height': 1.0})
+    rows = [(float(i), 10.0 + i * 0.4, 0, 0.5, 0.25) for i in range(10)]
+    records = read_binary(encoder.header() + encoder.encode_rows(rows))
+
+    assert [x[0] for x in records] == [x[0] for x in rows]
+    assert all(abs(x[1] - y[1]) <= 1.0 for x, y in zip(records, rows))
+    assert len(set(x[1] for x in records)) < len(rows)
+
+
+def test_delta_unchanged_frames_are_small():
+    encoder = DeltaEncoder(COLUMNS, 'A320')
+    rows = [(0.0, 1.0, 0, 0.5, 0.5)] * 10
+
+    assert len(encoder.encode_rows(rows)) == 4 + encoder.record.size + 9 * encoder.mask_size
+
+
+def test_delta_crash_and_truncation():
+    encoder = DeltaEncoder(COLUMNS, 'A320')
+    data = encoder.header() + encoder.encode_rows(ROWS) + encoder.crash_marker()
+    records = read_binary(data)
+
+    assert records[:-1] == ROWS
+    assert records[-1][0] == CRASH_TIME
+    assert read_binary(encoder.header() + encoder.encode_rows(ROWS)[:-1]) == ROWS[:-1]
+    assert encoder.encode_rows([]) == b''
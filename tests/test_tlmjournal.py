@@ -0,0 +1,247 @@
+import json
+import time
+
+import pytest
+
+from tlmformat import TYPE_DOUBLE, TYPE_FLOAT, FORMAT_CSV, FORMAT_BINARY, FORMAT_DELTA, ENCODERS
+from tlmwriter import TelemetryOutput
+from tlmreader import FlightLog
+from tlmjournal import (
+    BLOCK_META, BLOCK_LOG_HEADER, BLOCK_FRAMES, BLOCK_CRASH, JournalWriter, read_journal, recover_journal,
+    find_journals
+)
+from tlmpipeline import FileSink, JournalSink
+
+
+COLUMNS = [('t', TYPE_DOUBLE, 0), ('height', TYPE_FLOAT, 0)]
+FORMATS = [FORMAT_CSV, FORMAT_BINARY, FORMAT_DELTA]
+ROWS = [(i * 0.5, float(i % 7)) for i in range(100)]
+
+
+def write_journal(tmp_path, format, rows, block_size=10, checkpoint=None, crash=False, **options):
+    """Write the journal of a flight `flight` and return its writer, still open."""
+    encoder = ENCODERS[format](COLUMNS, 'A320')
+    meta = {'format': format, 'icao': 'A320', 'file': 'flight' + {FORMAT_CSV: '.csv', FORMAT_BINARY: '.tlm', FORMAT_DELTA: '.dtlm'}[format]}
+
+    if checkpoint:
+        meta['checkpoint'] = checkpoint
+
+    journal = JournalWriter(str(tmp_path / 'flight.journal'), **options)
+    journal.append(BLOCK_META, json.dumps(meta).encode())
+    journal.append(BLOCK_LOG_HEADER, encoder.header())
+
+    for i in range(0, len(rows), block_size):
+        block = rows[i:i + block_size]
+        journal.append(BLOCK_FRAMES, encoder.encode_rows(block), len(block), block[0][0], block[-1][0])
+
+    if crash:
+        journal.append(BLOCK_CRASH, encoder.crash_marker())
+
+    return journal
+
+
+def read_flight(tmp_path):
+    return list(FlightLog(str(tmp_path / 'flight.manifest.json')).frames())
+
+
+def columns(rows):
+    return [list(x) for x in zip(*rows)]
+
+
+@pytest.mark.parametrize('format', FORMATS)
+def test_recover(tmp_path, format):
+    write_journal(tmp_path, format, ROWS).close()
+    result = recover_journal(str(tmp_path / 'flight.journal'))
+
+    assert result['frames'] == len(ROWS)
+    assert not result['crashed'] and not result['truncated'] and not result['padding']
+    assert read_flight(tmp_path) == ROWS
+    assert find_journals(str(tmp_path)) == []
+
+
+def test_crash_marker(tmp_path):
+    write_journal(tmp_path, FORMAT_BINARY, ROWS, crash=True).close()
+
+    assert recover_journal(str(tmp_path / 'flight.journal'))['crashed']
+
+
+def test_incomplete_block(tmp_path):
+    journal = write_journal(tmp_path, FORMAT_CSV, ROWS)
+    journal.close()
+
+    # Block cut short by a system crash
+    with open(journal.file_path, 'rb') as f:
+        data = f.read()
+
+    with open(journal.file_path, 'ab') as f:
+        f.write(data[-40:-10])
+
+    result = recover_journal(journal.file_path, remove=False)
+
+    assert result['truncated'] == 30 and not result['padding']
+    assert result['frames'] == len(ROWS)
+    assert read_journal(journal.file_path)[1] == len(data)
+
+
+def test_corrupted_block(tmp_path):
+    journal = write_journal(tmp_path, FORMAT_BINARY, ROWS)
+    journal.close()
+
+    with open(journal.file_path, 'r+b') as f:
+        f.seek(-5, 2)
+        f.write(b'\xff')
+
+    result = recover_journal(journal.file_path)
+
+    # The last block is discarded, whatever follows it
+    assert result['truncated'] > 0
+    assert read_flight(tmp_path) == ROWS[:90]
+
+
+def test_preallocation_padding(tmp_path):
+    journal = write_journal(tmp_path, FORMAT_DELTA, ROWS, preallocate=4096)
+    journal.map.flush() # Left mapped, as if the simulator died
+
+    result = recover_journal(journal.file_path, remove=False)
+
+    assert result['padding'] > 0 and not result['truncated']
+    assert read_flight(tmp_path) == ROWS
+
+    journal.map.close()
+    journal.file.close()
+
+
+def test_invalid_journal(tmp_path):
+    file_path = tmp_path / 'flight.journal'
+    file_path.write_bytes(b'not a journal')
+
+    with pytest.raises(ValueError):
+        recover_journal(str(file_path))
+
+
+def test_log_with_more_frames(tmp_path):
+    output = TelemetryOutput(str(tmp_path / 'flight'), ENCODERS[FORMAT_BINARY](COLUMNS, 'A320'), fsync=False, max_frames=50)
+    output.write_block(columns(ROWS[:60]))
+    output.write_block(columns(ROWS[60:]))
+    output.close()
+    write_journal(tmp_path, FORMAT_BINARY, ROWS[:50]).close()
+
+    with pytest.raises(ValueError):
+        recover_journal(str(tmp_path / 'flight.journal'))
+
+    result = recover_journal(str(tmp_path / 'flight.journal'), force=True)
+
+    assert result['frames'] == 50
+    assert read_flight(tmp_path) == ROWS[:50]
+    assert sorted([x.name for x in tmp_path.iterdir()]) == ['flight.manifest.json', 'flight.tlm']
+
+
+@pytest.mark.parametrize('format', FORMATS)
+def test_recover_rotated(tmp_path, format):
+    # The log was flushed up to frame 40, and frames written after it may be partly on disk
+    output = TelemetryOutput(str(tmp_path / 'flight'), ENCODERS[format](COLUMNS, 'A320'), fsync=False,
+                             max_frames=30, index_interval=10)
+
+    for i in range(0, 40, 10):
+        output.write_block(columns(ROWS[i:i + 10]))
+
+    output.flush()
+    checkpoint = output.checkpoint()
+
+    for i in range(40, 70, 10):
+        output.write_block(columns(ROWS[i:i + 10]))
+
+    output.close()
+    write_journal(tmp_path, format, ROWS[40:], checkpoint=checkpoint).close()
+
+    result = recover_journal(str(tmp_path / 'flight.journal'))
+    manifest = json.loads((tmp_path / 'flight.manifest.json').read_text())
+    ext = result['file'][result['file'].rindex('.'):]
+
+    assert result['frames'] == len(ROWS)
+    assert result['file'] == str(tmp_path / ('flight.recovered' + ext))
+    assert [x['file'] for x in manifest['segments']] == ['flight.000' + ext, 'flight.001' + ext, 'flight.recovered' + ext]
+    assert not (tmp_path / ('flight.002' + ext)).exists()
+    assert read_flight(tmp_path) == ROWS
+
+    # The index of the truncated segment only covers the frames it still holds
+    with open(tmp_path / ('flight.001' + ext + '.idx')) as f:
+        assert [json.loads(x)['t_end'] for x in f] == [ROWS[39][0]]
+
+
+def test_recover_rotated_without_frames(tmp_path):
+    output = TelemetryOutput(str(tmp_path / 'flight'), ENCODERS[FORMAT_CSV](COLUMNS, 'A320'), fsync=False)
+    output.write_block(columns(ROWS))
+    output.flush()
+    checkpoint = output.checkpoint()
+    output.close()
+    write_journal(tmp_path, FORMAT_CSV, [], checkpoint=checkpoint).close()
+
+    result = recover_journal(str(tmp_path / 'flight.journal'))
+
+    assert result['file'] is None
+    assert result['frames'] == len(ROWS)
+    assert read_flight(tmp_path) == ROWS
+
+
+def wait_for_writer(sink, n_frames):
+    deadline = time.monotonic() + 5
+
+    while time.monotonic() < deadline:
+        checkpoint = sink.checkpoint
+
+        if checkpoint and sum([x['frames'] for x in checkpoint['segments']]) == n_frames:
+            return
+
+        time.sleep(0.001)
+
+    raise TimeoutError('Telemetry writer did not flush')
+
+
+def test_journal_sink_rotation(tmp_path):
+    prefix = str(tmp_path / 'flight')
+    file_sink = FileSink(FORMAT_BINARY, fsync=False)
+    journal_sink = JournalSink(FORMAT_BINARY, max_frames=10, max_bytes=1024, preallocate=0, file_sinks=[file_sink])
+    file_sink.open(prefix, COLUMNS, 'A320')
+    journal_sink.open(prefix, COLUMNS, 'A320')
+
+    for i in range(0, len(ROWS), 10):
+        block = columns(ROWS[i:i + 10])
+        file_sink.block(block, ())
+        wait_for_writer(file_sink, i + 10)
+
+        for slot in range(10):
+            journal_sink.frame(block, slot)
+
+    blocks, _ = read_journal(journal_sink.journal.file_path)
+
+    # Only the frames written since the last rotation are left
+    assert sum([x[1] for x in blocks if x[0] == BLOCK_FRAMES]) < len(ROWS)
+    assert journal_sink.journal.size < 1024 + 300
+
+    # The simulator dies after the last frames were journaled
+    journal_sink.journal.close()
+    file_sink.close()
+
+    assert recover_journal(prefix + '.journal')['frames'] == len(ROWS)
+    assert read_flight(tmp_path) == ROWS
+
+
+def test_journal_sink_stops_rotating_when_log_is_incomplete(tmp_path):
+    prefix = str(tmp_path / 'flight')
+    file_sink = FileSink(FORMAT_CSV, fsync=False)
+    journal_sink = JournalSink(FORMAT_CSV, max_frames=10, max_seconds=0, max_bytes=256, preallocate=0, file_sinks=[file_sink])
+    file_sink.open(prefix, COLUMNS, 'A320')
+    journal_sink.open(prefix, COLUMNS, 'A320')
+    file_sink.writer.dropped = 1
+
+    for slot in range(len(ROWS)):
+        journal_sink.frame(columns(ROWS), slot)
+
+    assert journal_sink.log_sink is None
+    assert sum([x[1] for x in read_journal(journal_sink.journal.file_path)[0] if x[0] == BLOCK_FRAMES]) == len(ROWS)
+
+    file_sink.close()
+    journal_sink.close()
+
+    assert find_journals(str(tmp_path)) == [prefix + '.journal']
@@ -0,0 +1,105 @@
+import pytest
+
+import tlmreader
+
+from tlmformat import TYPE_DOUBLE, TYPE_FLOAT, FORMAT_CSV, FORMAT_BINARY, FORMAT_DELTA, COMPRESSION_GZIP, ENCODERS
+from tlmwriter import TelemetryOutput, INDEX_EXTENSION
+from tlmreader import IndexedLog, read_index
+
+
+COLUMNS = [('t', TYPE_DOUBLE, 0), ('height', TYPE_FLOAT, 0)]
+N_BLOCKS = 20
+BLOCK_SIZE = 10
+
+
+def write_log(prefix, format, compression=None, index_interval=30):
+    """Write a log of 1 frame per second, switching to phase 'fast' in the second half."""
+    output = TelemetryOutput(
+        str(prefix), ENCODERS[format](COLUMNS, 'A320'), compression=compression, fsync=False,
+        index_interval=index_interval
+    )
+
+    for i in range(N_BLOCKS):
+        times = [float(i * BLOCK_SIZE + k) for k in range(BLOCK_SIZE)]
+        output.write_block([times, [x / 2 for x in times]], ['fast'] if i >= N_BLOCKS // 2 else [])
+
+    output.close()
+
+    return output.segment_path(0)
+
+
+def all_frames():
+    return [(float(i), i / 2) for i in range(N_BLOCKS * BLOCK_SIZE)]
+
+
+@pytest.fixture(params=[
+    (FORMAT_CSV, None), (FORMAT_BINARY, None), (FORMAT_DELTA, None), (FORMAT_BINARY, COMPRESSION_GZIP)
+])
+def log_path(request, tmp_path):
+    return write_log(tmp_path / 'flight', *request.param)
+
+
+def test_index_entries(log_path):
+    index = read_index(log_path)
+
+    # Entries cover whole blocks
+    assert [x['frames'] for x in index] == [30] * 6 + [20]
+    assert [x['frame'] for x in index] == list(range(0, 200, 30))
+    assert index[0]['t_start'] == 0.0 and index[-1]['t_end'] == 199.0
+
+
+def test_frames_by_time(log_path):
+    with IndexedLog(log_path) as log:
+        assert log.t_range == (0.0, 199.0)
+        assert list(log.frames()) == all_frames()
+        assert list(log.frames(95.0, 104.5)) == [x for x in all_frames() if 95 <= x[0] <= 104.5]
+        assert list(log.frames(t_end=-1)) == []
+        assert list(log.frames(300.0)) == []
+
+
+def test_frames_seek(log_path, monkeypatch):
+    offsets = []
+    open_log_at = tlmreader.open_log_at
+
+    def spy(file_path, offset):
+        offsets.append(offset)
+
+        return open_log_at(file_path, offset)
+
+    monkeypatch.setattr(tlmreader, 'open_log_at', spy)
+
+    with IndexedLog(log_path) as log:
+        assert next(log.frames(150.0)) == (150.0, 75.0)
+        assert offsets == [log.index[5]['offset']]
+
+
+def test_frames_past_index(log_path):
+    # Frames written after the last index entry are still read
+    index_path = log_path + INDEX_EXTENSION
+
+    with open(index_path) as f:
+        lines = f.readlines()
+
+    with open(index_path, 'w') as f:
+        f.writelines(lines[:3])
+        f.write(lines[3][:10]) # Partial line written before a crash
+
+    with IndexedLog(log_path) as log:
+        assert len(log.index) == 3
+        assert list(log.frames(150.0, 152.0)) == [(150.0, 75.0), (151.0, 75.5), (152.0, 76.0)]
+
+
+def test_frames_without_index(tmp_path):
+    log_path = write_log(tmp_path / 'flight', FORMAT_BINARY, index_interval=0)
+
+    with IndexedLog(log_path) as log:
+        assert log.t_range is None
+        assert list(log.frames(195.0)) == all_frames()[195:]
+
+
+def test_phase_frames(log_path):
+    with IndexedLog(log_path) as log:
+        assert log.phases == {'fast'}
+
+        # Entries are the granularity: the entry of frames 90-119 has the phase
+        assert list(log.phase_frames('fast')) == all_frames()[90:]
@@ -0,0 +1,76 @@
+import json
+
+from tlmformat import TYPE_DOUBLE, TYPE_FLOAT, FORMAT_CSV, FORMAT_BINARY, COMPRESSION_GZIP, ENCODERS
+from tlmwriter import TelemetryOutput
+from tlmreader import FlightLog
+
+
+COLUMNS = [('t', TYPE_DOUBLE, 0), ('height', TYPE_FLOAT, 0)]
+
+
+def blocks(n_blocks, size=10, dt=0.5):
+    """Return blocks of `size` frames, as lists of flat columns."""
+    return [
+        [[(i * size + k) * dt for k in range(size)], [float(i * size + k) for k in range(size)]]
+        for i in range(n_blocks)
+    ]
+
+
+def write_flight(prefix, n_blocks, format=FORMAT_BINARY, **options):
+    output = TelemetryOutput(str(prefix), ENCODERS[format](COLUMNS, 'A320'), fsync=False, **options)
+
+    for block in blocks(n_blocks):
+        output.write_block(block)
+
+    output.close()
+
+    return output
+
+
+def read_manifest(prefix):
+    with open(str(prefix) + '.manifest.json') as f:
+        return json.load(f)
+
+
+def test_single_file(tmp_path):
+    write_flight(tmp_path / 'flight', 3)
+    manifest = read_manifest(tmp_path / 'flight')
+
+    assert [x['file'] for x in manifest['segments']] == ['flight.tlm']
+    assert manifest['segments'][0]['frames'] == 30
+    assert manifest['icao'] == 'A320'
+
+
+def test_no_frames_no_file(tmp_path):
+    write_flight(tmp_path / 'flight', 0)
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_rotation_by_frames(tmp_path):
+    write_flight(tmp_path / 'flight', 5, max_frames=20)
+    segments = read_manifest(tmp_path / 'flight')['segments']
+
+    # A new segment starts with the block following the one reaching the limit
+    assert [x['file'] for x in segments] == ['flight.000.tlm', 'flight.001.tlm', 'flight.002.tlm']
+    assert [x['frames'] for x in segments] == [20, 20, 10]
+    assert [(x['t_start'], x['t_end']) for x in segments] == [(0.0, 9.5), (10.0, 19.5), (20.0, 24.5)]
+
+
+def test_rotation_by_seconds_and_bytes(tmp_path):
+    write_flight(tmp_path / 'time', 4, max_seconds=9)
+    write_flight(tmp_path / 'size', 4, format=FORMAT_CSV, max_bytes=1)
+
+    assert [x['frames'] for x in read_manifest(tmp_path / 'time')['segments']] == [20, 20]
+    assert [x['frames'] for x in read_manifest(tmp_path / 'size')['segments']] == [10] * 4
+
+
+def test_segments_read_back(tmp_path):
+    for compression in (None, COMPRESSION_GZIP):
+        prefix = tmp_path / ('flight-%s' % compression)
+        write_flight(prefix, 5, compression=compression, max_frames=20)
+        log = FlightLog(str(prefix) + '.manifest.json')
+        expected = [tuple(x) for block in blocks(5) for x in zip(*block)]
+
+        assert list(log.frames()) == expected
+        assert list(log.frames(12.0, 14.0)) == [x for x in expected if 12.0 <= x[0] <= 14.0]
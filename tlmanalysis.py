@@ -0,0 +1,307 @@
+"""Offline analysis of telemetry logs.
+
+Logs are loaded into columnar NumPy arrays and flight metrics are computed on whole columns at
+once. This module requires NumPy and has no dependency on X-Plane; it is meant to be used by
+offline tools (see `tools/tlm-analyze.py`) and is not imported by the plugins.
+
+Units are the ones of the recorded datarefs: heights and altitudes in meters, speeds in m/s
+(except `ias`, in knots), fuel flows in kg/s, angles in degrees.
+"""
+import os
+import json
+import concurrent.futures
+
+import numpy as np
+
+from os import path
+from tlmformat import (
+    CRASH_TIME, ENCODING_FIXED, COMPRESSION_NONE, BinaryReader, open_reader, split_log_path
+)
+from tlmwriter import MANIFEST_EXTENSION
+from tlmmetrics import (
+    M_TO_FT, GROUND_MARGIN, ROLL_SPEED, CLIMB_RATE,
+    PHASE_GROUND, PHASE_ROLL, PHASE_CLIMB, PHASE_LEVEL, PHASE_DESCENT, PHASE_NAMES, LABEL_ON_GROUND
+)
+
+
+NUMPY_TYPES = {
+    'int': '<i4',
+    'float': '<f4',
+    'double': '<f8',
+    'int_array': '<i4',
+    'float_array': '<f4',
+    'byte_array': 'u1'
+}
+
+
+class TelemetryData:
+    """Columns of a telemetry log as NumPy arrays.
+
+    Scalar columns are 1-D arrays and array columns are 2-D arrays with one column per element.
+    """
+
+    def __init__(self, columns, icao=None, crashed=False):
+        self.columns = columns # Dictionary of arrays by label
+        self.icao = icao
+        self.crashed = crashed
+
+    def __getitem__(self, label):
+        return self.columns[label]
+
+    def __contains__(self, label):
+        return label in self.columns
+
+    def __len__(self):
+        return len(self.columns['t'])
+
+    @property
+    def t(self):
+        return self.columns['t']
+
+    @classmethod
+    def concatenate(cls, parts):
+        """Join the data of consecutive segments of a flight."""
+        columns = {
+            label: np.concatenate([x.columns[label] for x in parts])
+            for label in parts[0].columns
+        }
+
+        return cls(columns, parts[0].icao, any(x.crashed for x in parts))
+
+
+def _split_columns(schema, values):
+    """Build the dictionary of columns from a 2-D array of flat records."""
+    columns = {}
+    i = 0
+
+    for label, _, col_length in schema:
+        if col_length:
+            columns[label] = values[:, i:i + col_length]
+            i += col_length
+        else:
+            columns[label] = values[:, i]
+            i += 1
+
+    return columns
+
+
+def _load_fixed(file_path):
+    """Memory-map an uncompressed fixed-width binary log."""
+    with open(file_path, 'rb') as f:
+        reader = BinaryReader(f)
+
+    dtype = np.dtype([
+        (label, NUMPY_TYPES[col_type], (col_length,)) if col_length else (label, NUMPY_TYPES[col_type])
+        for label, col_type, col_length in reader.columns
+    ])
+    n_records = (path.getsize(file_path) - reader.data_offset) // dtype.itemsize
+    records = np.memmap(file_path, dtype=dtype, mode='r', offset=reader.data_offset, shape=(n_records,))
+    crash = records['t'] == CRASH_TIME
+    records = records[~crash]
+
+    return TelemetryData(
+        {label: records[label] for label in dtype.names},
+        reader.icao,
+        bool(crash.any())
+    )
+
+
+def load_log(file_path):
+    """Load a telemetry file, or all the segments of a flight given its manifest."""
+    if file_path.endswith(MANIFEST_EXTENSION):
+        with open(file_path) as f:
+            manifest = json.load(f)
+
+        folder = path.dirname(file_path)
+        parts = [load_log(path.join(folder, x['file'])) for x in manifest['segments']]
+
+        return TelemetryData.concatenate(parts)
+
+    reader = open_reader(file_path)
+
+    try:
+        if (
+            isinstance(reader, BinaryReader) and reader.encoding == ENCODING_FIXED
+            and split_log_path(file_path)[2] is COMPRESSION_NONE
+        ):
+            return _load_fixed(file_path)
+
+        values = np.array(list(reader.records()), dtype=np.float64)
+    finally:
+        reader.close()
+
+    n_values = sum([col_length or 1 for _, _, col_length in reader.columns])
+    values = values.reshape(-1, n_values)
+    crash = values[:, 0] == CRASH_TIME
+
+    return TelemetryData(_split_columns(reader.columns, values[~crash]), reader.icao, bool(crash.any()))
+
+
+def vertical_speed(t, height):
+    """Return the vertical speed between consecutive frames, with the same length as `t`.
+
+    The first element repeats the second one. Frames with no elapsed time get a speed of 0.
+    """
+    dt = np.diff(t)
+    dh = np.diff(height.astype(np.float64))
+    vs = np.divide(dh, dt, out=np.zeros_like(dh), where=dt > 0)
+
+    return np.concatenate([vs[:1], vs]) if len(vs) else np.zeros_like(t, dtype=np.float64)
+
+
+def on_ground(data):
+    """Return a boolean array which is True for frames recorded on the ground.
+
+    The on-ground column is used if recorded, otherwise frames at most `GROUND_MARGIN` above
+    ground are on the ground (see `tlmmetrics.FlightMetrics.update()`).
+    """
+    if LABEL_ON_GROUND in data:
+        return np.asarray(data[LABEL_ON_GROUND]) != 0
+
+    return np.asarray(data['height']) <= GROUND_MARGIN
+
+
+def touchdowns(data):
+    """Return the touchdowns as a list of `(t, vertical speed [fpm])`.
+
+    A touchdown is a transition from airborne to on-ground, and its rate is the vertical speed
+    over the interval preceding the first frame on ground.
+    """
+    ground = on_ground(data)
+    idx = np.flatnonzero(ground[1:] & ~ground[:-1]) + 1
+    vs = vertical_speed(data.t, data['height']) * M_TO_FT * 60
+
+    return [(float(data.t[i]), float(vs[i])) for i in idx]
+
+
+def fuel_burn(data):
+    """Return the fuel burned by each engine (kg), integrating the fuel flow over time."""
+    ff = np.asarray(data['ff'], dtype=np.float64)
+
+    if len(ff) < 2:
+        return np.zeros(ff.shape[1:])
+
+    dt = np.diff(data.t)
+
+    return ((ff[1:] + ff[:-1]) / 2 * dt[:, None]).sum(axis=0)
+
+
+def phases(data):
+    """Return the flight phase (`PHASE_*`) of each frame, from ground speed, height and altitude."""
+    ground = on_ground(data)
+    gs = np.abs(data['gs'])
+    vs = vertical_speed(data.t, data['altitude'])
+
+    return np.select(
+        [ground & (gs < ROLL_SPEED), ground, vs > CLIMB_RATE, vs < -CLIMB_RATE],
+        [PHASE_GROUND, PHASE_ROLL, PHASE_CLIMB, PHASE_DESCENT],
+        PHASE_LEVEL
+    )
+
+
+def phase_segments(data, frame_phases=None):
+    """Return the list of `(phase name, t_start, t_end)` of consecutive frames in the same phase."""
+    frame_phases = phases(data) if frame_phases is None else frame_phases
+
+    if not len(frame_phases):
+        return []
+
+    starts = np.concatenate([[0], np.flatnonzero(frame_phases[1:] != frame_phases[:-1]) + 1])
+    ends = np.concatenate([starts[1:] - 1, [len(frame_phases) - 1]])
+
+    return [
+        (PHASE_NAMES[frame_phases[s]], float(data.t[s]), float(data.t[e]))
+        for s, e in zip(starts, ends)
+    ]
+
+
+def phase_durations(data, frame_phases=None):
+    """Return the time spent in each phase (s), by phase name."""
+    frame_phases = phases(data) if frame_phases is None else frame_phases
+    dt = np.diff(data.t)
+
+    return {
+        name: float(dt[frame_phases[:-1] == code].sum())
+        for code, name in enumerate(PHASE_NAMES)
+    }
+
+
+def summarize(data):
+    """Return a dictionary of flight metrics."""
+    if not len(data):
+        return {'frames': 0}
+
+    frame_phases = phases(data)
+    summary = {
+        'icao': data.icao,
+        'frames': len(data),
+        'crashed': data.crashed,
+        't_start': float(data.t[0]),
+        't_end': float(data.t[-1]),
+        'touchdowns': touchdowns(data),
+        'max_bank': float(np.abs(data['roll']).max()) if 'roll' in data else 0.0,
+        'max_pitch': float(data['pitch'].max()) if 'pitch' in data else None,
+        'max_ias': float(data['ias'].max()) if 'ias' in data else None,
+        'max_altitude_ft': float(data['altitude'].max() * M_TO_FT),
+        'phases': phase_segments(data, frame_phases),
+        'phase_durations': phase_durations(data, frame_phases)
+    }
+
+    if 'ff' in data:
+        burn = fuel_burn(data)
+        summary['fuel_burn'] = burn.tolist()
+        summary['fuel_burn_total'] = float(burn.sum())
+
+    if 'g_nrml' in data:
+        summary['max_g'] = float(data['g_nrml'].max())
+        summary['min_g'] = float(data['g_nrml'].min())
+
+    return summary
+
+
+def analyze(file_path):
+    """Load a log and return its summary, with the path of the log."""
+    summary = summarize(load_log(file_path))
+    summary['file'] = file_path
+
+    return summary
+
+
+def find_logs(folder):
+    """Return the logs in a telemetry folder: one manifest per flight, or the file itself for unsegmented logs without one."""
+    names = sorted(os.listdir(folder))
+    logs = []
+    segments = set()
+
+    for name in names:
+        if name.endswith(MANIFEST_EXTENSION):
+            with open(path.join(folder, name)) as f:
+                segments.update([x['file'] for x in json.load(f)['segments']])
+
+            logs.append(path.join(folder, name))
+
+    for name in names:
+        if name not in segments and split_log_path(name)[1] is not None:
+            logs.append(path.join(folder, name))
+
+    return logs
+
+
+def analyze_folder(folder, workers=None):
+    """Summarize all the logs of a folder in parallel, using up to `workers` processes.
+
+    Logs that fail to load are reported with an `error` key instead of the metrics.
+    """
+    logs = find_logs(folder)
+    results = []
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(analyze, x): x for x in logs}
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as exc:
+                results.append({'file': futures[future], 'error': str(exc)})
+
+    return sorted(results, key=lambda x: x['file'])
@@ -0,0 +1,97 @@
+from array import array
+
+from tlmformat import (
+    TYPE_INT, TYPE_FLOAT, TYPE_DOUBLE, TYPE_INT_ARRAY, TYPE_FLOAT_ARRAY, TYPE_BYTE_ARRAY
+)
+
+
+TYPECODES = {
+    TYPE_INT: 'i',
+    TYPE_FLOAT: 'f', # Float datarefs are single precision, so this is lossless
+    TYPE_DOUBLE: 'd',
+    TYPE_INT_ARRAY: 'i',
+    TYPE_FLOAT_ARRAY: 'f',
+    TYPE_BYTE_ARRAY: 'B'
+}
+
+
+def flat_columns(columns):
+    """Return the list of `(label, type)` of the flat value columns making up a schema.
+
+    Each element of an array column gets its own flat column.
+    """
+    out = []
+
+    for label, col_type, col_length in columns:
+        if col_length:
+            out.extend([(label, col_type)] * col_length)
+        else:
+            out.append((label, col_type))
+
+    return out
+
+
+class FrameBuffer:
+    """Column-oriented ring buffer of telemetry frames.
+
+    Each flat value column (see `flat_columns()`) is stored in a preallocated typed array, so
+    recording a frame only writes into existing slots. Frames are written at the slot returned by
+    `append()` and handed over in blocks by `take()`. When more than `capacity` frames are
+    appended between two calls to `take()`, the oldest ones are overwritten.
+    """
+
+    def __init__(self, columns, capacity):
+        self.capacity = capacity
+        self.columns = [
+            array(TYPECODES[col_type], bytes(array(TYPECODES[col_type]).itemsize * capacity))
+            for _, col_type in flat_columns(columns)
+        ]
+        self.head = 0 # Slot of the next frame
+        self.pending = 0 # Number of frames appended since the last `take()`
+
+    def __len__(self):
+        return self.pending
+
+    @property
+    def is_full(self):
+        return self.pending >= self.capacity
+
+    @property
+    def last_slot(self):
+        """Slot of the most recent frame."""
+        return (self.head - 1) % self.capacity
+
+    def append(self):
+        """Reserve the slot for a new frame and return its index."""
+        slot = self.head
+
+        self.head = (slot + 1) % self.capacity
+
+        if self.pending < self.capacity:
+            self.pending += 1
+
+        return slot
+
+    def discard_last(self):
+        """Remove the most recent frame, so that its slot is reused by the next `append()`."""
+        if self.pending:
+            self.head = self.last_slot
+            self.pending -= 1
+
+    def last(self, col):
+        """Return the value of flat column `col` in the most recent frame."""
+        return self.columns[col][self.last_slot]
+
+    def take(self):
+        """Return the pending frames as a block and mark them as consumed.
+
+        The block is a list of typed arrays, one per flat column, holding copies of the
+        pending frames in recording order.
+        """
+        start = self.head - self.pending
+        self.pending = 0
+
+        if start >= 0:
+            return [col[start:self.head] for col in self.columns]
+
+        return [col[start:] + col[:self.head] for col in self.columns]
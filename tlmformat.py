@@ -0,0 +1,695 @@
+"""Telemetry file formats.
+
+This module has no dependency on X-Plane so that it can be used by offline tools.
+
+A telemetry schema is a list of `(label, type, length)` columns, where the type is one of the
+`TYPE_*` strings and the length is the number of elements of an array column (0 for scalars).
+The first column is always the frame time `t`.
+
+Binary files start with `BINARY_MAGIC`, followed by a little endian `uint16` version and `uint32`
+length of a JSON document describing the schema. The header is padded to a multiple of 8 bytes
+and is followed by fixed-width little endian records, one per frame, which allows the data to
+be memory-mapped (see `BinaryReader.data_offset` and `BinaryReader.record_size`).
+
+Delta-encoded binary files (`"encoding": "delta"` in the schema) share the same header and store
+frames in blocks instead. Each block starts with a `uint32` frame count followed by the first
+frame as a full record. Each following frame is stored as a little endian bit mask of the flat
+columns that changed since the previous frame, followed by the changed values only. A block with
+a frame count of 0 marks a crash.
+
+Any of these files can be compressed (see `COMPRESSION_*`). Compressed files are made of
+independent compressed streams, one for each write flush, so that a crash loses at most the
+data written since the last flush. `open_log()` opens compressed and uncompressed files alike.
+"""
+import bz2
+import gzip
+import json
+import itertools
+import lzma
+import struct
+
+from os import path
+
+
+TYPE_INT = 'int'
+TYPE_FLOAT = 'float'
+TYPE_DOUBLE = 'double'
+TYPE_INT_ARRAY = 'int_array'
+TYPE_FLOAT_ARRAY = 'float_array'
+TYPE_BYTE_ARRAY = 'byte_array'
+
+FORMAT_CSV = 'csv'
+FORMAT_SPARSE_CSV = 'sparse_csv'
+FORMAT_BINARY = 'binary'
+FORMAT_DELTA = 'delta'
+
+FILE_EXTENSIONS = {
+    FORMAT_CSV: '.csv',
+    FORMAT_SPARSE_CSV: '.scsv',
+    FORMAT_BINARY: '.tlm',
+    FORMAT_DELTA: '.dtlm'
+}
+
+COMPRESSION_NONE = None
+COMPRESSION_GZIP = 'gzip'
+COMPRESSION_LZMA = 'lzma'
+COMPRESSION_BZ2 = 'bz2'
+
+COMPRESSION_EXTENSIONS = {
+    COMPRESSION_NONE: '',
+    COMPRESSION_GZIP: '.gz',
+    COMPRESSION_LZMA: '.xz',
+    COMPRESSION_BZ2: '.bz2'
+}
+
+COMPRESSORS = {
+    COMPRESSION_GZIP: gzip.compress,
+    COMPRESSION_LZMA: lzma.compress,
+    COMPRESSION_BZ2: bz2.compress
+}
+
+COMPRESSION_MAGIC = [
+    (b'\x1f\x8b', gzip.open),
+    (b'\xfd7zXZ\x00', lzma.open),
+    (b'BZh', bz2.open)
+] # File signatures of compressed files and the function to open them
+
+ARRAY_SEPARATOR = ':'
+CRASH_MARKER = 'CRASH' # Last line of a CSV file when the aircraft crashed
+CRASH_TIME = float('-inf') # Time of the record marking a crash in binary files
+
+BINARY_MAGIC = b'XPLTLM\x00\x00'
+BINARY_VERSION = 1
+BINARY_ALIGNMENT = 8
+BINARY_PREAMBLE = struct.Struct('<HI') # version, JSON length
+DELTA_BLOCK = struct.Struct('<I') # Number of frames in a delta block
+
+ENCODING_FIXED = 'fixed'
+ENCODING_DELTA = 'delta'
+
+STRUCT_CODES = {
+    TYPE_INT: 'i',
+    TYPE_FLOAT: 'f',
+    TYPE_DOUBLE: 'd',
+    TYPE_INT_ARRAY: 'i',
+    TYPE_FLOAT_ARRAY: 'f',
+    TYPE_BYTE_ARRAY: 'B'
+}
+
+
+def record_format(columns):
+    """Return the `struct` format string of a binary record for the given schema columns."""
+    fmt = '<'
+
+    for _, col_type, col_length in columns:
+        code = STRUCT_CODES[col_type]
+        fmt += '%d%s' % (col_length, code) if col_length else code
+
+    return fmt
+
+
+def flat_codes(columns):
+    """Return the `struct` code of each flat value of a record."""
+    out = []
+
+    for _, col_type, col_length in columns:
+        out.extend(STRUCT_CODES[col_type] * (col_length or 1))
+
+    return out
+
+
+def unflatten_record(columns, record):
+    """Inverse of `flatten_frame()`: group the values of array columns into lists."""
+    out = []
+    i = 0
+
+    for _, _, col_length in columns:
+        if col_length:
+            out.append(list(record[i:i + col_length]))
+            i += col_length
+        else:
+            out.append(record[i])
+            i += 1
+
+    return out
+
+
+class CsvEncoder:
+    """Encode telemetry frames as CSV text.
+
+    Encoders take blocks of frames as lists of flat value columns, where each element of an
+    array column has its own flat column (see `tlmbuffer.FrameBuffer`).
+    """
+    format = FORMAT_CSV
+
+    def __init__(self, columns, icao):
+        self.columns = columns
+        self.icao = icao
+        self.groups = [] # Tuples of (first flat column, array length) for each schema column
+
+        i = 0
+
+        for _, _, col_length in columns:
+            self.groups.append((i, col_length))
+            i += col_length or 1
+
+    def header(self):
+        return (','.join([label for label, _, _ in self.columns]) + '\n').encode()
+
+    def encode(self, block):
+        return self.encode_rows(zip(*block))
+
+    def encode_rows(self, rows):
+        """Encode an iterable of flat frames."""
+        groups = self.groups
+        lines = [
+            ','.join([
+                ARRAY_SEPARATOR.join([str(x) for x in row[i:i + n]]) if n else str(row[i])
+                for i, n in groups
+            ]) + '\n'
+            for row in rows
+        ]
+
+        return ''.join(lines).encode()
+
+    def crash_marker(self):
+        return (CRASH_MARKER + '\n').encode()
+
+
+class SparseCsvEncoder(CsvEncoder):
+    """Encode telemetry frames as CSV text where fields equal to the previous frame are left empty.
+
+    The first frame of each block is written in full, so that a block can be decoded even if the
+    previous one was dropped. See `sparse_to_csv()`.
+    """
+    format = FORMAT_SPARSE_CSV
+
+    def encode_rows(self, rows):
+        groups = self.groups
+        lines = []
+        prev = None
+
+        for row in rows:
+            fields = []
+
+            for i, n in groups:
+                if n:
+                    value = row[i:i + n]
+
+                    if prev is not None and value == prev[i:i + n]:
+                        fields.append('')
+                    else:
+                        fields.append(ARRAY_SEPARATOR.join([str(x) for x in value]))
+                elif prev is not None and row[i] == prev[i]:
+                    fields.append('')
+                else:
+                    fields.append(str(row[i]))
+
+            lines.append(','.join(fields) + '\n')
+            prev = row
+
+        return ''.join(lines).encode()
+
+
+class BinaryEncoder:
+    """Encode telemetry frames as fixed-width binary records."""
+    format = FORMAT_BINARY
+
+    def __init__(self, columns, icao):
+        self.columns = columns
+        self.icao = icao
+        self.record = struct.Struct(record_format(columns))
+        self.n_values = sum([col_length or 1 for _, _, col_length in columns])
+
+    def schema(self):
+        return {
+            'icao': self.icao,
+            'columns': [
+                {'label': label, 'type': col_type, 'length': col_length}
+                for label, col_type, col_length in self.columns
+            ],
+            'record_size': self.record.size,
+            'encoding': ENCODING_FIXED
+        }
+
+    def header(self):
+        schema = json.dumps(self.schema()).encode()
+        header = BINARY_MAGIC + BINARY_PREAMBLE.pack(BINARY_VERSION, len(schema)) + schema
+        padding = -len(header) % BINARY_ALIGNMENT
+
+        return header + b' ' * padding
+
+    def encode(self, block):
+        return self.encode_rows(zip(*block))
+
+    def encode_rows(self, rows):
+        """Encode an iterable of flat frames."""
+        pack = self.record.pack
+
+        return b''.join([pack(*row) for row in rows])
+
+    def crash_marker(self):
+        return self.record.pack(CRASH_TIME, *[0] * (self.n_values - 1))
+
+
+class DeltaEncoder(BinaryEncoder):
+    """Encode telemetry frames as blocks of changes from the previous frame.
+
+    Without deadbands the encoding is lossless. With deadbands, a value is only written when it
+    differs from the last written value of its column by more than the deadband of its label.
+    """
+    format = FORMAT_DELTA
+
+    def __init__(self, columns, icao, deadbands=None):
+        super().__init__(columns, icao)
+
+        deadbands = deadbands or {}
+
+        self.codes = flat_codes(columns)
+        self.deadbands = []
+        self.mask_size = (self.n_values + 7) // 8
+        self._structs = {} # Struct of the changed values, by mask
+
+        for label, _, col_length in columns:
+            self.deadbands.extend([deadbands.get(label, 0)] * (col_length or 1))
+
+    def schema(self):
+        schema = super().schema()
+        schema['encoding'] = ENCODING_DELTA
+
+        return schema
+
+    def encode_rows(self, rows):
+        rows = list(rows)
+
+        if not rows:
+            return b''
+
+        out = [DELTA_BLOCK.pack(len(rows)), self.record.pack(*rows[0])]
+        ref = list(rows[0])
+        deadbands = self.deadbands
+        mask_size = self.mask_size
+
+        for row in rows[1:]:
+            mask = 0
+            changed = []
+
+            for j, x in enumerate(row):
+                r = ref[j]
+
+                # NaN compares unequal to everything: a change to or from NaN is always written,
+                # and consecutive NaNs are not
+                if x != r and (abs(x - r) > deadbands[j] or (x != x) != (r != r)):
+                    mask |= 1 << j
+                    ref[j] = x
+                    changed.append(x)
+
+            values = self._structs.get(mask)
+
+            if values is None:
+                values = self._structs[mask] = struct.Struct(
+                    '<' + ''.join([code for j, code in enumerate(self.codes) if mask >> j & 1])
+                )
+
+            out.append(mask.to_bytes(mask_size, 'little'))
+            out.append(values.pack(*changed))
+
+        return b''.join(out)
+
+    def crash_marker(self):
+        return DELTA_BLOCK.pack(0)
+
+
+ENCODERS = {
+    FORMAT_CSV: CsvEncoder,
+    FORMAT_SPARSE_CSV: SparseCsvEncoder,
+    FORMAT_BINARY: BinaryEncoder,
+    FORMAT_DELTA: DeltaEncoder
+}
+
+
+class BinaryReader:
+    """Read a binary telemetry file, either fixed-width or delta-encoded.
+
+    Iterating over the reader yields frames in the same layout used for recording, where
+    array columns are lists. A frame whose time is `CRASH_TIME` marks a crash.
+    """
+
+    def __init__(self, file):
+        """Read the header of `file`, which must be open in binary mode."""
+        self.file = file
+
+        magic = file.read(len(BINARY_MAGIC))
+
+        if magic != BINARY_MAGIC:
+            raise ValueError('Not a binary telemetry file')
+
+        version, schema_len = BINARY_PREAMBLE.unpack(file.read(BINARY_PREAMBLE.size))
+
+        if version > BINARY_VERSION:
+            raise ValueError('Unsupported binary telemetry version', version)
+
+        schema = json.loads(file.read(schema_len).decode())
+        header_len = len(BINARY_MAGIC) + BINARY_PREAMBLE.size + schema_len
+
+        self.icao = schema['icao']
+        self.columns = [(x['label'], x['type'], x['length']) for x in schema['columns']]
+        self.record = struct.Struct(record_format(self.columns))
+        self.encoding = schema.get('encoding', ENCODING_FIXED)
+        self.data_offset = header_len + (-header_len % BINARY_ALIGNMENT)
+        self.record_size = self.record.size
+
+        file.read(self.data_offset - header_len) # Skip padding
+
+    @property
+    def labels(self):
+        return [label for label, _, _ in self.columns]
+
+    def close(self):
+        self.file.close()
+
+    def records(self, file=None):
+        """Yield flat tuples of values, one per record.
+
+        Arguments:
+            file: The file to read the records from, positioned at the start of a block
+                (see `open_log_at()`). Defaults to the file of the reader.
+        """
+        file = file or self.file
+
+        if self.encoding == ENCODING_DELTA:
+            return self._delta_records(file)
+
+        return self._fixed_records(file)
+
+    def _fixed_records(self, file):
+        size = self.record_size
+        unpack = self.record.unpack
+
+        while True:
+            data = file.read(size)
+
+            if len(data) < size:
+                break # EOF or truncated record
+
+            yield unpack(data)
+
+    def _delta_records(self, file):
+        read = file.read
+        size = self.record_size
+        codes = flat_codes(self.columns)
+        mask_size = (len(codes) + 7) // 8
+        structs = {} # Tuples of (Struct, column indices), by mask
+
+        while True:
+            data = read(DELTA_BLOCK.size)
+
+            if len(data) < DELTA_BLOCK.size:
+                break
+
+            n_frames, = DELTA_BLOCK.unpack(data)
+
+            if not n_frames:
+                yield (CRASH_TIME,) + (0,) * (len(codes) - 1)
+
+                continue
+
+            data = read(size)
+
+            if len(data) < size:
+                break
+
+            ref = list(self.record.unpack(data))
+
+            yield tuple(ref)
+
+            for _ in range(n_frames - 1):
+                data = read(mask_size)
+
+                if len(data) < mask_size:
+                    return
+
+                mask = int.from_bytes(data, 'little')
+                values = structs.get(mask)
+
+                if values is None:
+                    indices = [j for j in range(len(codes)) if mask >> j & 1]
+                    values = structs[mask] = (struct.Struct('<' + ''.join([codes[j] for j in indices])), indices)
+
+                values_struct, indices = values
+                data = read(values_struct.size)
+
+                if len(data) < values_struct.size:
+                    return
+
+                for j, x in zip(indices, values_struct.unpack(data)):
+                    ref[j] = x
+
+                yield tuple(ref)
+
+    def __iter__(self):
+        for record in self.records():
+            yield unflatten_record(self.columns, record)
+
+
+class CsvReader:
+    """Read a CSV or sparse CSV telemetry file.
+
+    CSV files carry no type information, so all values are returned as floats and every column
+    is reported as `TYPE_DOUBLE`. Array lengths are taken from the first frame.
+    """
+
+    def __init__(self, file, sparse=False):
+        """Read the header of `file`, which must be open in binary mode."""
+        self.file = file
+        self.sparse = sparse
+        self.icao = None
+
+        header = file.readline()
+        labels = header.decode().rstrip('\r\n').split(',')
+
+        self.data_offset = len(header)
+        self._first = file.readline() # Read ahead to find array lengths
+        fields = self._first.decode().rstrip('\r\n').split(',')
+
+        if len(fields) != len(labels):
+            fields = [''] * len(labels)
+
+        self.columns = [
+            (label, TYPE_DOUBLE, x.count(ARRAY_SEPARATOR) + 1 if ARRAY_SEPARATOR in x else 0)
+            for label, x in zip(labels, fields)
+        ]
+
+    @property
+    def labels(self):
+        return [label for label, _, _ in self.columns]
+
+    def close(self):
+        self.file.close()
+
+    def records(self, file=None):
+        """Yield flat tuples of values, one per frame. See `BinaryReader.records()`."""
+        if file is None:
+            file = self.file
+            lines = [self._first] if self._first else []
+            self._first = None
+        else:
+            lines = []
+
+        n_values = sum([col_length or 1 for _, _, col_length in self.columns])
+        prev = None
+
+        for line in itertools.chain(lines, file):
+            line = line.decode().rstrip('\r\n')
+
+            if line == CRASH_MARKER:
+                yield (CRASH_TIME,) + (0.0,) * (n_values - 1)
+
+                continue
+
+            fields = line.split(',')
+
+            if self.sparse and prev is not None:
+                fields = [x if x else y for x, y in zip(fields, prev)]
+
+            prev = fields
+
+            try:
+                values = tuple([float(y) for x in fields for y in x.split(ARRAY_SEPARATOR)])
+            except ValueError:
+                break # Truncated line
+
+            if len(values) != n_values:
+                break
+
+            yield values
+
+    def __iter__(self):
+        for record in self.records():
+            yield unflatten_record(self.columns, record)
+
+
+def binary_to_csv(src, dst):
+    """Convert the binary telemetry file object `src` into CSV text written to `dst`."""
+    reader = BinaryReader(src)
+    encoder = CsvEncoder(reader.columns, reader.icao)
+
+    dst.write(encoder.header().decode())
+
+    for record in reader.records():
+        if record[0] == CRASH_TIME:
+            dst.write(encoder.crash_marker().decode())
+        else:
+            dst.write(encoder.encode_rows([record]).decode())
+
+
+def sparse_to_csv(src, dst):
+    """Convert the sparse CSV text file object `src` into CSV text written to `dst`."""
+    dst.write(src.readline())
+    prev = None
+
+    for line in src:
+        line = line.rstrip('\n')
+
+        if line == CRASH_MARKER:
+            dst.write(line + '\n')
+
+            continue
+
+        fields = line.split(',')
+
+        if prev is not None:
+            fields = [x if x else y for x, y in zip(fields, prev)]
+
+        dst.write(','.join(fields) + '\n')
+        prev = fields
+
+
+class CompressedFile:
+    """Write-only binary file compressing the data written between two flushes as an independent stream.
+
+    Readers of the compression formats decode concatenated streams transparently.
+    """
+
+    def __init__(self, file_path, compression):
+        self.raw = open(file_path, 'wb')
+        self.compress = COMPRESSORS[compression]
+        self.pending = []
+
+    def write(self, data):
+        self.pending.append(data)
+
+        return len(data)
+
+    def flush(self):
+        if self.pending:
+            self.raw.write(self.compress(b''.join(self.pending)))
+            self.pending.clear()
+
+        self.raw.flush()
+
+    def fileno(self):
+        return self.raw.fileno()
+
+    def tell(self):
+        """Flush the pending data and return the raw offset where the next stream will start."""
+        self.flush()
+
+        return self.raw.tell()
+
+    def close(self):
+        self.flush()
+        self.raw.close()
+
+
+class _DecompressedStream:
+    """Decompressed stream which also closes the raw file it reads from when closed."""
+
+    def __init__(self, stream, raw):
+        self.stream = stream
+        self.raw = raw
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def readline(self):
+        return self.stream.readline()
+
+    def __iter__(self):
+        return iter(self.stream)
+
+    def close(self):
+        self.stream.close()
+        self.raw.close()
+
+
+def open_output(file_path, compression=COMPRESSION_NONE):
+    """Open a telemetry file for writing in binary mode."""
+    if compression is COMPRESSION_NONE:
+        return open(file_path, 'wb')
+
+    return CompressedFile(file_path, compression)
+
+
+def open_log(file_path):
+    """Open a telemetry file for reading in binary mode, decompressing it if needed."""
+    with open(file_path, 'rb') as f:
+        signature = f.read(8)
+
+    for magic, open_compressed in COMPRESSION_MAGIC:
+        if signature.startswith(magic):
+            return open_compressed(file_path, 'rb')
+
+    return open(file_path, 'rb')
+
+
+def open_log_at(file_path, offset):
+    """Open a telemetry file for reading in binary mode from the raw file offset `offset`.
+
+    For compressed files, the offset must be the start of a compressed stream.
+    """
+    raw = open(file_path, 'rb')
+    signature = raw.read(8)
+
+    raw.seek(offset)
+
+    for magic, open_compressed in COMPRESSION_MAGIC:
+        if signature.startswith(magic):
+            return _DecompressedStream(open_compressed(raw, 'rb'), raw)
+
+    return raw
+
+
+def open_reader(file_path):
+    """Open a telemetry file and return a reader for its format."""
+    _, fmt, _ = split_log_path(file_path)
+    file = open_log(file_path)
+
+    if fmt == FORMAT_CSV:
+        return CsvReader(file)
+    elif fmt == FORMAT_SPARSE_CSV:
+        return CsvReader(file, sparse=True)
+
+    return BinaryReader(file)
+
+
+def split_log_path(file_path):
+    """Split a telemetry file path into its base path, format and compression.
+
+    The format is None if the extension is unknown.
+    """
+    base, compression = file_path, COMPRESSION_NONE
+
+    for comp, ext in COMPRESSION_EXTENSIONS.items():
+        if ext and base.endswith(ext):
+            base, compression = base[:-len(ext)], comp
+
+            break
+
+    base, ext = path.splitext(base)
+
+    for fmt, fmt_ext in FILE_EXTENSIONS.items():
+        if ext == fmt_ext:
+            return base, fmt, compression
+
+    return base + ext, None, compression
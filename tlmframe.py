@@ -0,0 +1,125 @@
+"""Frame readers compiled from the resolved list of datarefs.
+
+Reading a frame with a `FrameReader` is a fixed sequence of read calls bound at compile time:
+the read function of each dataref type, the output list of array reads and the buffer columns
+are all resolved once, and datarefs are grouped by sampling divisor and by whether they have a
+deadband, so that the per-frame work is limited to the checks that can actually change.
+
+This module has no dependency on X-Plane; the read functions are passed in by the plugin.
+"""
+
+
+def _timed(func, hist, perf_counter):
+    """Wrap a read function so that the duration of each call is added to `hist`."""
+    def timed_func(*args):
+        start = perf_counter()
+        value = func(*args)
+        hist.add(perf_counter() - start)
+
+        return value
+
+    return timed_func
+
+
+class FrameReader:
+    def __init__(self, buffer, drefs, read_functions, timers=None, perf_counter=None):
+        """Compile a frame reader.
+
+        Arguments:
+            buffer: The `tlmbuffer.FrameBuffer` frames are read into. Its columns are the time,
+                followed by the columns of `drefs` in order.
+            drefs: List of `(dataref_id, type, n_elements, divisor, deadband)`
+            read_functions: Dictionary of read functions by dataref type. Scalar functions take
+                the dataref ID, array functions take the dataref ID, the number of elements and
+                an output list which they fill.
+            timers: Optional list of histograms, matching `drefs`, receiving the duration of each read
+            perf_counter: Clock used for the timers
+        """
+        self.buffer = buffer
+        self.groups = [] # Sorted tuples of (divisor, (scalars, scalar deadbands, arrays, array deadbands, held columns))
+
+        groups = {}
+        columns = buffer.columns
+        i = 1
+
+        for j, (dref_id, dref_type, dref_n, divisor, deadband) in enumerate(drefs):
+            width = dref_n or 1
+            cols = columns[i:i + width]
+            read = read_functions[dref_type]
+
+            if timers:
+                read = _timed(read, timers[j], perf_counter)
+
+            if divisor not in groups:
+                groups[divisor] = ([], [], [], [], [])
+
+            scalars, scalar_bands, arrays, array_bands, held = groups[divisor]
+
+            if dref_n:
+                entry = (read, dref_id, dref_n, [0] * dref_n, cols)
+
+                if deadband:
+                    array_bands.append(entry + (deadband,))
+                else:
+                    arrays.append(entry)
+            elif deadband:
+                scalar_bands.append((read, dref_id, cols[0], deadband))
+            else:
+                scalars.append((read, dref_id, cols[0]))
+
+            held.extend(cols)
+            i += width
+
+        self.groups = sorted(groups.items())
+
+    def read(self, slot, n, t):
+        """Read frame number `n`, recorded at time `t`, into `slot` of the buffer.
+
+        Datarefs are only read every `divisor` frames. Values not read, or that changed less than
+        their deadband since the previous frame, hold the value of the previous frame.
+        """
+        columns = self.buffer.columns
+        prev = (slot - 1) % self.buffer.capacity
+
+        columns[0][slot] = t
+
+        for divisor, (scalars, scalar_bands, arrays, array_bands, held) in self.groups:
+            if n % divisor:
+                for col in held:
+                    col[slot] = col[prev]
+
+                continue
+
+            for read, dref_id, col in scalars:
+                col[slot] = read(dref_id)
+
+            for read, dref_id, dref_n, out, cols in arrays:
+                read(dref_id, dref_n, out)
+
+                for col, x in zip(cols, out):
+                    col[slot] = x
+
+            if not n:
+                # No previous frame to hold values from
+                for read, dref_id, col, _ in scalar_bands:
+                    col[slot] = read(dref_id)
+
+                for read, dref_id, dref_n, out, cols, _ in array_bands:
+                    read(dref_id, dref_n, out)
+
+                    for col, x in zip(cols, out):
+                        col[slot] = x
+
+                continue
+
+            for read, dref_id, col, deadband in scalar_bands:
+                x = read(dref_id)
+                held_x = col[prev]
+                col[slot] = held_x if abs(x - held_x) <= deadband else x
+
+            for read, dref_id, dref_n, out, cols, deadband in array_bands:
+                read(dref_id, dref_n, out)
+
+                for col, x in zip(cols, out):
+                    held_x = col[prev]
+                    col[slot] = held_x if abs(x - held_x) <= deadband else x
@@ -0,0 +1,332 @@
+"""Export of telemetry logs as GIS tracks.
+
+The position columns of a log are streamed into NumPy arrays, simplified with the
+Douglas-Peucker algorithm to a tolerance in meters, and written as GPX, KML or GeoJSON. This
+module requires NumPy and has no dependency on X-Plane; it is meant to be used by offline tools
+(see `tools/tlm-export.py`) and is not imported by the plugins.
+"""
+import json
+import itertools
+import operator
+import concurrent.futures
+
+import numpy as np
+
+from os import path
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+from tlmformat import FORMAT_BINARY, COMPRESSION_NONE, split_log_path
+from tlmwriter import MANIFEST_EXTENSION
+from tlmreader import IndexedLog, FlightLog
+from tlmanalysis import load_log, find_logs
+
+
+GIS_GPX = 'gpx'
+GIS_KML = 'kml'
+GIS_GEOJSON = 'geojson'
+
+GIS_EXTENSIONS = {
+    GIS_GPX: '.gpx',
+    GIS_KML: '.kml',
+    GIS_GEOJSON: '.geojson'
+}
+
+LABEL_LATITUDE = 'latitude'
+LABEL_LONGITUDE = 'longitude'
+LABEL_ALTITUDE = 'altitude'
+
+EARTH_RADIUS = 6371008.8 # m
+CHUNK_SIZE = 65536 # Records converted into an array at once when streaming a log
+DEFAULT_TOLERANCE = 5.0 # m
+
+
+class Track:
+    """Positions of a flight, as 1-D arrays of times, latitudes, longitudes and altitudes (m)."""
+
+    def __init__(self, t, lat, lon, alt=None, icao=None, name=None):
+        self.t = t
+        self.lat = lat
+        self.lon = lon
+        self.alt = alt # None if the log has no altitude
+        self.icao = icao
+        self.name = name
+
+    def __len__(self):
+        return len(self.t)
+
+    def take(self, indices):
+        """Return the track made of the points at `indices`."""
+        return Track(
+            self.t[indices], self.lat[indices], self.lon[indices],
+            self.alt[indices] if self.alt is not None else None,
+            self.icao, self.name
+        )
+
+    def local_coordinates(self):
+        """Return the points in meters, in a local equirectangular projection centred on the track."""
+        lat = np.radians(self.lat)
+        lon = np.radians(self.lon)
+        lat0 = (lat.min() + lat.max()) / 2 if len(lat) else 0
+        # Unwrap longitudes so that tracks crossing the antimeridian stay continuous
+        lon = np.unwrap(lon)
+        coords = [lon * np.cos(lat0) * EARTH_RADIUS, lat * EARTH_RADIUS]
+
+        if self.alt is not None:
+            coords.append(self.alt)
+
+        return np.column_stack(coords)
+
+
+def _segment_paths(file_path):
+    if file_path.endswith(MANIFEST_EXTENSION):
+        return [x for x, _ in FlightLog(file_path).segments]
+
+    return [file_path]
+
+
+def _flat_index(columns):
+    """Return the flat record index of the scalar columns, by label."""
+    index = {}
+    i = 0
+
+    for label, _, col_length in columns:
+        if not col_length:
+            index[label] = i
+
+        i += col_length or 1
+
+    return index
+
+
+def _read_segment(file_path):
+    """Return the time and position columns of a telemetry file as an array of rows, and its ICAO code."""
+    with IndexedLog(file_path) as log:
+        index = _flat_index(log.columns)
+        labels = ['t', LABEL_LATITUDE, LABEL_LONGITUDE]
+
+        if LABEL_LATITUDE not in index or LABEL_LONGITUDE not in index:
+            raise ValueError('Telemetry log has no position columns', file_path)
+
+        if LABEL_ALTITUDE in index:
+            labels.append(LABEL_ALTITUDE)
+
+        icao = log.reader.icao
+        _, fmt, compression = split_log_path(file_path)
+
+        if fmt == FORMAT_BINARY and compression is COMPRESSION_NONE:
+            # Fixed-width records are memory-mapped instead of decoded one by one
+            data = load_log(file_path)
+
+            return np.column_stack([np.asarray(data[x], dtype=np.float64) for x in labels]), icao
+
+        records = map(operator.itemgetter(*[index[x] for x in labels]), log.frames())
+        chunks = []
+
+        while True:
+            chunk = np.array(list(itertools.islice(records, CHUNK_SIZE)), dtype=np.float64)
+
+            if not len(chunk):
+                break
+
+            chunks.append(chunk)
+
+    if not chunks:
+        return np.zeros((0, len(labels))), icao
+
+    return np.concatenate(chunks), icao
+
+
+def read_track(file_path):
+    """Read the track of a telemetry file, or of all the segments of a flight given its manifest."""
+    parts = [_read_segment(x) for x in _segment_paths(file_path)]
+    rows = np.concatenate([x for x, _ in parts]) if parts else np.zeros((0, 3))
+    icao = next((x for _, x in parts if x), None)
+    name = path.basename(flight_prefix(file_path))
+
+    return Track(
+        rows[:, 0], rows[:, 1], rows[:, 2],
+        rows[:, 3] if rows.shape[1] > 3 else None,
+        icao, name
+    )
+
+
+def _segment_distances(points, a, b):
+    """Return the distances from `points` to the segment from `a` to `b`."""
+    ab = b - a
+    ap = points - a
+    length2 = ab @ ab
+
+    if length2 > 0:
+        u = np.clip(ap @ ab / length2, 0, 1)
+        ap = ap - u[:, None] * ab
+
+    return np.sqrt(np.einsum('ij,ij->i', ap, ap))
+
+
+def simplify(points, tolerance):
+    """Return the indices of the points kept by the Douglas-Peucker algorithm.
+
+    Arguments:
+        points: 2-D array with one point per row
+        tolerance: Maximum distance between the simplified line and the points left out
+
+    The distances of all the points of a span are computed at once, and spans are processed from
+    a stack instead of recursively, so that the Python overhead is per point kept rather than
+    per point of the track.
+    """
+    n = len(points)
+
+    if n < 3:
+        return np.arange(n)
+
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+    stack = [(0, n - 1)]
+
+    while stack:
+        start, end = stack.pop()
+
+        if end - start < 2:
+            continue
+
+        distances = _segment_distances(points[start + 1:end], points[start], points[end])
+        i = int(np.argmax(distances))
+
+        if distances[i] > tolerance:
+            i += start + 1
+            keep[i] = True
+            stack.append((start, i))
+            stack.append((i, end))
+
+    return np.flatnonzero(keep)
+
+
+def simplify_track(track, tolerance=DEFAULT_TOLERANCE):
+    """Return the track simplified to `tolerance` meters, horizontally and vertically."""
+    if not len(track):
+        return track
+
+    points = track.local_coordinates()
+
+    # Drop repeated positions first, e.g. while parked, which never affect the shape
+    moved = np.ones(len(points), dtype=bool)
+    moved[1:-1] = np.any(points[1:-1] != points[:-2], axis=1)
+    indices = np.flatnonzero(moved)
+
+    return track.take(indices[simplify(points[indices], tolerance)])
+
+
+def _iso_time(t):
+    return datetime.fromtimestamp(t, timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def to_gpx(track):
+    points = [
+        '<trkpt lat="%.7f" lon="%.7f">%s<time>%s</time></trkpt>' % (
+            lat, lon, '<ele>%.1f</ele>' % alt if alt is not None else '', _iso_time(t)
+        )
+        for t, lat, lon, alt in zip(track.t, track.lat, track.lon, _altitudes(track))
+    ]
+
+    return '\n'.join([
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<gpx version="1.1" creator="X-Plane telemetry" xmlns="http://www.topografix.com/GPX/1/1">',
+        '<trk><name>%s</name><type>%s</type><trkseg>' % (escape(track.name or ''), escape(track.icao or '')),
+        *points,
+        '</trkseg></trk>',
+        '</gpx>',
+        ''
+    ])
+
+
+def to_kml(track):
+    coordinates = ' '.join([
+        '%.7f,%.7f,%.1f' % (lon, lat, alt or 0)
+        for lat, lon, alt in zip(track.lat, track.lon, _altitudes(track))
+    ])
+    altitude_mode = 'absolute' if track.alt is not None else 'clampToGround'
+
+    return '\n'.join([
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>',
+        '<name>%s</name>' % escape(track.name or ''),
+        '<Placemark><name>%s</name>' % escape(track.icao or track.name or ''),
+        '<LineString><altitudeMode>%s</altitudeMode><coordinates>%s</coordinates></LineString>' % (altitude_mode, coordinates),
+        '</Placemark></Document></kml>',
+        ''
+    ])
+
+
+def to_geojson(track):
+    if track.alt is not None:
+        coordinates = np.column_stack([track.lon, track.lat, track.alt]).round(7).tolist()
+    else:
+        coordinates = np.column_stack([track.lon, track.lat]).round(7).tolist()
+
+    return json.dumps({
+        'type': 'Feature',
+        'geometry': {'type': 'LineString', 'coordinates': coordinates},
+        'properties': {
+            'name': track.name,
+            'icao': track.icao,
+            'times': track.t.tolist()
+        }
+    })
+
+
+def _altitudes(track):
+    return track.alt.tolist() if track.alt is not None else itertools.repeat(None, len(track))
+
+
+GIS_WRITERS = {
+    GIS_GPX: to_gpx,
+    GIS_KML: to_kml,
+    GIS_GEOJSON: to_geojson
+}
+
+
+def flight_prefix(file_path):
+    """Return the path of a flight without extension, given its manifest or telemetry file."""
+    if file_path.endswith(MANIFEST_EXTENSION):
+        return file_path[:-len(MANIFEST_EXTENSION)]
+
+    return split_log_path(file_path)[0]
+
+
+def export(file_path, format=GIS_GEOJSON, tolerance=DEFAULT_TOLERANCE, output_dir=None):
+    """Export the track of a telemetry log, simplified to `tolerance` meters (0 to keep every point).
+
+    Return value:
+        A dictionary with the path of the log and of the track, and the number of points read and written.
+    """
+    track = read_track(file_path)
+    simplified = simplify_track(track, tolerance) if tolerance else track
+    dst_path = flight_prefix(file_path) + GIS_EXTENSIONS[format]
+
+    if output_dir:
+        dst_path = path.join(output_dir, path.basename(dst_path))
+
+    with open(dst_path, 'w') as f:
+        f.write(GIS_WRITERS[format](simplified))
+
+    return {'file': file_path, 'output': dst_path, 'points': len(track), 'points_written': len(simplified)}
+
+
+def export_folder(folder, format=GIS_GEOJSON, tolerance=DEFAULT_TOLERANCE, output_dir=None, workers=None):
+    """Export the tracks of all the logs of a folder in parallel, using up to `workers` processes.
+
+    Logs that fail to export are reported with an `error` key.
+    """
+    logs = find_logs(folder)
+    results = []
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(export, x, format, tolerance, output_dir): x for x in logs}
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as exc:
+                results.append({'file': futures[future], 'error': str(exc)})
+
+    return sorted(results, key=lambda x: x['file'])
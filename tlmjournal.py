@@ -0,0 +1,327 @@
+"""Crash-safe telemetry journal.
+
+While recording, frames are appended to a journal `<prefix>.journal` in small blocks, each as
+soon as it holds `max_frames` frames or `max_seconds` of recording, independently of the size of
+the frame buffer. If the simulator dies, at most one block of frames is lost and the journal can
+be turned back into a clean telemetry log with `recover_journal()` (see `tools/tlm-recover.py`).
+The journal is deleted when the flight is closed normally. So that it does not grow as large as
+the log, it can be rotated once the log is flushed, keeping only the frames that follow.
+
+A journal starts with `JOURNAL_MAGIC`, followed by blocks made of a `BLOCK_HEADER`, a payload and
+the CRC32 of the header and payload. Writes are not buffered by the process, so that every block
+written survives a crash of the simulator, and the checksum detects a block only partly written
+when the system itself goes down. The payloads are, in order:
+
+    BLOCK_META: JSON document with the format, ICAO code and file name of the telemetry log,
+        and the checkpoint of the log the journal continues if it was rotated
+    BLOCK_LOG_HEADER: The header of the telemetry log (see `tlmformat.ENCODERS`)
+    BLOCK_FRAMES: Encoded frames, as they are written to the log
+    BLOCK_CRASH: The crash marker of the format
+
+Journals are written by the sim thread, so they are best written through a memory-mapped file
+preallocated by `preallocate` bytes, which makes each block a memory copy instead of a system
+call. The unused end of the file is zero, and is cut off when the journal is closed or recovered.
+Syncing blocks to disk (`fsync`) blocks the writing thread until the disk write completes, with
+or without a memory map.
+
+This module has no dependency on X-Plane.
+"""
+import os
+import json
+import mmap
+import zlib
+import struct
+
+from os import path
+from tlmformat import COMPRESSION_NONE
+from tlmwriter import MANIFEST_EXTENSION
+
+
+JOURNAL_EXTENSION = '.journal'
+JOURNAL_MAGIC = b'XPLJRNL\x00'
+RECOVERED_SUFFIX = '.recovered' # Inserted before the extension of the log recovered from a rotated journal
+
+BLOCK_MAGIC = b'JB'
+BLOCK_HEADER = struct.Struct('<2sBxIIdd') # magic, kind, number of frames, payload length, t of first and last frame
+BLOCK_CRC = struct.Struct('<I')
+
+BLOCK_META = 0
+BLOCK_LOG_HEADER = 1
+BLOCK_FRAMES = 2
+BLOCK_CRASH = 3
+
+
+class JournalWriter:
+    """Append-only writer of journal blocks."""
+
+    def __init__(self, file_path, preallocate=0, fsync=False, append=False):
+        """Create the journal.
+
+        Arguments:
+            file_path: The path of the journal
+            preallocate: Size by which the file is preallocated and grown, in bytes, to write it
+                through a memory map (0 to write blocks to the file instead)
+            fsync: True to sync the journal to disk after each block, which also protects the
+                blocks against a crash of the system at the cost of a disk write per block
+            append: True to append blocks to an existing, closed journal
+        """
+        self.file_path = file_path
+        self.preallocate = preallocate
+        self.fsync = fsync
+        self.size = os.path.getsize(file_path) if append else 0 # Number of bytes written
+        self.map = None
+
+        if preallocate:
+            self.file = open(file_path, 'r+b' if append else 'w+b')
+            length = (self.size // preallocate + 1) * preallocate
+            self.file.truncate(length)
+            self.map = mmap.mmap(self.file.fileno(), length)
+        else:
+            self.file = open(file_path, 'ab' if append else 'wb', buffering=0)
+
+        if not append:
+            self._write(JOURNAL_MAGIC)
+
+    def append(self, kind, payload, n_frames=0, t_start=0, t_end=0):
+        """Append a block."""
+        header = BLOCK_HEADER.pack(BLOCK_MAGIC, kind, n_frames, len(payload), t_start, t_end)
+        crc = zlib.crc32(payload, zlib.crc32(header))
+
+        self._write(header + payload + BLOCK_CRC.pack(crc))
+
+        if self.fsync:
+            self.sync()
+
+    def _write(self, data):
+        end = self.size + len(data)
+
+        if self.map is None:
+            self.file.write(data)
+        else:
+            if end > len(self.map):
+                self.map.resize((end // self.preallocate + 1) * self.preallocate)
+
+            self.map[self.size:end] = data
+
+        self.size = end
+
+    def sync(self):
+        if self.map is not None:
+            self.map.flush()
+        else:
+            os.fsync(self.file.fileno())
+
+    def close(self, remove=False):
+        """Close the journal, deleting it if `remove` is True."""
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+            self.file.truncate(self.size)
+
+        self.file.close()
+
+        if remove:
+            os.remove(self.file_path)
+
+
+def read_journal(file_path):
+    """Read the valid blocks of a journal.
+
+    Return value:
+        A tuple of `(blocks, end)` where `blocks` is the list of `(kind, n_frames, t_start, t_end,
+        payload)` of the blocks up to the first one missing or corrupted, and `end` is the file
+        offset following the last valid block.
+    """
+    with open(file_path, 'rb') as f:
+        data = memoryview(f.read())
+
+    if data[:len(JOURNAL_MAGIC)] != JOURNAL_MAGIC:
+        raise ValueError('Not a telemetry journal', file_path)
+
+    blocks = []
+    pos = len(JOURNAL_MAGIC)
+
+    while pos + BLOCK_HEADER.size + BLOCK_CRC.size <= len(data):
+        magic, kind, n_frames, length, t_start, t_end = BLOCK_HEADER.unpack_from(data, pos)
+        start = pos + BLOCK_HEADER.size
+        end = start + length
+
+        if magic != BLOCK_MAGIC or end + BLOCK_CRC.size > len(data):
+            break
+
+        crc, = BLOCK_CRC.unpack_from(data, end)
+
+        if zlib.crc32(data[pos:end]) != crc:
+            break
+
+        blocks.append((kind, n_frames, t_start, t_end, bytes(data[start:end])))
+        pos = end + BLOCK_CRC.size
+
+    return blocks, pos
+
+
+def recover_journal(file_path, remove=True, force=False):
+    """Turn a journal left behind by a crash into a clean telemetry log.
+
+    The journal is first truncated after its last valid block. The frames of the journal are then
+    written to an uncompressed log, and the manifest of the flight is replaced by one listing
+    it. The journal is deleted unless `remove` is False.
+
+    If the journal was rotated while recording (see `tlmpipeline.JournalSink`), it holds a
+    checkpoint of the log and only the frames that followed. The segments of the log are then
+    kept up to the checkpoint, the segment written at that time is truncated to the size it had,
+    and the frames of the journal are written to a new segment `<prefix>.recovered<ext>`.
+    Otherwise, the log holds all the frames of the journal and replaces the previous segments.
+
+    Arguments:
+        file_path: The path of the journal
+        remove: True to delete the journal once the log is recovered
+        force: True to replace the log even if its manifest lists more frames than the recovered one
+
+    Return value:
+        A dictionary with the path of the log written from the journal (None if the journal
+        held nothing past its checkpoint), the path of the manifest, the number of frames of the
+        flight, the number of bytes of frames written from the journal, whether the flight ended
+        with a crash marker, and the number of bytes of incomplete blocks and of preallocation
+        padding cut off the journal.
+    """
+    blocks, end = read_journal(file_path)
+
+    if not blocks or blocks[0][0] != BLOCK_META:
+        raise ValueError('Telemetry journal has no valid header', file_path)
+
+    with open(file_path, 'rb') as f:
+        f.seek(end)
+        tail = f.read()
+
+    # The zeros left of the preallocation of a memory-mapped journal are not data
+    padding = len(tail) - len(tail.rstrip(b'\0'))
+
+    if tail:
+        os.truncate(file_path, end)
+
+    meta = json.loads(blocks[0][4])
+    checkpoint = meta.get('checkpoint')
+    folder = path.dirname(file_path)
+    manifest_path = file_path[:-len(JOURNAL_EXTENSION)] + MANIFEST_EXTENSION
+    frames = [x for x in blocks if x[0] == BLOCK_FRAMES]
+    segments = checkpoint['segments'] if checkpoint else []
+    n_frames = sum([x[1] for x in frames]) + sum([x['frames'] for x in segments])
+    old_segments = []
+
+    if path.exists(manifest_path):
+        with open(manifest_path) as f:
+            old_segments = json.load(f)['segments']
+
+        if not force and sum([x['frames'] for x in old_segments]) > n_frames:
+            raise ValueError('Telemetry journal holds fewer frames than the log', file_path)
+
+    if checkpoint:
+        _truncate_segment(folder, segments[-1], checkpoint['offset'])
+
+        name, ext = path.splitext(meta['file'])
+        log_name = name + RECOVERED_SUFFIX + ext
+    else:
+        log_name = meta['file']
+
+    log_path = path.join(folder, log_name)
+    n_bytes = 0
+
+    # A rotated journal with no block past the log header adds nothing to the log
+    if not checkpoint or len(blocks) > 2:
+        tmp_path = log_path + '.tmp'
+
+        with open(tmp_path, 'wb') as f:
+            for kind, _, _, _, payload in blocks[1:]:
+                f.write(payload)
+
+                if kind != BLOCK_LOG_HEADER:
+                    n_bytes += len(payload)
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, log_path)
+
+        segments = segments + [{
+            'file': log_name,
+            'index': None,
+            't_start': frames[0][2] if frames else None,
+            't_end': frames[-1][3] if frames else None,
+            'frames': sum([x[1] for x in frames]),
+            'bytes': n_bytes
+        }]
+    else:
+        log_path = None
+
+    kept = set([x['file'] for x in segments] + [x['index'] for x in segments])
+
+    for segment in old_segments:
+        for name in (segment['file'], segment['index']):
+            if name and name not in kept and path.exists(path.join(folder, name)):
+                os.remove(path.join(folder, name))
+
+    tmp_path = manifest_path + '.tmp'
+
+    with open(tmp_path, 'w') as f:
+        json.dump({
+            'icao': meta['icao'],
+            'format': meta['format'],
+            'compression': checkpoint['compression'] if checkpoint else COMPRESSION_NONE,
+            'segments': segments
+        }, f, indent=1)
+
+    os.replace(tmp_path, manifest_path)
+
+    if remove:
+        os.remove(file_path)
+
+    return {
+        'file': log_path,
+        'manifest': manifest_path,
+        'frames': n_frames,
+        'bytes': n_bytes,
+        'crashed': any(x[0] == BLOCK_CRASH for x in blocks),
+        'truncated': len(tail) - padding,
+        'padding': padding
+    }
+
+
+def _truncate_segment(folder, segment, size):
+    """Cut a segment of a log, and its index, back to a checkpoint."""
+    file_path = path.join(folder, segment['file'])
+
+    if path.getsize(file_path) < size:
+        raise ValueError('Telemetry log is shorter than the journal checkpoint', file_path)
+
+    os.truncate(file_path, size)
+
+    index_path = path.join(folder, segment['index']) if segment['index'] else None
+
+    if not index_path or not path.exists(index_path):
+        return
+
+    lines = []
+
+    with open(index_path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break # Partly written
+
+            if entry['t_end'] > segment['t_end']:
+                break
+
+            lines.append(line)
+
+    with open(index_path + '.tmp', 'w') as f:
+        f.writelines(lines)
+
+    os.replace(index_path + '.tmp', index_path)
+
+
+def find_journals(folder):
+    """Return the journals left behind in a telemetry folder."""
+    return [path.join(folder, x) for x in sorted(os.listdir(folder)) if x.endswith(JOURNAL_EXTENSION)]
+
@@ -0,0 +1,177 @@
+"""Flight metrics computed incrementally while recording.
+
+`FlightMetrics` is updated with each recorded frame in constant time and memory (apart from the
+lists of touchdowns and phase changes), and produces the same summary as
+`tlmanalysis.summarize()` without reading the log back. The definitions of phases and
+touchdowns are shared with `tlmanalysis`: the aircraft is on the ground when the on-ground
+column is set, or, if it is not recorded, when its height above ground is at most
+`GROUND_MARGIN`.
+
+This module has no dependency on X-Plane or NumPy.
+"""
+import os
+import json
+
+
+M_TO_FT = 3.28084
+MS_TO_KTS = 1.943844
+
+GROUND_MARGIN = 5.0 # m - height above ground still considered on ground, if the on-ground column is not recorded
+ROLL_SPEED = 40 / MS_TO_KTS # m/s - ground speed above which the aircraft is on its take-off or landing roll
+CLIMB_RATE = 300 / M_TO_FT / 60 # m/s - vertical speed above which the aircraft is climbing or descending
+
+PHASE_GROUND = 0
+PHASE_ROLL = 1
+PHASE_CLIMB = 2
+PHASE_LEVEL = 3
+PHASE_DESCENT = 4
+
+PHASE_NAMES = ['ground', 'roll', 'climb', 'level', 'descent']
+
+SUMMARY_EXTENSION = '.summary.json' # Appended to the flight prefix
+
+LABEL_T = 't'
+LABEL_HEIGHT = 'height'
+LABEL_ALTITUDE = 'altitude'
+LABEL_GS = 'gs'
+LABEL_IAS = 'ias'
+LABEL_ROLL = 'roll'
+LABEL_PITCH = 'pitch'
+LABEL_FF = 'ff'
+LABEL_G = 'g_nrml'
+LABEL_ON_GROUND = 'on_ground'
+
+REQUIRED_LABELS = [LABEL_T, LABEL_HEIGHT, LABEL_ALTITUDE, LABEL_GS]
+
+
+class FlightMetrics:
+    def __init__(self, icao=None, n_engines=0):
+        """Start the metrics of a flight.
+
+        Arguments:
+            icao: The aircraft ICAO code
+            n_engines: The number of fuel flow values per frame (0 if fuel flow is not recorded)
+        """
+        self.icao = icao
+        self.frames = 0
+        self.crashed = False
+        self.t_start = None
+        self.t = None # Time of the previous frame
+        self.height = None # Height of the previous frame
+        self.altitude = None # Altitude of the previous frame
+        self.ff = None # Fuel flow of the previous frame
+        self.on_ground = None # True if the previous frame was on the ground
+        self.phase = None # Phase of the previous frame
+        self.touchdowns = [] # Tuples of (t, vertical speed [fpm])
+        self.phases = [] # Lists of [phase name, t_start, t_end]
+        self.phase_durations = [0.0] * len(PHASE_NAMES)
+        self.fuel_burn = [0.0] * n_engines
+        self.fuel_burn_phases = [0.0] * len(PHASE_NAMES)
+        self.max_bank = 0.0
+        self.max_pitch = None
+        self.max_ias = None
+        self.max_altitude = None
+        self.max_g = None
+        self.min_g = None
+
+    def update(self, t, height, altitude, gs, ias=None, roll=None, pitch=None, ff=None, g=None, on_ground=None):
+        """Add a frame. Optional values are None when they are not recorded."""
+        first = self.t is None
+        dt = 0 if first else t - self.t
+
+        if first:
+            self.t_start = t
+
+        # Vertical speeds over the interval preceding this frame; the first frame has none
+        vs_height = (height - self.height) / dt if dt > 0 else 0
+        vs_altitude = (altitude - self.altitude) / dt if dt > 0 else 0
+        on_ground = bool(on_ground) if on_ground is not None else height <= GROUND_MARGIN
+
+        if on_ground:
+            phase = PHASE_GROUND if abs(gs) < ROLL_SPEED else PHASE_ROLL
+        elif vs_altitude > CLIMB_RATE:
+            phase = PHASE_CLIMB
+        elif vs_altitude < -CLIMB_RATE:
+            phase = PHASE_DESCENT
+        else:
+            phase = PHASE_LEVEL
+
+        if not first:
+            # The interval preceding this frame belongs to the phase of the previous frame
+            self.phase_durations[self.phase] += dt
+
+            if on_ground and not self.on_ground:
+                self.touchdowns.append((t, vs_height * M_TO_FT * 60))
+
+            if ff is not None and self.ff is not None:
+                for k, (x, x_prev) in enumerate(zip(ff, self.ff)):
+                    burn = (x + x_prev) / 2 * dt
+                    self.fuel_burn[k] += burn
+                    self.fuel_burn_phases[self.phase] += burn
+
+        if phase != self.phase:
+            self.phases.append([PHASE_NAMES[phase], t, t])
+        else:
+            self.phases[-1][2] = t
+
+        if roll is not None:
+            self.max_bank = max(self.max_bank, abs(roll))
+
+        if pitch is not None:
+            self.max_pitch = pitch if self.max_pitch is None else max(self.max_pitch, pitch)
+
+        if ias is not None:
+            self.max_ias = ias if self.max_ias is None else max(self.max_ias, ias)
+
+        if g is not None:
+            self.max_g = g if self.max_g is None else max(self.max_g, g)
+            self.min_g = g if self.min_g is None else min(self.min_g, g)
+
+        self.max_altitude = altitude if self.max_altitude is None else max(self.max_altitude, altitude)
+        self.frames += 1
+        self.t = t
+        self.height = height
+        self.altitude = altitude
+        self.ff = list(ff) if ff is not None else None
+        self.on_ground = on_ground
+        self.phase = phase
+
+    def summary(self):
+        """Return a dictionary of flight metrics (see `tlmanalysis.summarize()`)."""
+        if not self.frames:
+            return {'frames': 0}
+
+        summary = {
+            'icao': self.icao,
+            'frames': self.frames,
+            'crashed': self.crashed,
+            't_start': self.t_start,
+            't_end': self.t,
+            'touchdowns': self.touchdowns,
+            'max_bank': self.max_bank,
+            'max_pitch': self.max_pitch,
+            'max_ias': self.max_ias,
+            'max_altitude_ft': self.max_altitude * M_TO_FT,
+            'phases': [tuple(x) for x in self.phases],
+            'phase_durations': dict(zip(PHASE_NAMES, self.phase_durations))
+        }
+
+        if self.fuel_burn:
+            summary['fuel_burn'] = self.fuel_burn
+            summary['fuel_burn_total'] = sum(self.fuel_burn)
+            summary['fuel_burn_phases'] = dict(zip(PHASE_NAMES, self.fuel_burn_phases))
+
+        if self.max_g is not None:
+            summary['max_g'] = self.max_g
+            summary['min_g'] = self.min_g
+
+        return summary
+
+    def write(self, file_path):
+        """Write the summary as JSON, replacing the file atomically."""
+        tmp_path = file_path + '.tmp'
+
+        with open(tmp_path, 'w') as f:
+            json.dump(self.summary(), f, indent=1)
+
+        os.replace(tmp_path, file_path)
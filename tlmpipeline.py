@@ -0,0 +1,605 @@
+"""Telemetry pipeline: frame transforms and sinks.
+
+Each frame is read once into the frame buffer (see `tlmframe.FrameReader`), then goes through
+the transform stages in order, and is finally consumed by any number of sinks.
+
+Transforms are configuration objects compiled for a schema by `compile_transforms()`:
+
+    Convert: Add a column with the values of another column converted, e.g. into other units
+    Derive: Add a column computed from the values of other columns
+    Derivative: Add a column with the rate of change of another column
+    Filter: Drop the frames for which a condition does not hold
+
+Sinks receive either every frame as soon as it is recorded (`Sink.frame()`), or blocks of frames
+each time the frame buffer is flushed (`Sink.block()`), and apply their own buffering on top:
+
+    FileSink: Telemetry file in any format and compression, written on its own writer thread
+    StreamSink: Live stream over UDP or a Unix socket (see `tlmstream`)
+    RingSink: The most recent frames in memory, e.g. for on-screen display
+    JournalSink: Crash-safe journal of the frames, deleted when the flight ends (see `tlmjournal`)
+    MetricsSink: Flight metrics computed on the fly, written as a summary file (see `tlmmetrics`)
+
+This module has no dependency on X-Plane.
+"""
+import os
+import json
+import collections
+
+from os import path
+
+from tlmformat import (
+    TYPE_FLOAT, TYPE_DOUBLE, TYPE_FLOAT_ARRAY, FORMAT_CSV, COMPRESSION_NONE, ENCODERS, FILE_EXTENSIONS
+)
+from tlmwriter import AsyncWriter, TelemetryOutput, POLICY_DROP_OLDEST
+from tlmstream import StreamSender, PACKET_CRASH
+from tlmjournal import (
+    JOURNAL_EXTENSION, BLOCK_META, BLOCK_LOG_HEADER, BLOCK_FRAMES, BLOCK_CRASH, JournalWriter
+)
+from tlmmetrics import (
+    SUMMARY_EXTENSION, REQUIRED_LABELS, LABEL_T, LABEL_HEIGHT, LABEL_ALTITUDE, LABEL_GS, LABEL_IAS,
+    LABEL_ROLL, LABEL_PITCH, LABEL_FF, LABEL_G, LABEL_ON_GROUND, FlightMetrics
+)
+
+
+SINK_FILE = 'file'
+SINK_STREAM = 'stream'
+SINK_RING = 'ring'
+SINK_JOURNAL = 'journal'
+SINK_METRICS = 'metrics'
+
+
+def column_index(columns):
+    """Return the tuple of `(first flat column, array length)` of each column of a schema, by label."""
+    index = {}
+    i = 0
+
+    for label, _, col_length in columns:
+        index[label] = (i, col_length)
+        i += col_length or 1
+
+    return index
+
+
+def _getter(index, label):
+    """Return a function reading the value of `label` in a slot of the flat columns."""
+    i, n = index[label]
+
+    if n:
+        return lambda columns, slot: [col[slot] for col in columns[i:i + n]]
+
+    return lambda columns, slot: columns[i][slot]
+
+
+class Convert:
+    def __init__(self, label, func, new_label):
+        """Convert the values of `label` with `func` into the new column `new_label`.
+
+        Float and double columns keep their type, other types are converted into float columns.
+        Recorded columns are not converted in place, since values held from the previous frame
+        would be converted again.
+        """
+        self.label = label
+        self.func = func
+        self.new_label = new_label
+
+    def output_columns(self, columns):
+        _, col_type, col_length = next(x for x in columns if x[0] == self.label)
+
+        if col_type not in (TYPE_FLOAT, TYPE_DOUBLE):
+            col_type = TYPE_FLOAT_ARRAY if col_length else TYPE_FLOAT
+
+        return [(self.new_label, col_type, col_length)]
+
+    def compile(self, index):
+        src, n = index[self.label]
+        dst, _ = index[self.new_label]
+        func = self.func
+        pairs = [(src + k, dst + k) for k in range(n or 1)]
+
+        def apply(columns, slot, prev, first):
+            for i, j in pairs:
+                columns[j][slot] = func(columns[i][slot])
+
+        return apply
+
+
+class Derive:
+    def __init__(self, label, col_type, func, inputs):
+        """Add the scalar column `label` of type `col_type`, computed as `func(*values of inputs)`."""
+        self.label = label
+        self.col_type = col_type
+        self.func = func
+        self.inputs = inputs
+
+    def output_columns(self, columns):
+        return [(self.label, self.col_type, 0)]
+
+    def compile(self, index):
+        getters = [_getter(index, x) for x in self.inputs]
+        dst, _ = index[self.label]
+        func = self.func
+
+        def apply(columns, slot, prev, first):
+            columns[dst][slot] = func(*[get(columns, slot) for get in getters])
+
+        return apply
+
+
+class Derivative:
+    def __init__(self, label, source, scale=1):
+        """Add the column `label` with the rate of change per second of the scalar column `source`, times `scale`."""
+        self.label = label
+        self.source = source
+        self.scale = scale
+
+    def output_columns(self, columns):
+        return [(self.label, TYPE_FLOAT, 0)]
+
+    def compile(self, index):
+        src, _ = index[self.source]
+        dst, _ = index[self.label]
+        scale = self.scale
+
+        def apply(columns, slot, prev, first):
+            t = columns[0]
+            dt = t[slot] - t[prev]
+
+            if first:
+                columns[dst][slot] = 0
+            elif dt > 0:
+                columns[dst][slot] = (columns[src][slot] - columns[src][prev]) / dt * scale
+            else:
+                columns[dst][slot] = columns[dst][prev]
+
+        return apply
+
+
+class Filter:
+    def __init__(self, func, inputs):
+        """Keep only the frames for which `func(*values of inputs)` is true."""
+        self.func = func
+        self.inputs = inputs
+
+    def output_columns(self, columns):
+        return []
+
+    def compile(self, index):
+        getters = [_getter(index, x) for x in self.inputs]
+        func = self.func
+
+        def apply(columns, slot, prev, first):
+            return bool(func(*[get(columns, slot) for get in getters]))
+
+        return apply
+
+
+def transform_columns(transforms, columns):
+    """Return the schema of the frames after the transforms, given the schema of the frames read."""
+    out = list(columns)
+
+    for transform in transforms:
+        out.extend(transform.output_columns(out))
+
+    return out
+
+
+def compile_transforms(transforms, columns):
+    """Compile transforms for the schema returned by `transform_columns()`.
+
+    Return value:
+        A list of functions `apply(columns, slot, prev, first)` taking the flat columns of the
+        frame buffer, the slot of the frame and of the previous one, and True if there is no
+        previous frame (first frame, or first frame after dropped ones). A function returning
+        False drops the frame.
+    """
+    index = column_index(columns)
+
+    return [x.compile(index) for x in transforms]
+
+
+class Sink:
+    """Base class of sinks. Sinks only override the methods they need."""
+    wants_frames = False # True to receive each frame
+    wants_blocks = False # True to receive blocks of frames
+
+    def open(self, prefix, columns, icao):
+        """Start a flight with the given file prefix and schema."""
+
+    def frame(self, columns, slot):
+        """Consume the frame in `slot` of the flat `columns` of the frame buffer."""
+
+    def block(self, block, phases):
+        """Consume a block of frames (see `tlmbuffer.FrameBuffer.take()`) recorded during `phases`."""
+
+    def crash(self):
+        """Mark the end of the flight with a crash."""
+
+    def close(self):
+        """End the flight, writing everything buffered."""
+
+    def release(self):
+        """Free the resources of the sink, when the plugin is disabled."""
+
+
+class FileSink(Sink):
+    """Telemetry file written by an `AsyncWriter`.
+
+    Blocks are handed to the writer thread once at least `flush_frames` frames are pending.
+    """
+    wants_blocks = True
+
+    def __init__(self, format=FORMAT_CSV, encoder_options=None, compression=COMPRESSION_NONE, suffix='',
+                 fsync=True, max_bytes=0, max_frames=0, max_seconds=0, index_interval=0,
+                 queue_size=16, policy=POLICY_DROP_OLDEST, flush_frames=0, stats=None):
+        """Create the sink.
+
+        Arguments:
+            format: The telemetry format (see `tlmformat.ENCODERS`)
+            encoder_options: Additional encoder arguments by format
+            suffix: Appended to the flight prefix, to tell apart several file sinks of the same format
+            flush_frames: Minimum number of frames handed to the writer at once
+            stats: Optional `tlmstats.TelemetryStats`
+            The other arguments are the ones of `TelemetryOutput` and `AsyncWriter`.
+        """
+        self.format = format
+        self.encoder_options = (encoder_options or {}).get(format, {})
+        self.output_options = dict(
+            compression=compression,
+            fsync=fsync,
+            max_bytes=max_bytes,
+            max_frames=max_frames,
+            max_seconds=max_seconds,
+            index_interval=index_interval
+        )
+        self.suffix = suffix
+        self.queue_size = queue_size
+        self.policy = policy
+        self.flush_frames = flush_frames
+        self.stats = stats
+        self.encoder = None
+        self.writer = None
+        self.pending = [] # Tuples of (block, phases) waiting for `flush_frames`
+        self.n_pending = 0 # Number of frames in `pending`
+        self.dropped = 0 # Number of blocks of the last flight dropped by the writer
+        self.errors = 0 # Number of write errors of the last flight
+
+    @property
+    def complete(self):
+        """True if every block of the current or last flight was written to the file so far."""
+        if self.writer:
+            return not self.writer.dropped and not self.writer.errors
+
+        return not self.dropped and not self.errors
+
+    @property
+    def checkpoint(self):
+        """Checkpoint of the log after the last frames flushed by the writer (see `TelemetryOutput.checkpoint()`).
+
+        Only meaningful while the log is `complete`, which must be checked after reading it.
+        """
+        return self.writer.checkpoint if self.writer else None
+
+    def open(self, prefix, columns, icao):
+        self.close()
+
+        self.dropped = 0
+        self.errors = 0
+
+        self.encoder = ENCODERS[self.format](columns, icao, **self.encoder_options)
+        output = TelemetryOutput(prefix + self.suffix, self.encoder, **self.output_options)
+        self.writer = AsyncWriter(output, max_blocks=self.queue_size, policy=self.policy, stats=self.stats)
+
+    def block(self, block, phases):
+        self.pending.append((block, phases))
+        self.n_pending += len(block[0])
+
+        if self.n_pending >= self.flush_frames:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        if len(self.pending) == 1:
+            block, phases = self.pending[0]
+        else:
+            block = [sum(cols[1:], cols[0]) for cols in zip(*[x for x, _ in self.pending])]
+            phases = sorted(set().union(*[x for _, x in self.pending]))
+
+        self.writer.write(block, phases)
+        self.pending.clear()
+        self.n_pending = 0
+
+    def crash(self):
+        if self.writer:
+            self.flush()
+            self.writer.write_raw(self.encoder.crash_marker())
+
+    def close(self):
+        if self.writer:
+            self.flush()
+            self.writer.close() # Drains the queue before closing the output
+            self.dropped = self.writer.dropped
+            self.errors = self.writer.errors
+            self.writer = None
+
+
+class StreamSink(Sink):
+    """Live stream of frames (see `tlmstream.StreamSender`)."""
+    wants_frames = True
+
+    def __init__(self, address, max_rate=20, schema_interval=5):
+        self.sender = StreamSender(address, max_rate=max_rate, schema_interval=schema_interval)
+
+    def open(self, prefix, columns, icao):
+        self.sender.set_schema(columns, icao)
+
+    def frame(self, columns, slot):
+        self.sender.publish(columns, slot)
+
+    def crash(self):
+        self.sender.send(PACKET_CRASH)
+
+    def release(self):
+        self.sender.close()
+
+
+class RingSink(Sink):
+    """The most recent frames, kept in memory.
+
+    Frames are tuples of the flat values of `labels`, or of all the columns if not set.
+    """
+    wants_frames = True
+
+    def __init__(self, capacity=600, labels=None):
+        self.labels = labels
+        self.frames = collections.deque(maxlen=capacity)
+        self.flat = [] # Flat columns of `labels`
+
+    def open(self, prefix, columns, icao):
+        index = column_index(columns)
+        labels = self.labels or [x[0] for x in columns]
+
+        self.frames.clear()
+        self.flat = [i + k for i, n in (index[x] for x in labels if x in index) for k in range(n or 1)]
+
+    def frame(self, columns, slot):
+        self.frames.append(tuple([columns[i][slot] for i in self.flat]))
+
+    @property
+    def latest(self):
+        return self.frames[-1] if self.frames else None
+
+
+class JournalSink(Sink):
+    """Journal of the frames, from which the log can be recovered if the simulator dies (see `tlmjournal`).
+
+    Frames are written in a block as soon as `max_frames` frames or `max_seconds` of recording
+    are pending, which bounds the frames lost in a crash independently of the frame buffer. The
+    journal is deleted when the flight is closed, so this sink must come after the file sinks. It
+    is kept if one of `file_sinks` is incomplete, as the journal then holds frames missing from
+    the log.
+
+    Once the journal reaches `max_bytes`, it is rotated: it is rewritten with only the frames
+    that the writer of the log has not flushed yet, and a checkpoint of the log from which
+    recovery continues. The log is the one of the first file sink without suffix, which must be
+    in the format of the journal and synced to disk if the journal is. The journal is no longer
+    rotated once the log misses blocks.
+    """
+    wants_frames = True
+
+    def __init__(self, format=FORMAT_CSV, encoder_options=None, max_frames=10, max_seconds=1, max_bytes=1048576,
+                 preallocate=1048576, fsync=False, file_sinks=None):
+        """Create the sink.
+
+        Arguments:
+            format: The telemetry format of the recovered log (see `tlmformat.ENCODERS`)
+            encoder_options: Additional encoder arguments by format
+            max_frames: Maximum number of frames waiting to be written (0 for no limit)
+            max_seconds: Maximum time span of the frames waiting to be written (0 for no limit)
+            max_bytes: Size of the journal from which it is rotated, in bytes (0 to keep the whole flight)
+            file_sinks: The `FileSink`s whose logs the journal duplicates
+            The other arguments are the ones of `tlmjournal.JournalWriter`.
+        """
+        self.format = format
+        self.encoder_options = (encoder_options or {}).get(format, {})
+        self.max_frames = max_frames or float('inf')
+        self.max_seconds = max_seconds or float('inf')
+        self.max_bytes = max_bytes
+        self.preallocate = preallocate
+        self.fsync = fsync
+        self.file_sinks = file_sinks or []
+        self.encoder = None
+        self.journal = None
+        self.meta = None
+        self.log_sink = None # File sink of the log, while the journal can be rotated
+        self.rows = [] # Frames waiting to be written
+        self.unconfirmed = [] # Frames written to the journal that may not be flushed to the log yet
+        self.t_confirmed = None # Time of the last frame of the log at the checkpoint of the journal
+
+    def open(self, prefix, columns, icao):
+        self.close()
+
+        self.encoder = ENCODERS[self.format](columns, icao, **self.encoder_options)
+        self.meta = {
+            'format': self.format,
+            'icao': icao,
+            'file': path.basename(prefix) + FILE_EXTENSIONS[self.format]
+        }
+        self.log_sink = None
+        self.t_confirmed = None
+
+        if self.max_bytes:
+            for sink in self.file_sinks:
+                if not sink.suffix:
+                    if sink.format == self.format and (sink.output_options['fsync'] or not self.fsync):
+                        self.log_sink = sink
+
+                    break
+
+        self.journal = JournalWriter(prefix + JOURNAL_EXTENSION, self.preallocate, self.fsync)
+        self.journal.append(BLOCK_META, json.dumps(self.meta).encode())
+        self.journal.append(BLOCK_LOG_HEADER, self.encoder.header())
+
+    def frame(self, columns, slot):
+        if not self.journal:
+            return
+
+        rows = self.rows
+        rows.append(tuple([col[slot] for col in columns]))
+
+        if len(rows) >= self.max_frames or rows[-1][0] - rows[0][0] >= self.max_seconds:
+            self.commit()
+
+    def commit(self):
+        """Write the pending frames."""
+        rows = self.rows
+
+        if rows and self.t_confirmed is not None and rows[0][0] <= self.t_confirmed:
+            # Frames flushed to the log before being journaled are recovered from the log
+            rows[:] = [x for x in rows if x[0] > self.t_confirmed]
+
+        if rows:
+            self.journal.append(BLOCK_FRAMES, self.encoder.encode_rows(rows), len(rows), rows[0][0], rows[-1][0])
+
+            if self.log_sink:
+                self.unconfirmed.extend(rows)
+
+                if self.journal.size >= self.max_bytes:
+                    self.rotate()
+
+            rows.clear()
+
+    def rotate(self):
+        """Rewrite the journal without the frames flushed to the log, if there are any."""
+        checkpoint = self.log_sink.checkpoint
+
+        if not self.log_sink.complete:
+            # Frames missing from the log are only in the journal from now on
+            self.log_sink = None
+            self.unconfirmed.clear()
+
+            return
+
+        if checkpoint is None:
+            return
+
+        times = [x['t_end'] for x in checkpoint['segments'] if x['t_end'] is not None]
+
+        if not times:
+            return
+
+        unconfirmed = self.unconfirmed
+        n = 0
+
+        while n < len(unconfirmed) and unconfirmed[n][0] <= times[-1]:
+            n += 1
+
+        if not n:
+            return
+
+        rows = unconfirmed[n:]
+        file_path = self.journal.file_path
+        tmp_path = file_path + '.tmp'
+
+        try:
+            journal = JournalWriter(tmp_path, fsync=self.fsync)
+            journal.append(BLOCK_META, json.dumps(dict(self.meta, checkpoint=checkpoint)).encode())
+            journal.append(BLOCK_LOG_HEADER, self.encoder.header())
+
+            if rows:
+                journal.append(BLOCK_FRAMES, self.encoder.encode_rows(rows), len(rows), rows[0][0], rows[-1][0])
+
+            journal.close()
+        except OSError as exc:
+            print('telemetry: Warning Could not rotate journal %s. Keeping the whole flight in it...' % file_path)
+            print(exc)
+
+            self.log_sink = None
+            self.unconfirmed.clear()
+
+            return
+
+        self.journal.close()
+        os.replace(tmp_path, file_path)
+        self.journal = JournalWriter(file_path, self.preallocate, self.fsync, append=True)
+
+        del unconfirmed[:n]
+        self.t_confirmed = times[-1]
+
+    def crash(self):
+        if self.journal:
+            self.commit()
+            self.journal.append(BLOCK_CRASH, self.encoder.crash_marker())
+
+    def close(self):
+        if self.journal:
+            # The file sinks are closed, so the log is complete unless blocks were dropped or failed to be written
+            complete = all([x.complete for x in self.file_sinks])
+
+            if not complete:
+                self.commit()
+                print('telemetry: Warning The telemetry log is incomplete. Keeping journal %s for recovery' % self.journal.file_path)
+
+            self.journal.close(remove=complete)
+            self.journal = None
+
+        self.rows.clear()
+        self.unconfirmed.clear()
+
+
+class MetricsSink(Sink):
+    """Flight metrics updated with each frame, written to `<prefix>.summary.json` at the end of the flight.
+
+    Schemas without the columns of `tlmmetrics.REQUIRED_LABELS` produce no summary; optional
+    columns missing from the schema are left out of it.
+    """
+    wants_frames = True
+
+    def __init__(self):
+        self.metrics = None
+        self.file_path = None
+        self.getters = None # Getters of the arguments of `FlightMetrics.update()`
+
+    def open(self, prefix, columns, icao):
+        self.close()
+
+        index = column_index(columns)
+
+        if any(x not in index for x in REQUIRED_LABELS):
+            print('telemetry: Warning flight metrics need the columns %s' % ', '.join(REQUIRED_LABELS))
+            return
+
+        optional = [LABEL_IAS, LABEL_ROLL, LABEL_PITCH, LABEL_FF, LABEL_G, LABEL_ON_GROUND]
+        n_engines = index[LABEL_FF][1] if LABEL_FF in index else 0
+
+        self.getters = [_getter(index, x) for x in (LABEL_T, LABEL_HEIGHT, LABEL_ALTITUDE, LABEL_GS)]
+        self.getters += [_getter(index, x) if x in index else None for x in optional]
+        self.metrics = FlightMetrics(icao, n_engines)
+        self.file_path = prefix + SUMMARY_EXTENSION
+
+    def frame(self, columns, slot):
+        if self.metrics:
+            self.metrics.update(*[get(columns, slot) if get else None for get in self.getters])
+
+    def crash(self):
+        if self.metrics:
+            self.metrics.crashed = True
+
+    def close(self):
+        if self.metrics and self.metrics.frames:
+            try:
+                self.metrics.write(self.file_path)
+            except OSError as exc:
+                print('telemetry: Error writing the flight summary %s: %s' % (self.file_path, exc))
+
+        self.metrics = None
+
+
+SINK_CLASSES = {
+    SINK_FILE: FileSink,
+    SINK_STREAM: StreamSink,
+    SINK_RING: RingSink,
+    SINK_JOURNAL: JournalSink,
+    SINK_METRICS: MetricsSink
+}
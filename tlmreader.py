@@ -0,0 +1,152 @@
+"""Random access to telemetry logs through their index sidecars.
+
+This module has no dependency on X-Plane so that it can be used by offline tools.
+"""
+import json
+import bisect
+import itertools
+
+from os import path
+from tlmformat import CRASH_TIME, open_reader, open_log_at
+from tlmwriter import INDEX_EXTENSION
+
+
+def read_index(file_path):
+    """Return the index entries of a telemetry file, or an empty list if it has no index."""
+    index_path = file_path + INDEX_EXTENSION
+    entries = []
+
+    if path.exists(index_path):
+        with open(index_path) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    break # Partial line written before a crash
+
+    return entries
+
+
+class IndexedLog:
+    """A telemetry file whose frames can be read by time range or sampling phase.
+
+    Records are flat tuples of values, as returned by the readers in `tlmformat`. Without an
+    index, reading falls back to scanning the file from the start.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.reader = open_reader(file_path)
+        self.index = read_index(file_path)
+        self.index_ends = [x['t_end'] for x in self.index]
+
+    @property
+    def columns(self):
+        return self.reader.columns
+
+    @property
+    def labels(self):
+        return self.reader.labels
+
+    def close(self):
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def t_range(self):
+        """Tuple of (first, last) frame time according to the index, or None if not indexed."""
+        if not self.index:
+            return None
+
+        return self.index[0]['t_start'], self.index[-1]['t_end']
+
+    @property
+    def phases(self):
+        """Set of sampling phases found in the index."""
+        return set(itertools.chain.from_iterable(x['phases'] for x in self.index))
+
+    def _records_at(self, offset):
+        """Yield the records from the raw file offset `offset`, or from the first one if None."""
+        if offset is None:
+            reader = open_reader(self.file_path)
+            stream = reader.file
+            records = reader.records()
+        else:
+            stream = open_log_at(self.file_path, offset)
+            records = self.reader.records(stream)
+
+        try:
+            for record in records:
+                if record[0] != CRASH_TIME:
+                    yield record
+        finally:
+            stream.close()
+
+    def frames(self, t_start=None, t_end=None):
+        """Yield the records whose time is between `t_start` and `t_end` (inclusive).
+
+        The index is bisected to find the first entry that can contain `t_start`, or the last
+        entry if `t_start` is past the index, and reading stops at the first record past `t_end`.
+        """
+        offset = None
+
+        if t_start is not None and self.index:
+            # Frames written after the last index entry are still in the file, so a start past the
+            # end of the index reads from the last entry
+            i = min(bisect.bisect_left(self.index_ends, t_start), len(self.index) - 1)
+            offset = self.index[i]['offset']
+
+        for record in self._records_at(offset):
+            t = record[0]
+
+            if t_start is not None and t < t_start:
+                continue
+
+            if t_end is not None and t > t_end:
+                break
+
+            yield record
+
+    def phase_frames(self, phase):
+        """Yield the records of the index entries recorded while `phase` was active.
+
+        The granularity is one index entry, so records recorded in other phases can be included.
+        """
+        for entry in self.index:
+            if phase in entry['phases']:
+                yield from itertools.islice(self._records_at(entry['offset']), entry['frames'])
+
+
+class FlightLog:
+    """A flight made of one or more segments listed in a manifest (see `tlmwriter.TelemetryOutput`)."""
+
+    def __init__(self, manifest_path):
+        with open(manifest_path) as f:
+            self.manifest = json.load(f)
+
+        folder = path.dirname(manifest_path)
+
+        self.segments = [(path.join(folder, x['file']), x) for x in self.manifest['segments']]
+
+    def frames(self, t_start=None, t_end=None):
+        """Yield the records between `t_start` and `t_end`, only opening the segments covering that range."""
+        for file_path, segment in self.segments:
+            if segment['t_end'] is not None and t_start is not None and segment['t_end'] < t_start:
+                continue
+
+            if segment['t_start'] is not None and t_end is not None and segment['t_start'] > t_end:
+                break
+
+            with IndexedLog(file_path) as log:
+                yield from log.frames(t_start, t_end)
+
+    def phase_frames(self, phase):
+        """Yield the records recorded while `phase` was active, across all segments."""
+        for file_path, _ in self.segments:
+            with IndexedLog(file_path) as log:
+                yield from log.phase_frames(phase)
@@ -0,0 +1,88 @@
+"""Telemetry sampling profiles.
+
+A sampling profile is a list of phases in priority order. Each phase is a tuple of
+`(name, interval, rules)`, where `interval` is the recording interval in seconds while the phase
+is active and `rules` is a list of `(label, operator, threshold, hysteresis)` tuples which must
+all hold for the phase to be entered. The operator is either `'<'` or `'>'`.
+
+Once a phase is active, its thresholds are relaxed by the hysteresis value so that the phase
+is not left as soon as a value oscillates around a threshold. A phase with no rules always
+holds and should be the last one of the profile.
+"""
+from tlmbuffer import flat_columns
+
+
+OP_LT = '<'
+OP_GT = '>'
+
+
+class SamplingProfile:
+    def __init__(self, phases, columns, conversions=None):
+        """Compile a sampling profile for a telemetry schema.
+
+        Arguments:
+            phases: The list of phases (see the module documentation)
+            columns: The telemetry schema
+            conversions: Dictionary of functions converting the recorded value of a label
+                to the units used by the rules
+        """
+        conversions = conversions or {}
+        labels = [label for label, _ in flat_columns(columns)]
+
+        self.phases = [] # Tuples of (name, interval, compiled rules)
+        self.current = None # Index of the active phase
+
+        for name, interval, rules in phases:
+            compiled = []
+
+            for label, op, threshold, hysteresis in rules:
+                if op not in (OP_LT, OP_GT):
+                    raise ValueError('Invalid sampling rule operator', op)
+
+                if label not in labels:
+                    print('telemetry: Warning label %s is not recorded. Ignoring phase %s...' % (label, name))
+                    compiled = None
+
+                    break
+
+                compiled.append((labels.index(label), op == OP_LT, threshold, hysteresis, conversions.get(label)))
+
+            if compiled is not None:
+                self.phases.append((name, interval, compiled))
+
+    @property
+    def phase(self):
+        """Name of the active phase."""
+        return self.phases[self.current][0] if self.current is not None else None
+
+    def update(self, buffer):
+        """Select the active phase from the most recent frame in `buffer` and return its interval.
+
+        Return value:
+            The recording interval, or None if no phase holds.
+        """
+        columns = buffer.columns
+        slot = buffer.last_slot
+
+        for i, (_, interval, rules) in enumerate(self.phases):
+            active = i == self.current
+
+            for col, is_lt, threshold, hysteresis, convert in rules:
+                value = columns[col][slot]
+
+                if convert:
+                    value = convert(value)
+
+                if active:
+                    threshold = threshold + hysteresis if is_lt else threshold - hysteresis
+
+                if (value >= threshold) if is_lt else (value <= threshold):
+                    break
+            else:
+                self.current = i
+
+                return interval
+
+        self.current = None
+
+        return None
@@ -0,0 +1,143 @@
+"""Instrumentation of the telemetry recorder's own overhead.
+
+Durations and sizes are counted in histograms with fixed, logarithmic buckets, so that adding a
+sample is a bisection and an increment. Histograms are rolling: every `interval` seconds, a
+summary of the window is kept as the latest snapshot and the histograms start over.
+
+Samples are added from both the flight loop and the writer thread without locking. A sample
+added while a window is being rolled can be lost, which is acceptable for statistics.
+
+This module has no dependency on X-Plane.
+"""
+import bisect
+
+
+DURATION_BOUNDS = [1e-6 * 2 ** (k / 2) for k in range(41)] # s - 1 us to 1 s, half-octave buckets
+SIZE_BOUNDS = [2 ** k for k in range(33)] # bytes - 1 B to 4 GB
+
+DURATION_SCALE = 1e6 # Durations are summarized in microseconds
+
+STATS_KEYS = ['count', 'mean', 'p50', 'p95', 'p99', 'max']
+
+
+class Histogram:
+    def __init__(self, bounds):
+        """Create a histogram with buckets ending at `bounds` (sorted), plus an overflow bucket."""
+        self.bounds = bounds
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Return the upper bound of the bucket holding the `q` quantile, capped to the maximum."""
+        if not self.count:
+            return 0
+
+        rank = q * self.count
+        seen = 0
+
+        for i, n in enumerate(self.counts):
+            seen += n
+
+            if seen >= rank and n:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+
+        return self.max
+
+    def summary(self, scale=1):
+        """Return a dictionary of `STATS_KEYS`, with values multiplied by `scale`."""
+        return {
+            'count': self.count,
+            'mean': self.total / self.count * scale if self.count else 0,
+            'p50': self.quantile(0.5) * scale,
+            'p95': self.quantile(0.95) * scale,
+            'p99': self.quantile(0.99) * scale,
+            'max': self.max * scale
+        }
+
+
+class TelemetryStats:
+    """Rolling histograms of the recorder's overhead.
+
+    Metrics:
+        callback: Duration of the flight loop callback (us)
+        frame: Duration of reading a whole frame (us)
+        flush: Duration of handing the buffer to the writer, on the sim thread (us)
+        write: Duration of encoding, writing and syncing a batch of blocks, on the writer thread (us)
+        bytes: Encoded size of each block written (bytes)
+        columns: Duration of reading each dataref, by column label (us)
+    """
+
+    METRICS = ['callback', 'frame', 'flush', 'write', 'bytes']
+
+    def __init__(self, interval):
+        self.interval = interval # seconds - length of a window
+        self.callback = Histogram(DURATION_BOUNDS)
+        self.frame = Histogram(DURATION_BOUNDS)
+        self.flush = Histogram(DURATION_BOUNDS)
+        self.write = Histogram(DURATION_BOUNDS)
+        self.bytes = Histogram(SIZE_BOUNDS)
+        self.labels = [] # Labels of the datarefs read in each frame
+        self.reads = [] # Histograms of read durations matching `labels`
+        self.window_start = None
+        self.snapshot = {} # Summary of the last complete window (see `summary()`)
+
+    def set_columns(self, labels):
+        """Start timing the reads of a new set of datarefs."""
+        self.labels = list(labels)
+        self.reads = [Histogram(DURATION_BOUNDS) for _ in self.labels]
+
+    def summary(self):
+        """Return the summary of the current window by metric name, with reads by label under `columns`."""
+        summary = {
+            name: getattr(self, name).summary(1 if name == 'bytes' else DURATION_SCALE)
+            for name in self.METRICS
+        }
+        summary['columns'] = {
+            label: hist.summary(DURATION_SCALE)
+            for label, hist in zip(self.labels, self.reads)
+            if hist.count
+        }
+
+        return summary
+
+    def roll(self, now):
+        """Close the current window if it is older than `interval` seconds.
+
+        Return value:
+            The summary of the closed window, or None if the window is still open.
+        """
+        if self.window_start is None:
+            self.window_start = now
+
+            return None
+
+        if now - self.window_start < self.interval:
+            return None
+
+        self.snapshot = self.summary()
+        self.window_start = now
+
+        for name in self.METRICS:
+            getattr(self, name).reset()
+
+        for hist in self.reads:
+            hist.reset()
+
+        return self.snapshot
+
+    def value(self, metric, key):
+        """Return a value of the last complete window, or 0 if there is none yet."""
+        return self.snapshot.get(metric, {}).get(key, 0)
@@ -0,0 +1,184 @@
+"""Live telemetry streaming over UDP or Unix domain datagram sockets.
+
+Each datagram starts with a packet header (see `PACKET_HEADER`) holding the packet kind, the ID
+of the schema the packet belongs to and a sequence number, so that receivers can detect lost
+packets. The payload of each kind is:
+
+    PACKET_SCHEMA: The JSON schema of the binary format (see `tlmformat.BinaryEncoder.schema()`)
+    PACKET_FRAME: One frame, as a fixed-width binary record of the schema
+    PACKET_CRASH: Nothing, the aircraft crashed
+
+The schema is sent when it changes and then every `schema_interval` seconds, so that receivers
+started late can decode frames. Receivers ignore frames until they have the matching schema.
+
+Addresses are `(host, port)` tuples for UDP and paths for Unix domain sockets.
+
+This module has no dependency on X-Plane.
+"""
+import os
+import json
+import stat
+import socket
+import struct
+
+from tlmformat import BinaryEncoder
+
+
+STREAM_MAGIC = b'XPLS'
+PACKET_HEADER = struct.Struct('<4sBHI') # magic, kind, schema ID, sequence number
+
+PACKET_SCHEMA = 0
+PACKET_FRAME = 1
+PACKET_CRASH = 2
+
+
+def _make_socket(address):
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+
+    return socket.socket(family, socket.SOCK_DGRAM)
+
+
+class StreamSender:
+    """Non-blocking, rate-limited sender of telemetry frames.
+
+    Sending never waits: frames that cannot be sent right away, or with no receiver listening,
+    are counted in `dropped` and discarded.
+    """
+
+    def __init__(self, address, max_rate=20, schema_interval=5):
+        """Create the sender.
+
+        Arguments:
+            address: The destination address
+            max_rate: Maximum number of frames sent per second (0 for no limit)
+            schema_interval: Interval between repetitions of the schema (s)
+        """
+        self.address = address
+        self.min_interval = 1 / max_rate if max_rate else 0
+        self.schema_interval = schema_interval
+        self.encoder = None
+        self.schema_id = 0
+        self.schema_packet = None
+        self.sequence = 0
+        self.last_frame_t = None # Time of the last frame sent
+        self.last_schema_t = None # Time the schema was last sent
+        self.sent = 0 # Number of packets sent
+        self.dropped = 0 # Number of packets that could not be sent
+        self.error = None # Last send error
+
+        self.socket = _make_socket(address)
+        self.socket.setblocking(False)
+
+    def set_schema(self, columns, icao):
+        """Start streaming frames of a new schema."""
+        self.encoder = BinaryEncoder(columns, icao)
+        self.schema_id = (self.schema_id + 1) % 0x10000
+        self.schema_packet = json.dumps(self.encoder.schema()).encode()
+        self.last_frame_t = None
+        self.last_schema_t = None
+
+    def publish(self, columns, slot):
+        """Send the frame in `slot` of the flat `columns` (see `tlmbuffer.FrameBuffer`), unless rate-limited."""
+        t = columns[0][slot]
+
+        if self.last_frame_t is not None and t - self.last_frame_t < self.min_interval:
+            return
+
+        if self.last_schema_t is None or t - self.last_schema_t >= self.schema_interval:
+            self.last_schema_t = t
+            self.send(PACKET_SCHEMA, self.schema_packet)
+
+        self.last_frame_t = t
+        self.send(PACKET_FRAME, self.encoder.record.pack(*[col[slot] for col in columns]))
+
+    def send(self, kind, payload=b''):
+        header = PACKET_HEADER.pack(STREAM_MAGIC, kind, self.schema_id, self.sequence)
+        self.sequence = (self.sequence + 1) & 0xffffffff
+
+        try:
+            self.socket.sendto(header + payload, self.address)
+            self.sent += 1
+        except OSError as exc:
+            # No receiver, or its buffer is full
+            self.dropped += 1
+            self.error = exc
+
+    def close(self):
+        self.socket.close()
+
+
+class StreamDecoder:
+    """Decoder of the packets of a stream (see `StreamSender`)."""
+
+    def __init__(self):
+        self.schema = None # Schema of the frames being received
+        self.schema_id = None
+        self.record = None # struct.Struct of the frames
+        self.sequence = None # Sequence number expected next
+        self.lost = 0 # Number of packets missing from the sequence
+
+    @property
+    def labels(self):
+        return [x['label'] for x in self.schema['columns']] if self.schema else []
+
+    @property
+    def columns(self):
+        """Schema as a list of `(label, type, length)`."""
+        if not self.schema:
+            return []
+
+        return [(x['label'], x['type'], x['length']) for x in self.schema['columns']]
+
+    def decode(self, packet):
+        """Decode a packet.
+
+        Return value:
+            A tuple of `(kind, record)` where `record` is the flat frame for frame packets and
+            None otherwise, or None if the packet is invalid or its schema is unknown.
+        """
+        if len(packet) < PACKET_HEADER.size:
+            return None
+
+        magic, kind, schema_id, sequence = PACKET_HEADER.unpack_from(packet)
+
+        if magic != STREAM_MAGIC:
+            return None
+
+        if self.sequence is not None and sequence != self.sequence:
+            self.lost += (sequence - self.sequence) & 0xffffffff
+
+        self.sequence = (sequence + 1) & 0xffffffff
+        payload = packet[PACKET_HEADER.size:]
+
+        if kind == PACKET_SCHEMA:
+            if schema_id != self.schema_id:
+                self.schema = json.loads(payload)
+                self.schema_id = schema_id
+                self.record = BinaryEncoder(self.columns, self.schema['icao']).record
+
+            return kind, None
+
+        if schema_id != self.schema_id:
+            return None
+
+        if kind == PACKET_FRAME:
+            if len(payload) != self.record.size:
+                return None
+
+            return kind, self.record.unpack(payload)
+
+        return kind, None
+
+
+def open_receiver(address):
+    """Return a socket bound to `address`, receiving the packets of a stream.
+
+    A Unix socket left behind by a previous receiver at the same path is replaced.
+    """
+    if isinstance(address, str) and os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+        os.unlink(address)
+
+    sock = _make_socket(address)
+    sock.bind(address)
+
+    return sock
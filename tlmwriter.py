@@ -0,0 +1,351 @@
+import os
+import json
+import time
+import threading
+
+from os import path
+from collections import deque
+from tlmformat import FILE_EXTENSIONS, COMPRESSION_EXTENSIONS, COMPRESSION_NONE, open_output
+
+
+POLICY_BLOCK = 'block' # Wait for the writer thread when the queue is full
+POLICY_DROP_OLDEST = 'drop_oldest' # Discard the oldest queued block when the queue is full
+
+MANIFEST_EXTENSION = '.manifest.json'
+INDEX_EXTENSION = '.idx' # Appended to the file name of a segment
+
+
+class TelemetryOutput:
+    """Telemetry output of a flight, optionally split into numbered segments.
+
+    When any of the rotation limits is set, the flight is written to segments named
+    `<prefix>.<number><ext>` and a new segment is started with the block following the one
+    that reaches a limit.
+    The manifest `<prefix>.manifest.json` lists the segments and the time range of each.
+    Files are opened on the first write, so that a flight with no frames leaves no file behind.
+
+    When indexing is enabled, each segment gets a sidecar index (`<segment>.idx`) with one JSON
+    line every `index_interval` frames, rounded up to a block. Each entry holds the time range,
+    raw file offset, first frame number and number of frames of the blocks it covers, as well as
+    the sampling phases active while they were recorded. Entries start at block boundaries, and
+    for compressed files at the start of a compressed stream, so that reading can start there.
+    """
+
+    def __init__(self, prefix, encoder, compression=COMPRESSION_NONE, fsync=True, max_bytes=0, max_frames=0, max_seconds=0, index_interval=0):
+        """Create the output.
+
+        Arguments:
+            prefix: The path of the flight, without extension
+            encoder: The encoder of the telemetry format (see `tlmformat.ENCODERS`)
+            compression: The compression of the files (see `tlmformat.COMPRESSION_*`)
+            fsync: True to sync the file to disk after each flush
+            max_bytes: Maximum number of encoded bytes per segment (0 to disable)
+            max_frames: Maximum number of frames per segment (0 to disable)
+            max_seconds: Maximum time span of the frames of a segment (0 to disable)
+            index_interval: Number of frames between index entries (0 to disable indexing)
+        """
+        self.prefix = prefix
+        self.encoder = encoder
+        self.compression = compression
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self.max_frames = max_frames
+        self.max_seconds = max_seconds
+        self.index_interval = index_interval
+        self.file = None
+        self.index_file = None
+        self.index_entry = None # Index entry being built
+        self.segments = [] # Manifest entries, the last one being the current segment
+        self.rotate = False # True if the next block starts a new segment
+
+    @property
+    def is_segmented(self):
+        return bool(self.max_bytes or self.max_frames or self.max_seconds)
+
+    @property
+    def manifest_path(self):
+        return self.prefix + MANIFEST_EXTENSION
+
+    def segment_path(self, n):
+        ext = FILE_EXTENSIONS[self.encoder.format] + COMPRESSION_EXTENSIONS[self.compression]
+
+        if self.is_segmented:
+            return '%s.%03d%s' % (self.prefix, n, ext)
+
+        return self.prefix + ext
+
+    def write_block(self, block, phases=()):
+        """Encode and write a block of frames.
+
+        Arguments:
+            block: The frames (see `tlmbuffer.FrameBuffer.take()`)
+            phases: The sampling phases active while the frames were recorded
+
+        Return value:
+            The number of encoded bytes written.
+        """
+        times = block[0]
+
+        if not times:
+            return 0
+
+        if self.rotate:
+            self.close_segment()
+
+        if not self.file:
+            self.open_segment()
+
+        segment = self.segments[-1]
+
+        if self.index_interval and self.index_entry is None:
+            self.index_entry = {
+                't_start': times[0],
+                't_end': None,
+                'offset': self.file.tell(),
+                'frame': segment['frames'],
+                'frames': 0,
+                'phases': []
+            }
+
+        data = self.encoder.encode(block)
+
+        self.file.write(data)
+
+        if self.index_entry:
+            self.index_block(times, phases)
+
+        segment['frames'] += len(times)
+        segment['bytes'] += len(data)
+        segment['t_end'] = times[-1]
+
+        if segment['t_start'] is None:
+            segment['t_start'] = times[0]
+
+        self.rotate = bool(
+            self.max_bytes and segment['bytes'] >= self.max_bytes
+            or self.max_frames and segment['frames'] >= self.max_frames
+            or self.max_seconds and segment['t_end'] - segment['t_start'] >= self.max_seconds
+        )
+
+        return len(data)
+
+    def write_raw(self, data):
+        """Write data as-is to the current segment."""
+        if not self.file:
+            self.open_segment()
+
+        self.file.write(data)
+
+    def index_block(self, times, phases):
+        entry = self.index_entry
+        entry['t_end'] = times[-1]
+        entry['frames'] += len(times)
+        entry['phases'].extend([x for x in phases if x not in entry['phases']])
+
+        if entry['frames'] >= self.index_interval:
+            self.write_index_entry()
+
+    def write_index_entry(self):
+        if self.index_entry:
+            print(json.dumps(self.index_entry), file=self.index_file)
+
+            self.index_entry = None
+
+    def flush(self):
+        if self.file:
+            self.file.flush()
+
+            if self.index_file:
+                self.index_file.flush()
+
+            if self.fsync:
+                os.fsync(self.file.fileno())
+
+    def checkpoint(self):
+        """Return the state of the output up to the data written so far.
+
+        Return value:
+            A dictionary with a copy of the manifest entries of the segments (see `write_manifest()`),
+            the compression of the files and the raw size of the current segment, or None if no
+            segment is open.
+        """
+        if not self.file:
+            return None
+
+        return {
+            'segments': [dict(x) for x in self.segments],
+            'compression': self.compression,
+            'offset': self.file.tell()
+        }
+
+    def open_segment(self):
+        file_path = self.segment_path(len(self.segments))
+
+        self.file = open_output(file_path, self.compression)
+        self.segments.append({
+            'file': path.basename(file_path),
+            'index': path.basename(file_path) + INDEX_EXTENSION if self.index_interval else None,
+            't_start': None,
+            't_end': None,
+            'frames': 0,
+            'bytes': 0
+        })
+
+        if self.index_interval:
+            self.index_file = open(file_path + INDEX_EXTENSION, 'w')
+
+        self.file.write(self.encoder.header())
+        self.write_manifest()
+
+    def close_segment(self):
+        if self.index_file:
+            self.write_index_entry()
+
+        self.flush()
+        self.file.close()
+        self.file = None
+
+        if self.index_file:
+            self.index_file.close()
+            self.index_file = None
+
+        self.rotate = False
+        self.write_manifest()
+
+    def write_manifest(self):
+        tmp_path = self.manifest_path + '.tmp'
+
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'icao': self.encoder.icao,
+                'format': self.encoder.format,
+                'compression': self.compression,
+                'segments': self.segments
+            }, f, indent=1)
+
+        os.replace(tmp_path, self.manifest_path)
+
+    def close(self):
+        if self.file:
+            self.close_segment()
+
+
+class AsyncWriter:
+    """Telemetry writer running on a dedicated thread.
+
+    Blocks of frames are queued by the flight loop and encoded, written and synced to disk by
+    the writer thread, so that no disk I/O happens on the sim's main thread.
+    Raw items (markers) are never dropped and are written in queue order.
+    """
+
+    def __init__(self, output, max_blocks=16, policy=POLICY_DROP_OLDEST, stats=None):
+        """Create the writer and start its thread.
+
+        Arguments:
+            output: The `TelemetryOutput` to write to. Ownership is transferred to the writer.
+            max_blocks: Maximum number of blocks waiting in the queue.
+            policy: What to do when the queue is full (`POLICY_BLOCK` or `POLICY_DROP_OLDEST`).
+            stats: Optional `tlmstats.TelemetryStats` receiving write durations and block sizes.
+        """
+        if policy not in (POLICY_BLOCK, POLICY_DROP_OLDEST):
+            raise ValueError('Invalid backpressure policy', policy)
+
+        self.output = output
+        self.max_blocks = max_blocks
+        self.policy = policy
+        self.stats = stats
+        self.dropped = 0 # Number of blocks discarded because the queue was full
+        self.errors = 0 # Number of batches of items that could not be written
+        self.n_blocks = 0 # Number of frame blocks in the queue
+        self.checkpoint = None # Output checkpoint after the last flush with no error so far (see `TelemetryOutput.checkpoint()`)
+
+        self._queue = deque() # Items of (is_raw, data)
+        self._cond = threading.Condition()
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name='telemetry-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, block, phases=()):
+        """Queue a block of frames for writing (see `TelemetryOutput.write_block()`)."""
+        with self._cond:
+            while self.n_blocks >= self.max_blocks:
+                if self.policy == POLICY_DROP_OLDEST:
+                    self._drop_oldest()
+                else:
+                    self._cond.wait()
+
+            self._queue.append((False, (block, phases)))
+            self.n_blocks += 1
+            self._cond.notify_all()
+
+    def write_raw(self, data):
+        """Queue data to be written as-is."""
+        with self._cond:
+            self._queue.append((True, data))
+            self._cond.notify_all()
+
+    def close(self):
+        """Write everything still in the queue, stop the thread and close the output."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+
+        self._thread.join()
+
+        try:
+            self.output.close()
+        except Exception as exc:
+            print('telemetry: Error closing telemetry output')
+            print(exc)
+
+        if self.dropped:
+            print('telemetry: Warning %d blocks were dropped because the writer could not keep up' % self.dropped)
+
+    def _drop_oldest(self):
+        for i, (is_raw, _) in enumerate(self._queue):
+            if not is_raw:
+                del self._queue[i]
+
+                self.n_blocks -= 1
+                self.dropped += 1
+
+                return
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closing:
+                    self._cond.wait()
+
+                if not self._queue:
+                    break
+
+                items = list(self._queue)
+                self._queue.clear()
+                self.n_blocks = 0
+                self._cond.notify_all()
+
+            stats = self.stats
+            start = time.perf_counter()
+
+            try:
+                for is_raw, data in items:
+                    if is_raw:
+                        self.output.write_raw(data)
+                    else:
+                        n_bytes = self.output.write_block(*data)
+
+                        if stats and n_bytes:
+                            stats.bytes.add(n_bytes)
+
+                self.output.flush()
+
+                if not self.errors:
+                    self.checkpoint = self.output.checkpoint()
+
+                if stats:
+                    stats.write.add(time.perf_counter() - start)
+            except Exception as exc:
+                self.errors += 1
+                print('telemetry: Error writing telemetry data')
+                print(exc)
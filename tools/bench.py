@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""Benchmark the telemetry and state manager hot paths outside the simulator.
+
+The plugins are run against the offline XPLM stand-in in tools/fakexplm, with an optional
+per-call latency to simulate the cost of dataref access in the simulator.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+import statistics
+
+from os import path
+
+TOOLS_FOLDER = path.dirname(path.abspath(__file__))
+REPO_FOLDER = path.dirname(TOOLS_FOLDER)
+
+sys.path[:0] = [path.join(TOOLS_FOLDER, 'fakexplm'), REPO_FOLDER]
+os.environ.setdefault('FAKE_XPLM_ROOT', tempfile.mkdtemp(prefix='xpl-bench-'))
+
+import XPLMDataAccess as data
+import XPLMPlanes as planes
+import XPLMProcessing as proc
+import XPLMUtilities as utils
+
+
+FF_A320_CONFIG = path.join(REPO_FOLDER, 'statemanager', 'ff-a320.csv')
+
+
+def make_aircraft(icao='BNCH'):
+    """Create a fake aircraft in the fake X-Plane folder and make it the user aircraft."""
+    acf_folder = path.join(utils.SYSTEM_PATH, 'Aircraft', 'Bench')
+    acf_path = path.join(acf_folder, 'bench.acf')
+
+    os.makedirs(acf_folder, exist_ok=True)
+
+    with open(acf_path, 'w') as f:
+        print('I\n1100 Version\nACF\nP acf/_ICAO %s' % icao, file=f)
+
+    planes.set_user_aircraft(acf_path)
+
+    return acf_path
+
+
+def wait_for_recording(p, timeout=5):
+    """Run the flight loop until the telemetry plugin has read the ACF file and opened its output."""
+    end = time.monotonic() + timeout
+
+    while not p.is_recording:
+        if time.monotonic() > end:
+            raise RuntimeError('Telemetry was not initialized')
+
+        proc.run_flight_loops()
+        time.sleep(0.001)
+
+
+def make_config(n, file_path):
+    """Write a state manager config of `n` synthetic datarefs of mixed types."""
+    types = ['int', 'float', 'int', 'float', 'double', 'float[8]', 'int[4]']
+
+    with open(file_path, 'w') as f:
+        for i in range(n):
+            print('bench/dref_%d,%s' % (i, types[i % len(types)]), file=f)
+
+
+def timed(func, n=1, between=None):
+    """Call `func` `n` times and return the duration of each call in seconds."""
+    durations = []
+
+    for _ in range(n):
+        if between:
+            between()
+
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+
+    return durations
+
+
+def report(name, durations, size=''):
+    durations = sorted(durations)
+    p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+
+    print('%-36s %8s %12.1f %12.1f %12.1f' % (
+        name,
+        size,
+        statistics.mean(durations) * 1e6,
+        statistics.median(durations) * 1e6,
+        p95 * 1e6
+    ))
+
+
+def print_header(title):
+    print()
+    print(title)
+    print('%-36s %8s %12s %12s %12s' % ('', 'size', 'mean [us]', 'median [us]', 'p95 [us]'))
+
+
+def make_interpreted_reader(p):
+    """Return the frame reading path used before frame readers were compiled, for comparison."""
+    dref_arrays = [[0] * dref_n if dref_n else None for _, _, dref_n, _, _ in p.drefs]
+
+    def read_dataref(dref_id, dref_type, dref_n, out=None):
+        params = [dref_id]
+
+        if dref_n:
+            params.append(dref_n)
+            params.append(out)
+
+        return p.DREF_READ[dref_type](*params)
+
+    def get_frame(slot):
+        columns = p.buffer.columns
+        prev = (slot - 1) % p.buffer.capacity
+        n = p.frame_count
+        p.frame_count = n + 1
+
+        columns[0][slot] = time.time()
+        i = 1
+
+        for (dref_id, dref_type, dref_n, divisor, deadband), out in zip(p.drefs, dref_arrays):
+            width = dref_n or 1
+
+            if n % divisor:
+                for k in range(i, i + width):
+                    columns[k][slot] = columns[k][prev]
+            elif dref_n:
+                read_dataref(dref_id, dref_type, dref_n, out)
+
+                for k, x in enumerate(out, i):
+                    held = columns[k][prev]
+                    columns[k][slot] = held if n and abs(x - held) <= deadband else x
+            else:
+                x = read_dataref(dref_id, dref_type, dref_n)
+                held = columns[i][prev]
+                columns[i][slot] = held if n and abs(x - held) <= deadband else x
+
+            i += width
+
+    return get_frame
+
+
+def bench_telemetry(args):
+    import PI_telemetry
+    import tlmformat
+
+    from tlmbuffer import FrameBuffer
+    from tlmstats import TelemetryStats
+
+    make_aircraft()
+
+    p = PI_telemetry.PythonInterface()
+    p.XPluginStart()
+    p.XPluginEnable()
+    wait_for_recording(p)
+
+    n_frames = args.frames
+    n_drefs = len(p.drefs)
+
+    print_header('Telemetry (%d datarefs, %d flat columns)' % (n_drefs, len(p.buffer.columns)))
+
+    def read_frame():
+        p.get_frame(p.buffer.append())
+
+    interpreted_get_frame = make_interpreted_reader(p)
+
+    calls = sum(data.calls.values())
+    report('get_frame', timed(read_frame, n_frames, data.next_frame), n_drefs)
+    print('%-36s %8s %12.1f' % ('XPLM calls per frame', '', (sum(data.calls.values()) - calls) / n_frames))
+    report('get_frame (interpreted)', timed(lambda: interpreted_get_frame(p.buffer.append()), n_frames, data.next_frame), n_drefs)
+
+    report('record_frame', timed(p.record_frame, n_frames, data.next_frame), n_drefs)
+
+    p.stats = TelemetryStats(p.STATS_INTERVAL)
+    p.stats.set_columns(p.header[1:])
+    p.compile_reader()
+    report('record_frame (stats enabled)', timed(p.record_frame, n_frames, data.next_frame), n_drefs)
+    p.stats = None
+    p.compile_reader()
+
+    def fill_buffer():
+        for _ in range(p.buffer.capacity):
+            read_frame()
+
+    report('flush_buffer (sim thread)', timed(p.flush_buffer, args.blocks, fill_buffer), p.buffer.capacity)
+
+    for fmt, encoder_class in tlmformat.ENCODERS.items():
+        encoder = encoder_class(p.columns, p.aircraft_icao)
+        fill_buffer()
+        block = p.buffer.take()
+
+        report('encode block (%s)' % fmt, timed(lambda: encoder.encode(block), args.blocks), p.buffer.capacity)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    buffer = FrameBuffer(p.columns, n_frames)
+    per_frame = (tracemalloc.get_traced_memory()[0] - before) / n_frames
+    tracemalloc.stop()
+
+    print('%-36s %8s %12.1f' % ('memory per buffered frame [bytes]', '', per_frame))
+
+    del buffer
+
+    p.XPluginDisable()
+
+
+def bench_state(args):
+    import PI_statemanager as sm
+    import smformat
+
+    from smresolve import DrefResolver
+
+    acf_path = make_aircraft()
+    tmp_folder = tempfile.mkdtemp(prefix='xpl-bench-state-')
+    configs = [('ff-a320.csv', FF_A320_CONFIG)]
+
+    for n in args.sizes:
+        config_path = path.join(tmp_folder, 'bench-%d.csv' % n)
+        make_config(n, config_path)
+        configs.append(('%d drefs' % n, config_path))
+
+    print_header('State manager')
+
+    for name, config_path in configs:
+        n_runs = args.runs
+
+        report('read_config_file', timed(lambda: smformat.read_config_file(config_path), n_runs), name)
+
+        def init_config():
+            p.acf_drefs = p.resolver.resolve(config_path, acf_path)
+            p.update_drefs()
+
+        p = sm.PythonInterface()
+        p.acf_file_path = acf_path
+        p._create_folders()
+
+        def new_session():
+            p.resolver = DrefResolver(data.XPLMFindDataRef, data.XPLMCanWriteDataRef, sm.DREF_CACHE_FILE)
+
+        report('load config (uncached)', timed(init_config, n_runs, p.resolver.clear), name)
+        report('load config (new session)', timed(init_config, n_runs, new_session), name)
+        report('load config (cached)', timed(init_config, n_runs), name)
+        report('save_aircraft_state', timed(lambda: p.save_aircraft_state('bench'), n_runs, data.next_frame), name)
+
+        state_path = p.get_aircraft_state_file('bench')
+        csv_path = p.get_aircraft_state_file('bench', smformat.STATE_FORMAT_CSV)
+        drefs = p.drefs
+        state = smformat.read_state(state_path, drefs)
+        smformat.write_state_csv(csv_path, state)
+
+        report('read_state_csv', timed(lambda: smformat.read_state_csv(csv_path, drefs), n_runs), name)
+        report('read_state_binary', timed(lambda: smformat.read_state_binary(state_path, drefs), n_runs), name)
+
+        steps = []
+
+        def apply_all():
+            applier = p.apply_state(state)
+
+            while True:
+                start = time.perf_counter()
+                more = applier.step()
+                steps.append(time.perf_counter() - start)
+
+                if not more:
+                    break
+
+        report('apply_state (all frames)', timed(apply_all, n_runs), name)
+        report('apply_state (per frame)', steps, name)
+
+        p.APPLY_ONLY_CHANGED = False
+        report('apply_state (write all)', timed(apply_all, n_runs), name)
+        del p.APPLY_ONLY_CHANGED
+        report('load_aircraft_state (uncached)', timed(lambda: p.load_aircraft_state('bench'), n_runs, p.state_cache.clear), name)
+        report('load_aircraft_state (cached)', timed(lambda: p.load_aircraft_state('bench'), n_runs), name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--latency', type=float, default=0, help='Latency of each XPLM call in microseconds')
+    parser.add_argument('--frames', type=int, default=2000, help='Number of telemetry frames to record')
+    parser.add_argument('--blocks', type=int, default=20, help='Number of telemetry blocks to flush and encode')
+    parser.add_argument('--runs', type=int, default=5, help='Number of runs of each state manager operation')
+    parser.add_argument('--sizes', type=int, nargs='*', default=[2000, 10000], help='Synthetic state manager config sizes')
+    parser.add_argument('--only', choices=['telemetry', 'state'], help='Only run one of the benchmarks')
+    args = parser.parse_args()
+
+    data.LATENCY = args.latency / 1e6
+
+    if args.only != 'state':
+        bench_telemetry(args)
+
+    if args.only != 'telemetry':
+        bench_state(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""Offline stand-in for XPLMDataAccess.
+
+Dataref values come from a source function `source(name, frame)` returning a scalar or, for
+array datarefs, a list. The default source produces deterministic synthetic values, and
+`replay()` replays a recorded telemetry log instead. Values written through the `XPLMSetData*`
+functions override the source, and datarefs registered by plugins are read through their
+accessors. `LATENCY` seconds are spent in every call to simulate the cost of crossing into the
+simulator, and every call is counted in `calls`.
+"""
+import math
+import time
+import zlib
+
+from collections import Counter
+
+
+xplmType_Unknown = 0
+xplmType_Int = 1
+xplmType_Float = 2
+xplmType_Double = 4
+xplmType_FloatArray = 8
+xplmType_IntArray = 16
+xplmType_Data = 32
+
+LATENCY = 0.0 # seconds spent in every call
+AUTO_CREATE = True # Create unknown datarefs on lookup, otherwise XPLMFindDataRef returns None
+ARRAY_LENGTH = 8 # Length of synthetic array datarefs
+
+calls = Counter() # Number of calls by function name
+frame = 0 # Current frame of the source
+
+_names = [] # Dataref names, the ID of a dataref is its index + 1
+_ids = {}
+_values = {} # Written values by ID
+_read_only = set() # Names of the datarefs that are not writable
+_accessors = {} # Tuples of (read callback, refcon) of plugin datarefs by ID
+
+
+def synthetic(name, frame):
+    """Default source: a sine wave with a phase depending on the dataref name."""
+    phase = zlib.crc32(name.encode()) % 1000 / 1000 * 2 * math.pi
+
+    return math.sin(frame / 100 + phase) * 100
+
+
+def _synthetic_array(name, frame):
+    return [synthetic('%s[%d]' % (name, k), frame) for k in range(ARRAY_LENGTH)]
+
+
+source = synthetic
+
+
+def set_source(func):
+    """Use `func(name, frame)` as the source of dataref values."""
+    global source
+
+    source = func
+
+
+def replay(file_path, names, loop=True):
+    """Replay a telemetry log, one record per frame.
+
+    Arguments:
+        file_path: The telemetry file (any format supported by `tlmformat.open_reader()`)
+        names: Dictionary mapping log labels to dataref names
+        loop: True to start over at the end of the log, otherwise the last record is repeated
+    """
+    from tlmformat import CRASH_TIME, open_reader
+
+    reader = open_reader(file_path)
+    records = [x for x in reader.records() if x[0] != CRASH_TIME]
+    slices = {}
+    i = 0
+
+    reader.close()
+
+    for label, _, col_length in reader.columns:
+        if label in names:
+            slices[names[label]] = slice(i, i + col_length) if col_length else i
+
+        i += col_length or 1
+
+    def replay_source(name, frame):
+        record = records[frame % len(records) if loop else min(frame, len(records) - 1)]
+        col = slices.get(name)
+
+        if col is None:
+            return synthetic(name, frame)
+
+        value = record[col]
+
+        return list(value) if isinstance(col, slice) else value
+
+    set_source(replay_source)
+
+
+def next_frame():
+    """Advance the source to the next frame."""
+    global frame
+
+    frame += 1
+
+
+def reset():
+    """Forget all datarefs, written values and call counts, and restore the synthetic source."""
+    global frame
+
+    frame = 0
+    _names.clear()
+    _ids.clear()
+    _values.clear()
+    _read_only.clear()
+    _accessors.clear()
+    calls.clear()
+    set_source(synthetic)
+
+
+def set_read_only(name):
+    _read_only.add(name)
+
+
+def _call(func_name):
+    calls[func_name] += 1
+
+    if LATENCY:
+        end = time.perf_counter() + LATENCY
+
+        while time.perf_counter() < end:
+            pass
+
+
+def _get(dref_id):
+    if dref_id in _accessors:
+        read, refcon = _accessors[dref_id]
+
+        return read(refcon) if read else 0
+
+    if dref_id in _values:
+        return _values[dref_id]
+
+    return source(_names[dref_id - 1], frame)
+
+
+def _get_array(dref_id, values, offset, count, convert=float):
+    value = _get(dref_id)
+
+    if not isinstance(value, (list, tuple, bytes)):
+        value = _synthetic_array(_names[dref_id - 1], frame)
+
+    if values is None:
+        return len(value)
+
+    n = max(0, min(count, len(value) - offset))
+
+    for k in range(n):
+        values[k] = convert(value[offset + k])
+
+    return n
+
+
+def _set_array(dref_id, values, offset, count):
+    value = _get(dref_id)
+    value = list(value) if isinstance(value, (list, tuple, bytes)) else [0] * (offset + count)
+    value[offset:offset + count] = values[:count]
+
+    _values[dref_id] = value
+
+
+def XPLMFindDataRef(name):
+    _call('XPLMFindDataRef')
+
+    if name not in _ids:
+        if not AUTO_CREATE:
+            return None
+
+        _names.append(name)
+        _ids[name] = len(_names)
+
+    return _ids[name]
+
+
+def XPLMRegisterDataAccessor(name, data_type, writable, read_int, write_int, read_float, write_float,
+                             read_double, write_double, read_int_array, write_int_array,
+                             read_float_array, write_float_array, read_data, write_data,
+                             read_refcon, write_refcon):
+    """Register a scalar plugin dataref. Array accessors are not supported."""
+    _call('XPLMRegisterDataAccessor')
+
+    dref_id = XPLMFindDataRef(name)
+    _accessors[dref_id] = (read_int or read_float or read_double, read_refcon)
+
+    if not writable:
+        set_read_only(name)
+
+    return dref_id
+
+
+def XPLMUnregisterDataAccessor(dref_id):
+    _call('XPLMUnregisterDataAccessor')
+
+    _accessors.pop(dref_id, None)
+
+
+def XPLMCanWriteDataRef(dref_id):
+    _call('XPLMCanWriteDataRef')
+
+    return int(dref_id is not None and _names[dref_id - 1] not in _read_only)
+
+
+def XPLMGetDatai(dref_id):
+    _call('XPLMGetDatai')
+
+    return int(_get(dref_id))
+
+
+def XPLMGetDataf(dref_id):
+    _call('XPLMGetDataf')
+
+    return float(_get(dref_id))
+
+
+def XPLMGetDatad(dref_id):
+    _call('XPLMGetDatad')
+
+    return float(_get(dref_id))
+
+
+def XPLMGetDatavi(dref_id, values, offset, count):
+    _call('XPLMGetDatavi')
+
+    return _get_array(dref_id, values, offset, count, int)
+
+
+def XPLMGetDatavf(dref_id, values, offset, count):
+    _call('XPLMGetDatavf')
+
+    return _get_array(dref_id, values, offset, count)
+
+
+def XPLMGetDatab(dref_id, values, offset, count):
+    _call('XPLMGetDatab')
+
+    return _get_array(dref_id, values, offset, count, lambda x: int(x) & 0xff)
+
+
+def XPLMSetDatai(dref_id, value):
+    _call('XPLMSetDatai')
+
+    _values[dref_id] = int(value)
+
+
+def XPLMSetDataf(dref_id, value):
+    _call('XPLMSetDataf')
+
+    _values[dref_id] = float(value)
+
+
+def XPLMSetDatad(dref_id, value):
+    _call('XPLMSetDatad')
+
+    _values[dref_id] = float(value)
+
+
+def XPLMSetDatavi(dref_id, values, offset, count):
+    _call('XPLMSetDatavi')
+    _set_array(dref_id, values, offset, count)
+
+
+def XPLMSetDatavf(dref_id, values, offset, count):
+    _call('XPLMSetDatavf')
+    _set_array(dref_id, values, offset, count)
+
+
+def XPLMSetDatab(dref_id, values, offset, count):
+    _call('XPLMSetDatab')
+    _set_array(dref_id, values, offset, count)
@@ -0,0 +1,21 @@
+"""Offline stand-in for XPLMMenus."""
+
+
+def XPLMDestroyMenu(menu_id):
+    pass
+
+
+def XPLMClearAllMenuItems(menu_id):
+    pass
+
+
+def XPLMAppendMenuSeparator(menu_id):
+    pass
+
+
+def XPLMSetMenuItemName(menu_id, index, name, force_english):
+    pass
+
+
+def XPLMEnableMenuItem(menu_id, index, enabled):
+    pass
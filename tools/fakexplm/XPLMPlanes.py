@@ -0,0 +1,16 @@
+"""Offline stand-in for XPLMPlanes."""
+XPLM_USER_AIRCRAFT = 0
+
+user_aircraft_path = '' # Path of the user aircraft's .acf file, empty when no aircraft is loaded
+
+
+def set_user_aircraft(acf_path):
+    global user_aircraft_path
+
+    user_aircraft_path = acf_path
+
+
+def XPLMGetNthAircraftModel(index):
+    acf_path = user_aircraft_path if index == XPLM_USER_AIRCRAFT else ''
+
+    return acf_path.replace('\\', '/').split('/')[-1], acf_path
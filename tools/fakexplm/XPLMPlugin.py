@@ -0,0 +1,9 @@
+"""Offline stand-in for XPLMPlugin."""
+XPLM_MSG_PLANE_CRASHED = 101
+XPLM_MSG_PLANE_LOADED = 102
+XPLM_MSG_AIRPORT_LOADED = 103
+XPLM_MSG_SCENERY_LOADED = 104
+XPLM_MSG_AIRPLANE_COUNT_CHANGED = 105
+XPLM_MSG_PLANE_UNLOADED = 106
+XPLM_MSG_WILL_WRITE_PREFS = 107
+XPLM_MSG_LIVERY_LOADED = 108
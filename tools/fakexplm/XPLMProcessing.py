@@ -0,0 +1,36 @@
+"""Offline stand-in for XPLMProcessing.
+
+Registered flight loop callbacks are kept in `callbacks` and run by `run_flight_loops()`.
+"""
+import time
+
+
+callbacks = {} # Next call time by (callback, refcon)
+
+_start = time.monotonic()
+
+
+def XPLMGetElapsedTime():
+    return time.monotonic() - _start
+
+
+def XPLMRegisterFlightLoopCallback(callback, interval, refcon):
+    callbacks[(callback, refcon)] = interval
+
+
+def XPLMUnregisterFlightLoopCallback(callback, refcon):
+    callbacks.pop((callback, refcon), None)
+
+
+def XPLMSetFlightLoopCallbackInterval(callback, interval, relative_to_now, refcon):
+    callbacks[(callback, refcon)] = interval
+
+
+def run_flight_loops(n=1):
+    """Call every registered callback `n` times, ignoring the requested intervals."""
+    for counter in range(n):
+        for callback, refcon in list(callbacks):
+            interval = callback(0, 0, counter, refcon)
+
+            if (callback, refcon) in callbacks:
+                callbacks[(callback, refcon)] = interval
@@ -0,0 +1,14 @@
+"""Offline stand-in for XPLMUtilities.
+
+The system path is taken from the `FAKE_XPLM_ROOT` environment variable, or is a new temporary
+folder. It must be set before the plugins are imported.
+"""
+import os
+import tempfile
+
+
+SYSTEM_PATH = os.environ.get('FAKE_XPLM_ROOT') or tempfile.mkdtemp(prefix='fakexplm-')
+
+
+def XPLMGetSystemPath():
+    return os.path.join(SYSTEM_PATH, '')
@@ -0,0 +1,12 @@
+"""Offline stand-in for the XPPython3 `xp` module."""
+_next_id = [0]
+
+
+def createMenu(name, parent_menu, parent_item, handler, refcon):
+    _next_id[0] += 1
+
+    return _next_id[0]
+
+
+def appendMenuItem(menu_id, name, refcon):
+    return refcon
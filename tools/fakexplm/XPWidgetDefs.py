@@ -0,0 +1,9 @@
+"""Offline stand-in for XPWidgetDefs. Every constant gets a distinct integer value."""
+_constants = {}
+
+
+def __getattr__(name):
+    if name.startswith('xp'):
+        return _constants.setdefault(name, len(_constants) + 1)
+
+    raise AttributeError(name)
@@ -0,0 +1,25 @@
+"""Offline stand-in for XPWidgets. Widgets are only given IDs and geometries, nothing is drawn."""
+_next_id = [0]
+_geometries = {} # Tuples of (left, top, right, bottom) by widget ID
+
+
+def XPCreateWidget(left, top, right, bottom, visible, descriptor, is_root, container, class_):
+    _next_id[0] += 1
+    _geometries[_next_id[0]] = (left, top, right, bottom)
+
+    return _next_id[0]
+
+
+def XPGetWidgetGeometry(widget_id):
+    return _geometries.get(widget_id, (0, 0, 0, 0))
+
+
+def XPSetWidgetGeometry(widget_id, left, top, right, bottom):
+    _geometries[widget_id] = (left, top, right, bottom)
+
+
+def __getattr__(name):
+    if name.startswith('XP'):
+        return lambda *args: None
+
+    raise AttributeError(name)
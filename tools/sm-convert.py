@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Convert aircraft states between the CSV and binary formats of the state manager.
+
+CSV states are converted to binary and binary states to CSV. The types of the datarefs of a CSV
+state are taken from the state manager configs, which are required to convert to binary.
+"""
+import sys
+import argparse
+
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from smformat import (STATE_FORMAT_CSV, STATE_FORMAT_BINARY, STATE_EXTENSIONS, read_config_file, read_state,
+                      state_format, write_state)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('paths', nargs='+', help='State files')
+    parser.add_argument('-c', '--config', action='append', default=[],
+                        help='State manager config (statemanager.csv), can be repeated; later configs override earlier ones')
+    parser.add_argument('-o', '--output-dir', help='Output folder (default: next to the state)')
+    args = parser.parse_args()
+
+    dref_db = {}
+
+    for config_path in args.config:
+        dref_db.update(read_config_file(config_path))
+
+    for file_path in args.paths:
+        src_format = state_format(file_path)
+
+        if src_format is None:
+            print('Skipping %s: unknown state format' % file_path)
+
+            continue
+
+        if src_format == STATE_FORMAT_CSV and not dref_db:
+            print('Skipping %s: converting a CSV state requires a config' % file_path)
+
+            continue
+
+        dst_format = STATE_FORMAT_BINARY if src_format == STATE_FORMAT_CSV else STATE_FORMAT_CSV
+        dst_path = file_path[:-len(STATE_EXTENSIONS[src_format])] + STATE_EXTENSIONS[dst_format]
+
+        if args.output_dir:
+            dst_path = path.join(args.output_dir, path.basename(dst_path))
+
+        try:
+            # Binary states hold their own types, so the config only filters them when given
+            state = read_state(file_path, dref_db if dref_db else None)
+            write_state(dst_path, state, dref_db)
+        except (OSError, ValueError) as exc:
+            print('Skipping %s: %s' % (file_path, exc))
+
+            continue
+
+        print('%s: %d datarefs' % (dst_path, len(state)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""Compute flight metrics from telemetry logs. Requires NumPy."""
+import sys
+import json
+import argparse
+
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from tlmanalysis import analyze, analyze_folder
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('paths', nargs='+', help='Telemetry files, flight manifests or telemetry folders')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of worker processes for folders (defaults to the number of CPUs)')
+    args = parser.parse_args()
+
+    for log_path in args.paths:
+        if path.isdir(log_path):
+            results = analyze_folder(log_path, args.jobs)
+        else:
+            results = [analyze(log_path)]
+
+        for summary in results:
+            print(json.dumps(summary))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""Export telemetry logs as simplified GPX, KML or GeoJSON tracks. Requires NumPy."""
+import sys
+import json
+import argparse
+
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from tlmgis import GIS_EXTENSIONS, GIS_GEOJSON, DEFAULT_TOLERANCE, export, export_folder
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('paths', nargs='+', help='Telemetry files, flight manifests or telemetry folders')
+    parser.add_argument('-f', '--format', choices=sorted(GIS_EXTENSIONS), default=GIS_GEOJSON, help='Track format')
+    parser.add_argument('-t', '--tolerance', type=float, default=DEFAULT_TOLERANCE, help='Simplification tolerance in meters (0 to keep every point)')
+    parser.add_argument('-o', '--output-dir', help='Output folder (defaults to the folder of each log)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of worker processes for folders (defaults to the number of CPUs)')
+    args = parser.parse_args()
+
+    for log_path in args.paths:
+        if path.isdir(log_path):
+            results = export_folder(log_path, args.format, args.tolerance, args.output_dir, args.jobs)
+        else:
+            results = [export(log_path, args.format, args.tolerance, args.output_dir)]
+
+        for result in results:
+            print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Receive live telemetry streamed by the telemetry plugin and print it as CSV."""
+import os
+import sys
+import argparse
+
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from tlmformat import CsvEncoder
+from tlmstream import PACKET_SCHEMA, PACKET_FRAME, PACKET_CRASH, StreamDecoder, open_receiver
+
+
+MAX_PACKET_SIZE = 65536
+
+
+def parse_address(address):
+    """Return a Unix socket path as is, and `host:port` as a tuple."""
+    if ':' not in address:
+        return address
+
+    host, port = address.rsplit(':', 1)
+
+    return host, int(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('address', help='UDP address as host:port, or Unix socket path')
+    parser.add_argument('-n', '--count', type=int, default=0, help='Exit after this many frames (0 to run until interrupted)')
+    args = parser.parse_args()
+
+    address = parse_address(args.address)
+    decoder = StreamDecoder()
+    encoder = None
+    n_frames = 0
+    sock = open_receiver(address)
+
+    try:
+        while not args.count or n_frames < args.count:
+            result = decoder.decode(sock.recv(MAX_PACKET_SIZE))
+
+            if result is None:
+                continue
+
+            kind, record = result
+
+            if kind == PACKET_SCHEMA and (encoder is None or encoder.columns != decoder.columns):
+                encoder = CsvEncoder(decoder.columns, decoder.schema['icao'])
+                sys.stdout.write(encoder.header().decode())
+            elif kind == PACKET_FRAME:
+                sys.stdout.write(encoder.encode_rows([record]).decode())
+                n_frames += 1
+            elif kind == PACKET_CRASH:
+                print('# Crash')
+
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+
+        if isinstance(address, str):
+            os.unlink(address)
+
+    if decoder.lost:
+        print('# %d packets lost' % decoder.lost, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
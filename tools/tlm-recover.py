@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""Recover the telemetry logs of flights interrupted by a crash of X-Plane from their journals."""
+import sys
+import argparse
+
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from tlmjournal import recover_journal, find_journals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('paths', nargs='+', help='Journal files, or telemetry folders to search for journals')
+    parser.add_argument('-k', '--keep', action='store_true', help='Keep the journals after recovering the logs')
+    parser.add_argument('-f', '--force', action='store_true', help='Replace logs holding more frames than their journal')
+    args = parser.parse_args()
+
+    journals = []
+
+    for x in args.paths:
+        journals.extend(find_journals(x) if path.isdir(x) else [x])
+
+    if not journals:
+        print('No journal found')
+
+    for file_path in journals:
+        try:
+            result = recover_journal(file_path, remove=not args.keep, force=args.force)
+        except (OSError, ValueError) as exc:
+            print('Skipping %s: %s' % (file_path, exc))
+
+            continue
+
+        print('%s: %d frames%s%s' % (
+            result['file'] or result['manifest'],
+            result['frames'],
+            ', crashed' if result['crashed'] else '',
+            ', %d bytes of incomplete blocks discarded' % result['truncated'] if result['truncated'] else ''
+        ))
+
+
+if __name__ == '__main__':
+    main()
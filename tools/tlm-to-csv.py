@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""Convert binary, sparse CSV and compressed telemetry files into the CSV format."""
+import io
+import sys
+import shutil
+import argparse
+
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from tlmformat import (
+    FORMAT_CSV, FORMAT_SPARSE_CSV, binary_to_csv, sparse_to_csv, open_log, split_log_path
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('files', nargs='+', help='Telemetry files, optionally compressed (.gz, .xz, .bz2)')
+    parser.add_argument('-o', '--output-dir', help='Output folder (defaults to the folder of each input file)')
+    args = parser.parse_args()
+
+    for src_path in args.files:
+        base_path, fmt, _ = split_log_path(src_path)
+
+        if fmt is None:
+            print('Skipping %s: unknown format' % src_path)
+
+            continue
+
+        dst_path = base_path + '.csv'
+
+        if args.output_dir:
+            dst_path = path.join(args.output_dir, path.basename(dst_path))
+
+        if dst_path == src_path:
+            print('Skipping %s: already a CSV file' % src_path)
+
+            continue
+
+        with open_log(src_path) as src, open(dst_path, 'w') as dst:
+            if fmt == FORMAT_CSV:
+                shutil.copyfileobj(io.TextIOWrapper(src), dst)
+            elif fmt == FORMAT_SPARSE_CSV:
+                sparse_to_csv(io.TextIOWrapper(src), dst)
+            else:
+                binary_to_csv(src, dst)
+
+        print(dst_path)
+
+
+if __name__ == '__main__':
+    main()